@@ -1,15 +1,26 @@
 import configparser
+import functools
 import json
 import os
-import pickle
-from flask import Flask, render_template
+import time
+from flask import Flask, Response, abort, request
+from flask import render_template as flask_render_template
 from flask_bootstrap import Bootstrap
 
-from fantasy_enums import GameOutcome
+from league_storage import league_filename
+from league_store import LeagueStore, WatchedJsonFile
+from memory_usage import MEMORY_FIELDS, process_memory
+from metrics import (RequestMetrics, add_phase, escape_label, finish_request, metric, set_cache_status, start_request,
+                     timed_build, timed_render, worker_label)
+from standings import ODDS_FILENAME, SNAPSHOT_FILENAME
+from web_cache import ResponseCache, build_version, conditional_response
 
 config = configparser.ConfigParser()
 dir_path = os.path.dirname(os.path.realpath(__file__))
-config.read(f"{dir_path}/config.ini")
+# Where config.ini and the data written by update_league.py are. RECORDS_DATA_DIR points the site at somewhere else,
+# EG a synthetic league to benchmark against (see benchmark.py)
+data_path = os.environ.get("RECORDS_DATA_DIR", dir_path)
+config.read(f"{data_path}/config.ini")
 
 S2 = config["ESPN"]["s2"]
 SWID = config["ESPN"]["swid"]
@@ -19,44 +30,105 @@ LEAGUE_NAME = config["WEBSITE"]["league_name"].replace('"', '')
 LEAGUE_ABBREVIATION = config["WEBSITE"]["league_abbreviation"].replace('"', '')
 MEET_THE_MANAGERS_ASSETS = os.path.join("static/meet_the_managers")
 MANAGER_BIOS_PATH = os.path.join(MEET_THE_MANAGERS_ASSETS, "manager_bios.json")
-
-league_pickle_filename = f"{dir_path}/{LEAGUE_NAME}.pickle"
-if os.path.exists(league_pickle_filename):
-    with open(league_pickle_filename, "rb") as f:
-        fantasy_league = pickle.load(f)
-else:
-    print(f"Could not find pickled league instance at {league_pickle_filename}")
-    exit(1)
-    
-snapshot_json_filename = f"{dir_path}/Playoff Snapshot.json"
-if os.path.exists(snapshot_json_filename):
-    with open(snapshot_json_filename, "r") as f:
-        standings_snapshot = json.load(f)
-else:
-    print(f"Could not find the regular season snapshot list at {snapshot_json_filename}")
-    exit(1)
+# Written by optimize_images.py, which makes smaller WebP and JPEG copies of the manager images
+MANAGER_IMAGES_MANIFEST_PATH = os.path.join(MEET_THE_MANAGERS_ASSETS, "optimized", "manifest.json")
+# How wide the manager images are shown (see meet_the_managers.css), so browsers can pick which copy to download
+MANAGER_IMAGE_SIZES = "(min-width: 1008px) 33vw, 100vw"
+
+# How often, in seconds, to check whether update_league.py has written new data. 0 disables reloading
+RELOAD_INTERVAL = config["WEBSITE"].getfloat("reload_interval", fallback=60)
+# How long, in seconds, clients and proxies may reuse an API response before revalidating it
+CACHE_MAX_AGE = config["WEBSITE"].getint("cache_max_age", fallback=60)
+# How many rendered pages and API responses to keep in memory, per worker. 0 disables the cache
+RESPONSE_CACHE_SIZE = config["WEBSITE"].getint("response_cache_size", fallback=128)
+
+# How update_league.py stores the league, either "pickle" or "sqlite"
+STORAGE = config["WEBSITE"].get("storage", fallback="pickle")
+
+league_storage_filename = league_filename(data_path, LEAGUE_NAME, STORAGE)
+snapshot_json_filename = os.path.join(data_path, SNAPSHOT_FILENAME)
+# Written by update_league.py next to the snapshot, unless there wasn't enough data to simulate the season with
+playoff_odds_json_filename = os.path.join(data_path, ODDS_FILENAME)
+
+# Nothing is loaded until preload_data() is called (or, failing that, the first request comes in), so that importing
+# the app stays cheap for tools that only need part of it
+league_store = LeagueStore(league_storage_filename, snapshot_json_filename, RELOAD_INTERVAL)
+
+# Responses are built from the data and from the code and templates here, so both go into their version. Hashing
+# the code means a deploy changes every ETag, without clients having to wait for new data to stop reusing old pages
+BUILD_VERSION = build_version(dir_path)
+
+# Rendered pages and API responses only change when the data (or the build) does, so keep them until it does
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+# The bios and images change even less, so only read them again when their files change
+manager_bios = WatchedJsonFile(MANAGER_BIOS_PATH, default={})
+manager_images = WatchedJsonFile(MANAGER_IMAGES_MANIFEST_PATH, default={})
+playoff_odds = WatchedJsonFile(playoff_odds_json_filename, default={})
+
+# How long each phase of each route takes, for the Server-Timing header and /metrics
+request_metrics = RequestMetrics()
 
 app = Flask(__name__)
 Bootstrap(app)
-SORTED_MANAGERS = sorted(member.name for member in fantasy_league.members)
-
-
-def format_member_for_display(member_obj, affected_by_tenure=False):
-    # Member was a founding member of the league and is still active
-    if member_obj.joined_year == fantasy_league.founded_year and member_obj.left_year == fantasy_league.active_year:
-        return member_obj.name
-    # If there is a reason to note that a member joined late or left early, do so
-    if affected_by_tenure:
-        # Member was a founding member of the league but is no longer active
-        if member_obj.joined_year == fantasy_league.founded_year and member_obj.left_year < fantasy_league.active_year:
-            return f"{member_obj.name}\N{ASTERISK} (Left {member_obj.left_year})"
-        # Member joined the league after it was founded, but is still active
-        elif member_obj.left_year == fantasy_league.active_year:
-            return f"{member_obj.name}\N{ASTERISK} (Joined {member_obj.joined_year})"
-        # Member joined the league after it was founded, and is no longer active
-        return f"{member_obj.name}\N{ASTERISK} ({member_obj.joined_year} - {member_obj.left_year})"
-    # Otherwise just return their name
-    return member_obj.name
+# Every page renders through this, so loading and compiling its template is timed as rendering it, not as the data
+render_template = timed_render(flask_render_template)
+
+
+def preload_data():
+    """Loads the data (and builds every leaderboard) up front so that no request pays for it. wsgi.py does this in the
+    uWSGI master process before the workers are forked, so they all share this one copy of it"""
+    if not os.path.exists(league_storage_filename):
+        print(f"Could not find stored league instance at {league_storage_filename}")
+        exit(1)
+    if not os.path.exists(snapshot_json_filename):
+        print(f"Could not find the regular season snapshot list at {snapshot_json_filename}")
+        exit(1)
+    league_store.preload()
+
+
+def current_record_book():
+    """Returns the record book for the current data, which is swapped out in the background when new data is written"""
+    return league_store.get().record_book
+
+
+def cache_key(watched_files):
+    """Gets the key a response is cached under: its path, along with the version of each WatchedJsonFile it uses, so
+    that it (and its ETag) changes whenever any of them do"""
+    if not watched_files:
+        return request.path
+    return f"{request.path}@{'-'.join(str(watched_file.version()) for watched_file in watched_files)}"
+
+
+def api_response(build, *watched_files):
+    """Returns whatever build makes from the current record book as JSON. Clients that already have it for the
+    current data version, and the current version of any WatchedJsonFiles it uses, get a 304 Not Modified without it
+    being built"""
+    data = league_store.get()
+
+    def build_body():
+        built = build(data.record_book)
+        start = time.perf_counter()
+        body = json.dumps(built).encode()
+        add_phase("render", time.perf_counter() - start)
+        return body
+
+    set_cache_status("hit")
+    return conditional_response(f"{BUILD_VERSION}-{data.version}", cache_key(watched_files),
+                                timed_build(build_body), "application/json", CACHE_MAX_AGE, response_cache)
+
+
+def cached_page(*watched_files):
+    """Serves a page's rendered HTML from memory until the data, or any of the WatchedJsonFiles it uses, changes"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            data = league_store.get()
+            set_cache_status("hit")
+            return conditional_response(f"{BUILD_VERSION}-{data.version}", cache_key(watched_files),
+                                        timed_build(lambda: view(*args, **kwargs).encode()), "text/html",
+                                        CACHE_MAX_AGE, response_cache)
+        return wrapper
+    return decorator
 
 
 @app.context_processor
@@ -64,267 +136,364 @@ def handle_context():
     return dict(os=os)
 
 
+@app.before_request
+def handle_request_start():
+    start_request()
+
+
+@app.after_request
+def handle_request_end(response):
+    route = request.url_rule.rule if request.url_rule is not None else None
+    return finish_request(response, route, request_metrics)
+
+
+# Prometheus metrics for this worker: how long each route takes, the data it is serving, and its response cache. Each
+# worker keeps its own, so every series is labelled with the worker it came from
+@app.route("/metrics")
+def metrics():
+    data = league_store.get()
+    worker = worker_label()
+    lines = request_metrics.exposition(worker)
+    lines += metric("records_data_info", "gauge", "Version of the data being served", 1,
+                    f'{worker},version="{escape_label(data.version)}"')
+    lines += metric("records_data_load_seconds", "gauge", "Seconds it took to load the league and snapshot files",
+                    data.load_seconds, worker)
+    lines += metric("records_data_loaded_timestamp_seconds", "gauge", "When the data being served was loaded",
+                    data.loaded_at, worker)
+    lines += metric("records_response_cache_hits_total", "counter", "Responses served from the cache",
+                    response_cache.hits, worker)
+    lines += metric("records_response_cache_misses_total", "counter", "Responses that had to be built",
+                    response_cache.misses, worker)
+    lines += metric("records_response_cache_entries", "gauge", "Responses in the cache", len(response_cache.entries),
+                    worker)
+    memory = process_memory()
+    if memory is not None:
+        lines += ["# HELP records_process_memory_bytes Resident memory of this worker, from /proc/self/smaps_rollup",
+                  "# TYPE records_process_memory_bytes gauge"]
+        lines += [f'records_process_memory_bytes{{{worker},field="{field}"}} {memory.get(field, 0) * 1024}'
+                  for field in MEMORY_FIELDS]
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/")
+@cached_page()
 def index():
+    record_book = current_record_book()
     return render_template("index.html",
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Home",
                            welcome_message=f"Welcome to the {LEAGUE_NAME} online record book",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/snapshot")
+@cached_page(playoff_odds)
 def snapshot():
+    record_book = current_record_book()
     return render_template('snapshot.html',
                            title_prefix=LEAGUE_ABBREVIATION,
-                           records=standings_snapshot[:len(list(fantasy_league.teams_in_active_year()))],
+                           records=record_book.snapshot,
                            record_name="Current playoff snapshot",
-                           seeds=standings_snapshot,
-                           members=SORTED_MANAGERS)
+                           seeds=record_book.standings_snapshot,
+                           odds=playoff_odds.get().get("odds", {}),
+                           simulations=playoff_odds.get().get("simulations"),
+                           members=record_book.sorted_managers)
 
 
 @app.route("/championships")
+@cached_page()
 def championships():
-    records = [{"member": format_member_for_display(member, affected_by_tenure=True),
-                "value": member.championship_wins(), }
-               for member in
-               sorted(fantasy_league.members_with_championship(), key=lambda member: member.championship_wins(), reverse=True)]
+    record_book = current_record_book()
     return render_template("table_minimal.html",
-                           records=records,
+                           records=record_book.tables["championships"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Championships",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/total_regular_season_points")
+@cached_page()
 def total_regular_season_points():
-    records = [{"member": format_member_for_display(member, affected_by_tenure=True),
-                "value": member.regular_season_points(),
-                "average": member.regular_season_average_points(), }
-               for member in sorted((member for member in fantasy_league.members), key=lambda member: member.regular_season_points(), reverse=True)]
+    record_book = current_record_book()
     return render_template("table_with_average.html",
-                           records=records,
+                           records=record_book.tables["total_regular_season_points"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="All time regular season points",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/total_playoff_points")
+@cached_page()
 def total_playoff_points():
-    records = [{"member": format_member_for_display(member, affected_by_tenure=True),
-                "value": member.playoff_points(),
-                "average": member.playoff_average_points(), }
-               for member in
-               sorted((member for member in fantasy_league.members_with_playoff_appearances()), key=lambda member: member.playoff_points(), reverse=True)]
+    record_book = current_record_book()
     return render_template("table_with_average.html",
-                           records=records,
+                           records=record_book.tables["total_playoff_points"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="All time playoff points",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/win_percent")
+@cached_page()
 def win_percents():
-    records = [{"member": format_member_for_display(member),
-                "value": member.regular_season_win_percentage(), }
-               for member in
-               sorted(fantasy_league.members, key=lambda member: member.regular_season_win_percentage(), reverse=True)]
+    record_book = current_record_book()
     return render_template("table_minimal.html",
-                           records=records,
+                           records=record_book.tables["win_percent"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Win percentage",
                            percent="%",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/playoff_appearances")
+@cached_page()
 def playoff_appearances():
-    records = [{"member": format_member_for_display(member, affected_by_tenure=True),
-                "value": member.playoff_appearances(), }
-               for member in sorted((member for member in fantasy_league.members if member.playoff_appearances()),
-                                    key=lambda member: member.playoff_appearances(), reverse=True)]
+    record_book = current_record_book()
     return render_template("table_minimal.html",
-                           records=records,
+                           records=record_book.tables["playoff_appearances"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Playoff appearances",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/highest_regular_season")
+@cached_page()
 def highest_regular_seasons():
-    records = [{"member": format_member_for_display(team.member),
-                "team": team.name,
-                "value": team.regular_season_points_scored(),
-                "year": team.year, }
-               for team in fantasy_league.teams_by_regular_season_points_for()[:10]]
+    record_book = current_record_book()
     return render_template("table_no_week.html",
-                           records=records,
+                           records=record_book.tables["highest_regular_season"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Most points in one season",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/lowest_regular_season")
+@cached_page()
 def lowest_regular_seasons():
-    records = [{"member": format_member_for_display(team.member),
-                "team": team.name,
-                "value": team.regular_season_points_scored(),
-                "year": team.year, }
-               for team in fantasy_league.teams_by_regular_season_points_for(exclude_current=True)[:-10:-1]]
+    record_book = current_record_book()
     return render_template("table_no_week.html",
-                           records=records,
+                           records=record_book.tables["lowest_regular_season"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Least points in one season",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/best_defense")
+@cached_page()
 def best_defenses():
-    records = [{"member": format_member_for_display(team.member),
-                "team": team.name,
-                "value": team.regular_season_points_against(),
-                "year": team.year, }
-               for team in fantasy_league.teams_by_regular_season_points_against(exclude_current=True)[:-10:-1]]
+    record_book = current_record_book()
     return render_template("table_no_week.html",
-                           records=records,
+                           records=record_book.tables["best_defense"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Least points against in one season",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/worst_defense")
+@cached_page()
 def worst_defenses():
-    records = [{"member": format_member_for_display(team.member),
-                "team": team.name,
-                "value": team.regular_season_points_against(),
-                "year": team.year, }
-               for team in fantasy_league.teams_by_regular_season_points_against()[:10]]
+    record_book = current_record_book()
     return render_template("table_no_week.html",
-                           records=records,
+                           records=record_book.tables["worst_defense"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Most points against in one season",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/highest_week")
+@cached_page()
 def highest_weeks():
-    records = [{"member": format_member_for_display(matchup.team.member),
-                "team": matchup.team.name,
-                "value": matchup.points_for,
-                "week": matchup.week,
-                "year": matchup.team.year, }
-               for matchup in fantasy_league.matchups_by_points_for()[:10]]
+    record_book = current_record_book()
     return render_template("table_full.html",
-                           records=records,
+                           records=record_book.tables["highest_week"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Most points in one week",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/lowest_week")
+@cached_page()
 def lowest_weeks():
-    records = [{"member": format_member_for_display(matchup.team.member),
-                "team": matchup.team.name,
-                "value": matchup.points_for,
-                "week": matchup.week,
-                "year": matchup.team.year, }
-               for matchup in fantasy_league.matchups_by_points_for()[:-10:-1]]
+    record_book = current_record_book()
     return render_template("table_full.html",
-                           records=records,
+                           records=record_book.tables["lowest_week"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Least points in one week",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/lowest_win")
+@cached_page()
 def lowest_wins():
-    matchups = sorted((matchup for matchup in fantasy_league.matchup_superset() if matchup.outcome == GameOutcome.WIN),
-                      key=lambda matchup: matchup.points_for)
-    records = [{"member": format_member_for_display(matchup.team.member),
-                "team": matchup.team.name,
-                "value": matchup.points_for,
-                "week": matchup.week,
-                "year": matchup.team.year}
-               for matchup in matchups][:10]
+    record_book = current_record_book()
     return render_template("table_full.html",
-                           records=records,
+                           records=record_book.tables["lowest_win"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Least points that still won",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/highest_loss")
+@cached_page()
 def highest_losses():
-    matchups = sorted((matchup for matchup in fantasy_league.matchup_superset() if matchup.outcome == GameOutcome.LOSS),
-                      key=lambda matchup: matchup.points_for, reverse=True)
-    records = [{"member": format_member_for_display(matchup.team.member),
-                "team": matchup.team.name,
-                "value": matchup.points_for,
-                "week": matchup.week,
-                "year": matchup.team.year}
-               for matchup in matchups][:10]
+    record_book = current_record_book()
     return render_template("table_full.html",
-                           records=records,
+                           records=record_book.tables["highest_loss"],
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name="Most points that still lost",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
+
+
+@app.route("/points_left_on_bench")
+@cached_page()
+def points_left_on_bench():
+    record_book = current_record_book()
+    return render_template("table_full.html",
+                           records=record_book.tables["points_left_on_bench"],
+                           title_prefix=LEAGUE_ABBREVIATION,
+                           record_name="Most points left on the bench in one week",
+                           members=record_book.sorted_managers)
+
+
+@app.route("/season_points_left_on_bench")
+@cached_page()
+def season_points_left_on_bench():
+    record_book = current_record_book()
+    return render_template("table_efficiency.html",
+                           records=record_book.tables["season_points_left_on_bench"],
+                           title_prefix=LEAGUE_ABBREVIATION,
+                           record_name="Most points left on the bench in one season",
+                           seasons=True,
+                           value_name="Points Left on Bench",
+                           members=record_book.sorted_managers)
+
+
+@app.route("/best_season_efficiency")
+@cached_page()
+def best_season_efficiencies():
+    record_book = current_record_book()
+    return render_template("table_efficiency.html",
+                           records=record_book.tables["best_season_efficiency"],
+                           title_prefix=LEAGUE_ABBREVIATION,
+                           record_name="Best lineup efficiency in one season",
+                           seasons=True,
+                           value_name="Efficiency",
+                           percent="%",
+                           members=record_book.sorted_managers)
+
+
+@app.route("/worst_season_efficiency")
+@cached_page()
+def worst_season_efficiencies():
+    record_book = current_record_book()
+    return render_template("table_efficiency.html",
+                           records=record_book.tables["worst_season_efficiency"],
+                           title_prefix=LEAGUE_ABBREVIATION,
+                           record_name="Worst lineup efficiency in one season",
+                           seasons=True,
+                           value_name="Efficiency",
+                           percent="%",
+                           members=record_book.sorted_managers)
+
+
+@app.route("/manager_efficiency")
+@cached_page()
+def manager_efficiencies():
+    record_book = current_record_book()
+    return render_template("table_efficiency.html",
+                           records=record_book.tables["manager_efficiency"],
+                           title_prefix=LEAGUE_ABBREVIATION,
+                           record_name="All time lineup efficiency",
+                           value_name="Efficiency",
+                           percent="%",
+                           members=record_book.sorted_managers)
 
 
 @app.route("/head-to-head/<member_name>")
+@cached_page()
 def head_to_head(member_name):
+    record_book = current_record_book()
     member_name = member_name.strip().title()
     if member_name is None:
         return render_template("index.html",
                                title_prefix=LEAGUE_ABBREVIATION,
                                record_name="Home",
                                welcome_message=f"Welcome to the {LEAGUE_NAME} online record book",
-                               members=SORTED_MANAGERS)
-    winrates = []
-    for member in fantasy_league.members:
-        if member.name == member_name:
-            matchups = member.matchup_superset()
-            for opponent in fantasy_league.members:
-                if opponent.id == member.id:
-                    continue
-                games_against = [matchup for matchup in matchups if matchup.opponent.member.name == opponent.name]
-                wins = len([game for game in games_against if game.outcome == GameOutcome.WIN])
-                try:
-                    winrate = round(wins * 100 / len(games_against), 2)
-                    winrates.append({
-                        "member": format_member_for_display(opponent, affected_by_tenure=True),
-                        "value": winrate
-                    })
-                except ZeroDivisionError:
-                    continue
-
-    records = sorted(winrates, key=lambda x: x.get("value"), reverse=True)
+                               members=record_book.sorted_managers)
 
     return render_template("table_minimal.html",
-                           records=records,
+                           records=record_book.head_to_head.get(member_name, []),
                            title_prefix=LEAGUE_ABBREVIATION,
                            record_name=f"Win percentages for {member_name}",
                            percent="%",
-                           members=SORTED_MANAGERS)
+                           members=record_book.sorted_managers)
 
 
 @app.route("/meet_the_managers")
+@cached_page(manager_bios, manager_images)
 def meet_the_managers():
-    managers = []
-    for name in sorted(member.name for member in fantasy_league.members if member.left_year == fantasy_league.active_year):
-        managers.append(
-            {"display_name": name, "key_name": name.lower().replace(" ", "")}
-        )
-
-    with open(MANAGER_BIOS_PATH, "r") as g:
-        bios = json.loads(g.read())
-
+    record_book = current_record_book()
     return render_template("meet_the_managers.html",
                            title_prefix=LEAGUE_ABBREVIATION,
-                           managers=managers,
+                           managers=record_book.managers,
                            record_name=f"Meet the members",
-                           bios=bios,
-                           meet_the_managers_assets=MEET_THE_MANAGERS_ASSETS,
-                           members=SORTED_MANAGERS)
+                           bios=manager_bios.get(),
+                           images={manager["key_name"]: manager_image(manager["key_name"])
+                                   for manager in record_book.managers},
+                           image_sizes=MANAGER_IMAGE_SIZES,
+                           members=record_book.sorted_managers)
+
+
+def manager_image(key_name):
+    """Gets the sources for a manager's picture, preferring the copies made by optimize_images.py if there are any"""
+    images = manager_images.get()
+    # Managers without a picture get the default one
+    if key_name not in images and not os.path.exists(os.path.join(MEET_THE_MANAGERS_ASSETS, f"{key_name}.jpg")):
+        key_name = "default_manager"
+    entry = images.get(key_name)
+    if entry is None:
+        return {"src": os.path.join(MEET_THE_MANAGERS_ASSETS, f"{key_name}.jpg")}
+
+    def srcset(variants):
+        return ", ".join(f"{os.path.join(MEET_THE_MANAGERS_ASSETS, variant.get('src'))} {variant.get('width')}w"
+                         for variant in variants)
+
+    jpeg_variants = entry.get("variants").get("jpeg")
+    return {"height": entry.get("height"),
+            "src": os.path.join(MEET_THE_MANAGERS_ASSETS, jpeg_variants[-1].get("src")),
+            "srcset": srcset(jpeg_variants),
+            "webp_srcset": srcset(entry.get("variants").get("webp")),
+            "width": entry.get("width"), }
+
+
+@app.route("/api/")
+def api_index():
+    return api_response(lambda record_book: {"records": sorted(record_book.tables),
+                                             "members": record_book.sorted_managers})
+
+
+@app.route("/api/snapshot")
+def api_snapshot():
+    return api_response(lambda record_book: {"standings": record_book.snapshot,
+                                             "seeds": record_book.standings_snapshot,
+                                             "odds": playoff_odds.get().get("odds", {}),
+                                             "simulations": playoff_odds.get().get("simulations")},
+                        playoff_odds)
+
+
+@app.route("/api/head-to-head/<member_name>")
+def api_head_to_head(member_name):
+    member_name = member_name.strip().title()
+    if member_name not in current_record_book().head_to_head:
+        abort(404)
+    return api_response(lambda record_book: record_book.head_to_head.get(member_name, []))
+
+
+@app.route("/api/<record>")
+def api_record(record):
+    if record not in current_record_book().tables:
+        abort(404)
+    return api_response(lambda record_book: record_book.tables[record])
 
 
 if __name__ == "__main__":
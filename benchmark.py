@@ -0,0 +1,233 @@
+import argparse
+import gc
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import record_book
+from league_storage import league_filename, load_league, save_league
+from league_store import LeagueStore
+from playoff_odds import playoff_odds
+from record_book import RecordBook
+from standings import SNAPSHOT_FILENAME, playoff_snapshot
+from synthetic_league import generate_league, player_data_response, write_synthetic_league
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+# The config.ini the site is benchmarked with. Reloading is off so that the data never changes part way through
+BENCHMARK_CONFIG = """[ESPN]
+s2 = synthetic
+swid = synthetic
+league_id = 0
+league_founded = {founded_year}
+
+[WEBSITE]
+league_name = SYNTHETIC
+league_abbreviation = SYN
+reload_interval = 0
+storage = {storage}
+"""
+
+
+class CannedResponse:
+    """Stands in for a requests.Response, with a body that is parsed every time it is asked for, like the real one"""
+
+    def __init__(self, body):
+        self.body: bytes = body
+        self.status_code: int = 200
+
+    def json(self):
+        """Parses the body"""
+        return json.loads(self.body)
+
+
+class CannedSession:
+    """Stands in for the ESPN session, answering every request with the same response"""
+
+    def __init__(self, body):
+        self.response: CannedResponse = CannedResponse(body)
+
+    def get(self, *args, **kwargs):
+        """Returns the canned response"""
+        return self.response
+
+
+def measure(function, repeat, setup=None):
+    """Times the best and median of repeat calls to function (after calling setup, untimed, before each one), then
+    calls it once more while tracing allocations to find the most memory it had in use at once.
+    Returns dict[statistic: value]"""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    # Tracing slows everything down, so the peak is measured on a run of its own
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"best": min(timings), "median": statistics.median(timings), "peak_mb": peak / 1024 / 1024}
+
+
+def forget_record_book():
+    """Drops the record book kept for the current data version, so that the next load builds it again"""
+    record_book._current_record_book = None
+
+
+def git_revision():
+    """Gets the commit being benchmarked, or None if it can't be found"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=dir_path, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(years, members, current_week, seed, repeat, storage):
+    """Builds a synthetic league of the given size and times every stage of loading it, serving it, and updating it.
+    Returns dict[benchmark name: dict[statistic: value]]"""
+    results = {}
+    results["generate league"] = measure(lambda: generate_league(years, members, current_week=current_week,
+                                                                 seed=seed), 1)
+    fantasy_league = generate_league(years, members, current_week=current_week, seed=seed)
+
+    data_dir = tempfile.mkdtemp(prefix="records-benchmark-")
+    league_path = write_synthetic_league(fantasy_league, data_dir, "SYNTHETIC", storage)
+    with open(os.path.join(data_dir, "config.ini"), "w") as f:
+        f.write(BENCHMARK_CONFIG.format(founded_year=fantasy_league.founded_year, storage=storage))
+    results["league file MB"] = {"size_mb": os.path.getsize(league_path) / 1024 / 1024}
+
+    # Loading and saving the league, in both formats
+    for other_storage in ("pickle", "sqlite"):
+        path = league_filename(data_dir, "BENCHMARK", other_storage)
+        results[f"save {other_storage}"] = measure(lambda: save_league(fantasy_league, path), repeat)
+        results[f"load {other_storage}"] = measure(lambda: load_league(path), repeat)
+        os.remove(path)
+
+    with open(os.path.join(data_dir, SNAPSHOT_FILENAME), "r") as f:
+        standings_snapshot = json.load(f)
+    results["build record book"] = measure(lambda: RecordBook(load_league(league_path), standings_snapshot, "0"), 1)
+    # Everything the site loads before it can serve the league: just the stored record book for SQLite, otherwise the
+    # whole league and the record book built from it
+    league_store = LeagueStore(league_path, os.path.join(data_dir, SNAPSHOT_FILENAME), 0)
+    results[f"site load {storage}"] = measure(league_store.load, repeat, setup=forget_record_book)
+
+    # The standings and bracket stage of update_league.py
+    results["playoff snapshot"] = measure(lambda: playoff_snapshot(fantasy_league), repeat)
+    results["playoff odds"] = measure(lambda: playoff_odds(fantasy_league, seed=seed), repeat)
+
+    # Enriching a week of lineups, with ESPN swapped out for the same response every time
+    import espn_fetch
+    body = json.dumps(player_data_response(members, seed)).encode()
+    previous_session = espn_fetch.SESSION
+    espn_fetch.use_session(CannedSession(body))
+    try:
+        results["fetch player data"] = measure(
+            lambda: espn_fetch.fetch_player_data(0, "", "", fantasy_league.active_year, 1), repeat * 10)
+    finally:
+        espn_fetch.use_session(previous_session)
+
+    # Like the site, the app expects to be run from here so it can find the static files
+    os.environ["RECORDS_DATA_DIR"] = data_dir
+    os.chdir(dir_path)
+    start = time.perf_counter()
+    import app
+    results["import app"] = {"best": time.perf_counter() - start}
+    results["import app"]["median"] = results["import app"]["best"]
+    # Then loading the league and building every leaderboard, the way the site starts up
+    start = time.perf_counter()
+    app.preload_data()
+    results["preload data"] = {"best": time.perf_counter() - start}
+    results["preload data"]["median"] = results["preload data"]["best"]
+
+    from export_site import export_paths
+    client = app.app.test_client()
+    paths = export_paths(app.app, app.current_record_book())
+    for path in paths:
+        # Cold renders the page from the record book, cached serves it from the response cache
+        results[f"GET {path} (cold)"] = measure(lambda: client.get(path), repeat,
+                                                setup=app.response_cache.entries.clear)
+        results[f"GET {path} (cached)"] = measure(lambda: client.get(path), repeat)
+    results["GET every page (cold)"] = measure(lambda: [client.get(path) for path in paths], 1,
+                                               setup=app.response_cache.entries.clear)
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    # Starting the command line, which should only import what the command asks for. Each run is a fresh interpreter
+    for command in (["--help"], ["query", "--help"]):
+        results[f"records.py {' '.join(command)}"] = measure(
+            lambda: subprocess.run([sys.executable, os.path.join(dir_path, "records.py")] + command,
+                                   capture_output=True, check=True), repeat)
+    return results
+
+
+def print_results(results, previous=None):
+    """Prints a table of the results, with how much slower (or faster) each one was than in the previous results"""
+    print(f"{'benchmark':<60} {'best':>10} {'median':>10} {'peak MB':>9} {'vs last':>8}")
+    for name, result in results.items():
+        if "best" not in result:
+            print(f"{name:<60} {result.get('size_mb'):>10.2f}")
+            continue
+        peak = f"{result.get('peak_mb'):.2f}" if "peak_mb" in result else ""
+        change = ""
+        last = (previous or {}).get(name)
+        if last and last.get("best"):
+            change = f"{(result.get('best') / last.get('best') - 1) * 100:+.0f}%"
+        print(f"{name:<60} {result.get('best') * 1000:>8.2f}ms {result.get('median') * 1000:>8.2f}ms {peak:>9} "
+              f"{change:>8}")
+
+
+def previous_results(history_path, sizes):
+    """Gets the results of the last run in the history file with the same league size, or None if there isn't one"""
+    previous = None
+    try:
+        with open(history_path, "r") as f:
+            for line in f:
+                run = json.loads(line)
+                if run.get("sizes") == sizes:
+                    previous = run.get("results")
+    except (OSError, json.JSONDecodeError):
+        return None
+    return previous
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time loading, serving, and updating a synthetic league")
+    parser.add_argument("--years", type=int, default=30, help="How many seasons the league has existed for")
+    parser.add_argument("--members", type=int, default=20, help="How many members (and teams each year) it has")
+    parser.add_argument("--current-week", type=int, default=10,
+                        help="Week the last season is in, 0 for a finished season")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random numbers, so runs can be compared")
+    parser.add_argument("--repeat", type=int, default=5, help="How many times to run each benchmark")
+    parser.add_argument("--storage", choices=("pickle", "sqlite"), default="pickle",
+                        help="How the site loads the league")
+    parser.add_argument("--history", help="JSON lines file to compare against, and then add this run to")
+    args = parser.parse_args()
+
+    league_sizes = {"current_week": args.current_week, "members": args.members, "storage": args.storage,
+                    "years": args.years}
+    benchmark_results = run_benchmarks(args.years, args.members, args.current_week or None, args.seed,
+                                       max(args.repeat, 1), args.storage)
+    # ru_maxrss is in kB on Linux
+    benchmark_results["process max RSS MB"] = {"size_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    print(f"{args.years} years, {args.members} members, week {args.current_week or 'final'}, {args.storage}, "
+          f"Python {sys.version.split()[0]}")
+    print_results(benchmark_results, previous_results(args.history, league_sizes) if args.history else None)
+
+    if args.history:
+        with open(args.history, "a") as f:
+            f.write(json.dumps({"results": benchmark_results, "revision": git_revision(), "sizes": league_sizes,
+                                "time": time.strftime("%Y-%m-%dT%H:%M:%S")}) + "\n")
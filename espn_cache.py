@@ -0,0 +1,170 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import threading
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from utility import write_atomically
+
+# Pulls the season out of both the current and the leagueHistory style of ESPN endpoint
+SEASON_PATTERN = re.compile(r"(?:/seasons/|seasonId=)(\d{4})")
+
+
+class OfflineCacheMiss(Exception):
+    pass
+
+
+class ResponseCache:
+    """Content-addressed on-disk store of raw ESPN responses
+
+    Bodies live under objects/ named by the sha256 of their content, so identical responses are only stored once.
+    Entries under entries/ are named by the sha256 of the request (URL with its query string, plus any headers
+    that change the response) and point at a body along with the validators needed to revalidate it"""
+
+    def __init__(self, directory):
+        self.directory: str = directory
+        os.makedirs(os.path.join(directory, "entries"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+
+    @staticmethod
+    def request_key(url, headers=None):
+        """Hashes a request into the name of its cache entry"""
+        identity = json.dumps([url, sorted((headers or {}).items())])
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, "entries", f"{key}.json")
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest)
+
+    def get(self, key):
+        """Returns (entry, body) for a cached request, or None if it isn't cached"""
+        try:
+            with open(self._entry_path(key), "r") as f:
+                entry = json.load(f)
+            with open(self._object_path(entry.get("digest")), "rb") as f:
+                return entry, f.read()
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, url, body, headers, year, week, immutable):
+        """Stores a response body and the entry that points at it"""
+        digest = hashlib.sha256(body).hexdigest()
+        if not os.path.exists(self._object_path(digest)):
+            write_atomically(self._object_path(digest), "wb", lambda f: f.write(body))
+        entry = {
+            "content_type": headers.get("Content-Type", "application/json"),
+            "digest": digest,
+            "etag": headers.get("ETag"),
+            "immutable": immutable,
+            "last_modified": headers.get("Last-Modified"),
+            "url": url,
+            "week": week,
+            "year": year,
+        }
+        self._put_entry(key, entry)
+        return entry
+
+    def _put_entry(self, key, entry):
+        write_atomically(self._entry_path(key), "w", lambda f: json.dump(entry, f))
+
+    def freeze(self, is_final):
+        """Marks every entry for a final season or week as immutable, so later runs never revalidate it"""
+        for name in os.listdir(os.path.join(self.directory, "entries")):
+            key = name.removesuffix(".json")
+            cached = self.get(key)
+            if cached is None:
+                continue
+            entry, _ = cached
+            if not entry.get("immutable") and entry.get("year") and is_final(entry.get("year"), entry.get("week")):
+                entry["immutable"] = True
+                self._put_entry(key, entry)
+
+
+class CachingSession(requests.Session):
+    """Session whose GETs are served from a ResponseCache when possible
+
+    Responses for final seasons and weeks are served straight from disk. Anything else is revalidated with ESPN
+    (at most once per run) using the stored ETag or Last-Modified date. When offline, the network is never used.
+    Seasons and weeks being refetched, given as (year, week) with a week of None for a whole season, are always
+    revalidated"""
+
+    def __init__(self, cache, is_final=lambda year, week: False, offline=False, refetch=()):
+        super().__init__()
+        self.cache: ResponseCache = cache
+        self.is_final = is_final
+        self.offline: bool = offline
+        self.refetch: set[tuple[int, int | None]] = set(refetch)
+        self._revalidated: set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        full_url = requests.Request("GET", url, params=params).prepare().url
+        key = self.cache.request_key(full_url, headers)
+        year, week = request_season_and_week(full_url, params)
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            entry, body = cached
+            immutable = entry.get("immutable") and not self.is_refetched(year, week)
+            with self._lock:
+                fresh = immutable or self.offline or key in self._revalidated
+            if fresh:
+                return cached_response(full_url, entry, body)
+
+        if self.offline:
+            raise OfflineCacheMiss(f"{full_url} is not in the ESPN response cache")
+
+        # Ask ESPN whether the cached copy is still good
+        request_headers = dict(headers or {})
+        if cached is not None:
+            entry, body = cached
+            if entry.get("etag"):
+                request_headers["If-None-Match"] = entry.get("etag")
+            if entry.get("last_modified"):
+                request_headers["If-Modified-Since"] = entry.get("last_modified")
+
+        response = super().get(url, params=params, headers=request_headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            entry, body = cached
+            response = cached_response(full_url, entry, body)
+        elif response.status_code == 200:
+            self.cache.put(key, full_url, response.content, response.headers, year, week, self.is_final(year, week))
+        else:
+            return response
+
+        with self._lock:
+            self._revalidated.add(key)
+        return response
+
+    def is_refetched(self, year, week):
+        """Returns a boolean representing whether a season or week is being refetched"""
+        return (year, None) in self.refetch or (year, week) in self.refetch
+
+
+def cached_response(url, entry, body):
+    """Builds a requests.Response from a cached entry and body"""
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.encoding = "utf-8"
+    response.headers = CaseInsensitiveDict({"Content-Type": entry.get("content_type")})
+    response.url = url
+    return response
+
+
+def request_season_and_week(url, params):
+    """Returns the (season, scoring period) a request is for. Either may be None, EG for whole-season views"""
+    match = SEASON_PATTERN.search(url)
+    year = int(match.group(1)) if match else None
+    week = None
+    if params:
+        items = params.items() if isinstance(params, dict) else params
+        for name, value in items:
+            if name == "scoringPeriodId":
+                week = int(value)
+    return year, week
@@ -0,0 +1,352 @@
+from __future__ import annotations
+import random
+import requests
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from espn_api.football import League
+from espn_api.requests import espn_requests
+from espn_api.requests.espn_requests import ESPNInvalidLeague
+from requests.adapters import HTTPAdapter
+
+from espn_cache import CachingSession
+from fantasy_classes import Player
+from fantasy_enums import PlayerPosition
+
+# Default cap on the number of ESPN requests in flight at once
+DEFAULT_CONCURRENCY = 8
+# Default cap on how many requests are sent to ESPN each second, on average
+DEFAULT_RATE_LIMIT = 10
+# Default number of times to retry a request ESPN throttled (429) or failed (5xx)
+DEFAULT_RETRIES = 4
+# Seconds to back off before the first retry, doubling for each one after it, up to the maximum
+RETRY_BACKOFF = 1
+MAX_RETRY_BACKOFF = 30
+
+# ESPN's defaultPositionId for each position, which is numbered differently to the lineup slots
+DEFAULT_POSITION_IDS = {
+    1: PlayerPosition.QB,
+    2: PlayerPosition.RB,
+    3: PlayerPosition.WR,
+    4: PlayerPosition.TE,
+    5: PlayerPosition.KICKER,
+    16: PlayerPosition.DEFENSE,
+}
+
+
+class SessionModule:
+    """Stands in for the requests module inside espn_api so that its calls go through a shared session"""
+
+    def __init__(self, session):
+        self.session: requests.Session = session
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def get(self, *args, **kwargs):
+        return self.session.get(*args, **kwargs)
+
+
+class TokenBucket:
+    """Lets requests through at a steady rate, with bursts of up to capacity requests after a quiet spell"""
+
+    def __init__(self, rate, capacity):
+        self.capacity: float = capacity
+        self.rate: float = rate
+        self.tokens: float = capacity
+        self._lock = threading.Lock()
+        self._updated: float = time.monotonic()
+
+    def acquire(self):
+        """Waits until a request may be sent. Returns how many seconds that took"""
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RequestStats:
+    """Counts of the requests actually sent to ESPN (not those served from the on-disk cache), shared between threads"""
+
+    def __init__(self):
+        self.bytes: int = 0
+        self.failures: int = 0
+        self.requests: int = 0
+        self.retries: int = 0
+        self.retry_seconds: float = 0
+        self.statuses: dict[int, int] = {}
+        self.throttled_seconds: float = 0
+        self._lock = threading.Lock()
+
+    def add_response(self, status_code, size):
+        """Counts a response ESPN sent"""
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+
+    def add_retry(self, delay):
+        """Counts a retry, and how long it backed off for"""
+        with self._lock:
+            self.retries += 1
+            self.retry_seconds += delay
+
+    def add_failure(self):
+        """Counts a request that was still throttled or failing once it ran out of retries"""
+        with self._lock:
+            self.failures += 1
+
+    def add_throttled(self, seconds):
+        """Counts time spent waiting on the rate limit"""
+        with self._lock:
+            self.throttled_seconds += seconds
+
+    def summary(self):
+        """Returns the counts as a dict that can be written out as JSON"""
+        with self._lock:
+            return {"bytes": self.bytes, "failures": self.failures, "requests": self.requests, "retries": self.retries,
+                    "retry_seconds": round(self.retry_seconds, 3),
+                    "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+                    "throttled_seconds": round(self.throttled_seconds, 3)}
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """Transport adapter that holds requests to a rate limit, and retries those ESPN throttles (429) or fails (5xx)
+    after a jittered exponential backoff, counting everything it sends in a RequestStats"""
+
+    def __init__(self, stats, bucket=None, retries=DEFAULT_RETRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket: TokenBucket | None = bucket
+        self.retries: int = retries
+        self.stats: RequestStats = stats
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                self.stats.add_throttled(self.bucket.acquire())
+            response = super().send(request, **kwargs)
+            # Reading the body here is what requests would do next anyway, unless the caller asked to stream it
+            size = int(response.headers.get("Content-Length", 0)) if kwargs.get("stream") else len(response.content)
+            self.stats.add_response(response.status_code, size)
+            if not should_retry(response.status_code):
+                return response
+            if attempt >= self.retries:
+                self.stats.add_failure()
+                return response
+            delay = retry_delay(attempt, response.headers.get("Retry-After"))
+            self.stats.add_retry(delay)
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+
+def should_retry(status_code):
+    """Returns a boolean representing whether a response means ESPN is throttling or failing, and may answer later"""
+    return status_code == 429 or status_code >= 500
+
+
+def retry_delay(attempt, retry_after=None):
+    """Calculates how long to back off before a retry: a random time up to an exponentially growing limit, so that
+    concurrent requests don't all retry at once, but never less than ESPN asked for in a Retry-After header"""
+    delay = random.uniform(0, min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2 ** attempt))
+    try:
+        return max(delay, min(float(retry_after), MAX_RETRY_BACKOFF))
+    except (TypeError, ValueError):
+        # Retry-After is missing, or an HTTP date
+        return delay
+
+
+def create_session(max_workers=DEFAULT_CONCURRENCY, cache=None, rate_limit=DEFAULT_RATE_LIMIT,
+                   retries=DEFAULT_RETRIES, stats=None, **cache_options):
+    """Creates a session that keeps one pooled keep-alive connection per concurrent request and accepts gzip.
+    Requests sent to ESPN are held to rate_limit a second (0 for no limit), retried on 429 and 5xx responses, and
+    counted in stats if one is given. If a ResponseCache is given, responses are served from and saved to it
+    (see CachingSession for the options)"""
+    session = requests.Session() if cache is None else CachingSession(cache, **cache_options)
+    bucket = TokenBucket(rate_limit, max(max_workers, 1)) if rate_limit > 0 else None
+    adapter = ThrottledAdapter(stats if stats is not None else RequestStats(), bucket, retries,
+                               pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
+
+
+def use_session(session):
+    """Sends all ESPN traffic, this module's and espn_api's, through the given session"""
+    global SESSION
+    SESSION = session
+    espn_requests.requests = SessionModule(session)
+
+
+SESSION: requests.Session = create_session()
+use_session(SESSION)
+
+
+def fetch_player_data(league_id, espn_s2, espn_swid, fetch_year, fetch_week):
+    """Gets name, points, position_id, and team for players in the given year/week combination.
+    Data not available prior to 2018. Returns data as a defaultdict[week: list[Player]], or None if ESPN wouldn't
+    send it (even after retrying)"""
+
+    # Start a defaultdict for the results
+    output_data = defaultdict(list)
+    # This data is not available prior to 2018
+    if fetch_year < 2018:
+        return output_data
+
+    endpoint = f"https://lm-api-reads.fantasy.espn.com/apis/v3/games/ffl/seasons/{fetch_year}/segments/0/leagues/{league_id}"
+    # Ask for the roster and matchup views in one request
+    params = [
+        ("view", "mRoster"),
+        ("view", "mMatchup"),
+        ("scoringPeriodId", fetch_week),
+    ]
+    cookies = {
+        'swid': espn_swid,
+        'espn_s2': espn_s2
+    }
+    r = SESSION.get(endpoint, params=params, cookies=cookies)
+    if r.status_code != 200:
+        print("year: ", fetch_year, "week: ", fetch_week, "returned an HTTP", r.status_code)
+        return None
+    roster_result = matchup_result = r.json()
+
+    # If ESPN didn't send both views back together, fall back to asking for the matchup view on its own
+    if "schedule" not in matchup_result:
+        params = {
+            "view": "mMatchup",
+            "scoringPeriodId": fetch_week,
+        }
+        r = SESSION.get(endpoint, params=params, cookies=cookies)
+        if r.status_code != 200:
+            print("year: ", fetch_year, "week: ", fetch_week, "returned an HTTP", r.status_code)
+            return None
+        matchup_result = r.json()
+
+    # Rostered players that week
+    rostered = []
+    # Loop over the teams' rosters
+    for fetch_team in roster_result.get("teams"):
+        for entry in fetch_team.get("roster").get("entries"):
+            # Add the data that can be pulled from this endpoint
+            rostered.append({
+                "default_position": None,
+                "name": None,
+                "on_team": fetch_team.get("id"),
+                "player_id": entry.get("playerId"),
+                "points": None,
+                "position_id": entry.get("lineupSlotId"),
+            })
+
+    # Create a list of scheduled players
+    scheduled = []
+    # Get players who were played and players who were benched
+    for game in matchup_result.get("schedule"):
+        scheduled.extend(game.get("home", {}).get("rosterForCurrentScoringPeriod", {}).get("entries", []))
+        scheduled.extend(game.get("away", {}).get("rosterForCurrentScoringPeriod", {}).get("entries", []))
+
+    # Enrich the rostered players with the scheduled players (only fully works in 2018 or later)
+    missing = enrich_rostered_players(rostered, scheduled)
+    for rostered_player in missing:
+        print("year: ", fetch_year, "week: ", fetch_week, "player", rostered_player.get("player_id"),
+              "on team", rostered_player.get("on_team"), "was not found in the schedule")
+
+    # Use the data we put together to create a player object
+    for rostered_player in rostered:
+        if rostered_player.get("name"):
+            player_object = Player(espn_id=rostered_player.get("player_id"),
+                                   name=rostered_player.get("name"),
+                                   points=rostered_player.get("points"),
+                                   position=rostered_player.get("position_id"),
+                                   default_position=rostered_player.get("default_position"))
+            output_data[rostered_player.get("on_team")].append(player_object)
+
+    return output_data
+
+
+def enrich_rostered_players(rostered, scheduled):
+    """Fills in the name, points, and position of each rostered player from the scheduled player with the same playerId.
+    Returns the rostered players that had no match in the schedule"""
+    # Index the schedule by player so each rostered player is a single lookup
+    scheduled_by_id = {scheduled_player.get("playerId"): scheduled_player for scheduled_player in scheduled}
+
+    missing = []
+    for rostered_player in rostered:
+        scheduled_player = scheduled_by_id.get(rostered_player.get("player_id"))
+        if scheduled_player is None:
+            missing.append(rostered_player)
+            continue
+        rostered_player["default_position"] = DEFAULT_POSITION_IDS.get(
+            scheduled_player.get("playerPoolEntry").get("player").get("defaultPositionId"))
+        rostered_player["name"] = scheduled_player.get("playerPoolEntry").get("player").get("fullName")
+        rostered_player["points"] = scheduled_player.get("playerPoolEntry").get("appliedStatTotal")
+    return missing
+
+
+def get_year_from_api(league_id, espn_s2, espn_swid, query_year):
+    """ Returns an ESPN_API object for the given year """
+    return League(league_id=league_id, year=query_year, espn_s2=espn_s2, swid=espn_swid)
+
+
+def fetch_years(league_id, espn_s2, espn_swid, years, max_workers=DEFAULT_CONCURRENCY):
+    """Gets the ESPN_API object for each of the given years concurrently.
+    Returns a dict[year: League] in the order the years were given, leaving out years ESPN has no league for"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {year: pool.submit(get_year_from_api, league_id, espn_s2, espn_swid, year) for year in years}
+
+    api_years = {}
+    for year, future in futures.items():
+        # If it fails, that's ok
+        # It most likely just means that the fantasy football year hasn't started for the calendar year
+        try:
+            api_years[year] = future.result()
+        except ESPNInvalidLeague:
+            continue
+    return api_years
+
+
+def fetch_scoreboard(api_year, week):
+    """Gets the scoreboard for a week, or None if ESPN doesn't have any data for the week yet"""
+    scoreboard = api_year.scoreboard(week)
+    # If nobody has any points, the ESPN API doesn't have data for that week
+    if all(game.home_score == 0 for game in scoreboard) and all(game.away_score == 0 for game in scoreboard):
+        return None
+    return scoreboard
+
+
+def fetch_scoreboards(year_weeks, max_workers=DEFAULT_CONCURRENCY):
+    """Gets the scoreboard for each (League, week) pair concurrently.
+    Returns a dict[(year, week): fetch_scoreboard result] in the order the pairs were given"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {(api_year.year, week): pool.submit(fetch_scoreboard, api_year, week)
+                   for api_year, week in year_weeks}
+    return {year_week: future.result() for year_week, future in futures.items()}
+
+
+def fetch_weeks_player_data(league_id, espn_s2, espn_swid, year_weeks, max_workers=DEFAULT_CONCURRENCY):
+    """Gets the player data for each (year, week) pair concurrently.
+    Returns a dict[(year, week): fetch_player_data result] in the order the pairs were given"""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {(year, week): pool.submit(fetch_player_data, league_id, espn_s2, espn_swid, year, week)
+                   for year, week in year_weeks}
+    return {year_week: future.result() for year_week, future in futures.items()}
+
+
+def weeks_to_fetch(api_year):
+    """Returns the weeks of a season that have happened or are in progress"""
+    return range(1, min(len(api_year.settings.matchup_periods), api_year.current_week) + 1)
+
+
+def week_is_final(api_year, week):
+    """Returns a boolean representing whether a week of a season is over, so its results will no longer change"""
+    return api_year.current_week >= len(api_year.settings.matchup_periods) or week < api_year.current_week
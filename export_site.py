@@ -0,0 +1,145 @@
+import argparse
+import configparser
+import hashlib
+import json
+import os
+import shutil
+import time
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+# Where config.ini and the data written by update_league.py are, the same as for the site (see app.py)
+data_path = os.environ.get("RECORDS_DATA_DIR", dir_path)
+
+# Name of the symlink, inside the export directory, that points at the newest export
+CURRENT_LINK = "current"
+# Hashes of every exported file, written into each export so the next one can tell what changed
+MANIFEST_FILENAME = "manifest.json"
+# Endpoints that only make sense served live by the app
+LIVE_ENDPOINTS = ("metrics", "static")
+
+
+def export_filename(path):
+    """Gets the file, relative to the export, that nginx should serve for a URL path"""
+    extension = ".json" if path.startswith("/api/") else ".html"
+    if path.endswith("/"):
+        return f"{path.strip('/')}/index{extension}".lstrip("/")
+    return f"{path.lstrip('/')}{extension}"
+
+
+def export_paths(flask_app, record_book):
+    """Lists the URL path of every page and API response the app can serve for the current data"""
+    # Values for the arguments of routes like /head-to-head/<member_name>
+    argument_values = {
+        "member_name": record_book.sorted_managers,
+        "record": sorted(record_book.tables),
+    }
+    paths = []
+    for rule in flask_app.url_map.iter_rules():
+        if rule.endpoint in LIVE_ENDPOINTS or "GET" not in rule.methods:
+            continue
+        if not rule.arguments:
+            paths.append(rule.rule)
+            continue
+        for argument in rule.arguments:
+            for value in argument_values.get(argument, []):
+                paths.append(rule.rule.replace(f"<{argument}>", value))
+    return sorted(paths)
+
+
+def export_site(flask_app, record_book, export_dir, keep):
+    """Renders every page into a new directory, then points the current symlink at it in one step. Pages that
+    haven't changed since the last export are hard linked to it instead of being written again, so they keep their
+    modification time (and nginx's ETag for them). Returns (new directory, pages written, pages unchanged)"""
+    os.makedirs(export_dir, exist_ok=True)
+    current_link = os.path.join(export_dir, CURRENT_LINK)
+    previous_dir = os.path.realpath(current_link) if os.path.islink(current_link) else None
+    previous_manifest = {}
+    if previous_dir is not None:
+        try:
+            with open(os.path.join(previous_dir, MANIFEST_FILENAME), "r") as f:
+                previous_manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            previous_manifest = {}
+
+    new_dir = os.path.join(export_dir, f"site-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    os.makedirs(new_dir)
+
+    client = flask_app.test_client()
+    manifest = {}
+    written = 0
+    unchanged = 0
+    for path in export_paths(flask_app, record_book):
+        response = client.get(path)
+        if response.status_code != 200:
+            print(f"Skipping {path}, which returned an HTTP {response.status_code}")
+            continue
+        body = response.get_data()
+        filename = export_filename(path)
+        digest = hashlib.sha256(body).hexdigest()
+        manifest[filename] = digest
+        destination = os.path.join(new_dir, filename)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Reuse the previous export's copy of any page that hasn't changed
+        if previous_manifest.get(filename) == digest:
+            try:
+                os.link(os.path.join(previous_dir, filename), destination)
+                unchanged += 1
+                continue
+            except OSError:
+                pass
+        with open(destination, "wb") as f:
+            f.write(body)
+        written += 1
+
+    # The static files are served as they are, so link to them rather than copying them
+    os.symlink(os.path.join(dir_path, "static"), os.path.join(new_dir, "static"))
+    with open(os.path.join(new_dir, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    # Swap the symlink over in one rename so nginx only ever sees a complete export
+    temp_link = f"{current_link}.tmp"
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(os.path.basename(new_dir), temp_link)
+    os.replace(temp_link, current_link)
+
+    remove_old_exports(export_dir, keep)
+    return new_dir, written, unchanged
+
+
+def remove_old_exports(export_dir, keep):
+    """Deletes all but the newest few exports, never deleting the one the current symlink points at"""
+    current_dir = os.path.realpath(os.path.join(export_dir, CURRENT_LINK))
+    exports = sorted((os.path.join(export_dir, name) for name in os.listdir(export_dir) if name.startswith("site-")),
+                     key=os.path.getmtime, reverse=True)
+    for old_export in exports[keep:]:
+        if os.path.realpath(old_export) != current_dir:
+            shutil.rmtree(old_export, ignore_errors=True)
+
+
+def main(argv=None, prog=None, data_directory=data_path):
+    """Exports the site for the data in a directory with the given command-line arguments (sys.argv if None)"""
+    config = configparser.ConfigParser()
+    config.read(f"{data_directory}/config.ini")
+    parser = argparse.ArgumentParser(prog=prog,
+                                     description="Render every page of the site to static files for nginx to serve")
+    parser.add_argument("--output", default=config["WEBSITE"].get("export_dir", fallback=f"{dir_path}/site"),
+                        help="Directory to export into (defaults to the export_dir setting in config.ini)")
+    parser.add_argument("--keep", type=int, default=2, help="How many exports to keep, including the new one")
+    args = parser.parse_args(argv)
+
+    # The app loads the league data the same way the site does, from the data directory RECORDS_DATA_DIR gives it when
+    # it is imported. Like the site, it expects to be run from here so it can find the static files
+    os.environ["RECORDS_DATA_DIR"] = data_directory
+    os.chdir(dir_path)
+    from app import app, current_record_book, preload_data
+    preload_data()
+
+    start = time.perf_counter()
+    new_export, pages_written, pages_unchanged = export_site(app, current_record_book(), args.output, max(args.keep, 1))
+    print(f"Exported {pages_written + pages_unchanged} pages to {new_export} in {time.perf_counter() - start:.2f}s "
+          f"({pages_written} written, {pages_unchanged} unchanged)")
+
+
+if __name__ == "__main__":
+    main()
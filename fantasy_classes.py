@@ -1,7 +1,36 @@
 from __future__ import annotations
+import functools
 import itertools
 
-from fantasy_enums import GameType, GameOutcome, PlayerPosition
+from fantasy_enums import POSITION_SLOTS, GameType, GameOutcome, PlayerPosition
+
+
+def cached(method):
+    """Memoizes a method's result on its object until the object's clear_cache method is called"""
+    @functools.wraps(method)
+    def wrapper(self):
+        # Objects unpickled from before the cache existed won't have one yet
+        cache = self.__dict__.setdefault("_cache", {})
+        try:
+            return cache[method.__name__]
+        except KeyError:
+            value = cache[method.__name__] = method(self)
+            return value
+    return wrapper
+
+
+class CachedAggregates:
+    """Mixin for objects that memoize aggregates with @cached"""
+
+    def __getstate__(self):
+        # Cached values are cheap to rebuild, so leave them out of the pickle
+        state = self.__dict__.copy()
+        state.pop("_cache", None)
+        return state
+
+    def clear_cache(self):
+        """Forgets every memoized aggregate so that it is recalculated on next use"""
+        self._cache = {}
 
 
 class FantasyLeague:
@@ -12,15 +41,89 @@ class FantasyLeague:
         self.active_year_regular_season_length: int = 0
         self.espn_s2: str = espn_s2
         self.espn_swid: str = espn_swid
+        self.final_weeks: set[tuple[int, int]] = set()
         self.founded_year: int = founded_year
         self.id: int = league_id
         self.max_completed_year: int = 0
+        self.member_index: dict[str, Member] = {}
         self.members: set[Member] = set()
         self.name: str = ""
+        # Teams are keyed by (year, ESPN team ID), with one Team per owner if a team was co-owned
+        self.team_index: dict[tuple[int, int], list[Team]] = {}
+
+    def __getstate__(self):
+        # Teams leave their matchups out of their own state and the league pickles them once every team has been.
+        # Otherwise each matchup's opponent is pickled from inside it, nesting deep enough to hit the recursion limit
+        state = self.__dict__.copy()
+        state["team_matchups"] = [(team, list(team.matchups)) for team in self.team_superset()]
+        return state
+
+    def __setstate__(self, state):
+        # Leagues pickled before weeks were marked final have no record of them, so everything gets fetched once
+        state.setdefault("final_weeks", set())
+        team_matchups = state.pop("team_matchups", ())
+        self.__dict__.update(state)
+        # Leagues pickled before the indexes existed need them built from their members and teams
+        if "member_index" not in state or "team_index" not in state:
+            self.rebuild_indexes()
+        for team, matchups in team_matchups:
+            team.key_matchups(matchups)
+        # Teams pickled before their matchups were keyed kept them in a set, which can only be keyed now that
+        # every opponent has been unpickled
+        for team in self.team_superset():
+            team.key_matchups(team.__dict__.pop("matchups", ()))
 
     def add_member(self, member):
         """Add a new member to the league"""
         self.members.add(member)
+        self.member_index[member.id] = member
+
+    def get_member(self, member_id):
+        """Returns the member with the given ID, or None if there isn't one"""
+        return self.member_index.get(member_id)
+
+    def get_teams(self, year, espn_id):
+        """Returns the teams (one per owner) with the given ESPN team ID in the given year"""
+        return self.team_index.get((year, espn_id), [])
+
+    def index_team(self, team):
+        """Add a team to the league's (year, ESPN team ID) index"""
+        teams = self.team_index.setdefault((team.year, team.espn_id), [])
+        if team not in teams:
+            teams.append(team)
+
+    def rebuild_indexes(self):
+        """Rebuild the member and team indexes from the league's members"""
+        self.member_index = {member.id: member for member in self.members}
+        self.team_index = {}
+        for team in sorted(self.team_superset(), key=lambda team: team.member.id):
+            self.index_team(team)
+
+    def clear_final_weeks(self, year, week=None):
+        """Forget that a week (or every week of a year, if no week is given) is final so it gets fetched again"""
+        self.final_weeks = {(final_year, final_week) for final_year, final_week in self.final_weeks
+                            if final_year != year or (week is not None and final_week != week)}
+
+    def is_week_final(self, year, week):
+        """Returns a boolean representing whether a week's results are final and already stored"""
+        return (year, week) in self.final_weeks
+
+    def mark_week_final(self, year, week):
+        """Record that a week's results are final so future updates don't fetch it again"""
+        self.final_weeks.add((year, week))
+
+    def weeks_without_positions(self):
+        """Gets the (year, week) of every week whose lineups were stored before players' default positions were, IE
+        that has benched players but not one benched player with a known position"""
+        benched_weeks = set()
+        positioned_weeks = set()
+        for matchup in self.matchup_superset():
+            for player in matchup.lineup:
+                if player.position == PlayerPosition.BENCH:
+                    benched_weeks.add((matchup.team.year, matchup.week))
+                    if player.default_position is not None:
+                        positioned_weeks.add((matchup.team.year, matchup.week))
+        return sorted(benched_weeks - positioned_weeks)
 
     def player_superset(self):
         """Gets all players from all matchups from all teams from all members in a league"""
@@ -108,9 +211,10 @@ class Matchup:
         return False
 
 
-class Member:
+class Member(CachedAggregates):
 
     def __init__(self, league, member_id, name):
+        self._cache: dict = {}
         self.id: str = member_id
         self.joined_year: int = 99999
         self.league: FantasyLeague = league
@@ -121,6 +225,8 @@ class Member:
     def add_team(self, team):
         """Add a new team to the member"""
         self.teams.add(team)
+        self.league.index_team(team)
+        self.clear_cache()
 
     def championship_wins(self):
         """Calculates the number of championship wins for a member"""
@@ -132,66 +238,78 @@ class Member:
             return self.id == other.id
         return False
 
+    @cached
     def matchup_superset(self):
         """Gets all matchups from all teams for a member"""
-        return set(itertools.chain.from_iterable((team.matchups for team in self.teams)))
+        return frozenset(itertools.chain.from_iterable((team.matchups for team in self.teams)))
 
     def player_superset(self):
         """Gets all players from all matchups from all teams for a member"""
         return set(itertools.chain.from_iterable((team.player_superset() for team in self.teams)))
 
+    @cached
     def playoff_appearances(self):
         """Calculates the playoff appearances for a member"""
         return len([team for team in self.teams if team.made_playoffs()])
 
+    @cached
     def playoff_average_points(self):
         """Calculates the average points scored per playoff game for a member"""
         try:
-            return round(self.playoff_points() / len(list(self.playoff_matchups())), 2)
+            return round(self.playoff_points() / len(self.playoff_matchups()), 2)
         except ZeroDivisionError:
             return 0
 
+    @cached
     def playoff_matchups(self):
         """Gets all playoff matchups for a member"""
-        return (matchup for matchup in self.matchup_superset() if matchup.type == GameType.PLAYOFF)
+        return tuple(matchup for matchup in self.matchup_superset() if matchup.type == GameType.PLAYOFF)
 
+    @cached
     def playoff_points(self):
         """Calculates the all-time playoff points for a member"""
         return round(sum(matchup.points_for for matchup in self.playoff_matchups()), 2)
 
+    @cached
     def playoff_win_percentage(self):
         """Calculates the playoff win percentage for a member"""
         try:
-            return round(self.playoff_wins() * 100 / len(list(self.playoff_matchups())), 2)
+            return round(self.playoff_wins() * 100 / len(self.playoff_matchups()), 2)
         except ZeroDivisionError:
             return 0
 
+    @cached
     def playoff_wins(self):
         """Calculates the number of playoff wins for a member"""
         return len(list(matchup for matchup in self.playoff_matchups() if matchup.outcome == GameOutcome.WIN))
 
+    @cached
     def regular_season_average_points(self):
         """Calculates the average points scored per regular season game for a member"""
         try:
-            return round(self.regular_season_points() / len(list(self.regular_season_matchups())), 2)
+            return round(self.regular_season_points() / len(self.regular_season_matchups()), 2)
         except ZeroDivisionError:
             return 0
 
+    @cached
     def regular_season_matchups(self):
         """Gets all regular season matchups for a member"""
-        return (matchup for matchup in self.matchup_superset() if matchup.type == GameType.REGULAR_SEASON)
+        return tuple(matchup for matchup in self.matchup_superset() if matchup.type == GameType.REGULAR_SEASON)
 
+    @cached
     def regular_season_points(self):
         """Calculates the all-time regular season points for a member"""
         return round(sum(matchup.points_for for matchup in self.regular_season_matchups()), 2)
 
+    @cached
     def regular_season_win_percentage(self):
         """Calculates the regular season win percentage for a member"""
         try:
-            return round(self.regular_season_wins() * 100 / len(list(self.regular_season_matchups())), 2)
+            return round(self.regular_season_wins() * 100 / len(self.regular_season_matchups()), 2)
         except ZeroDivisionError:
             return 0
 
+    @cached
     def regular_season_wins(self):
         """Calculates the number of regular season wins for a member"""
         return len(list(matchup for matchup in self.regular_season_matchups() if matchup.outcome == GameOutcome.WIN))
@@ -207,20 +325,38 @@ class Member:
 
 class Player:
 
-    def __init__(self, espn_id, name, points, position):
+    def __init__(self, espn_id, name, points, position, default_position=None):
+        self.default_position: PlayerPosition | None = self.resolve_default_position(position, default_position)
         self.id: int = espn_id
         self.name: str = name
         self.points: int = round(points, ndigits=2)
         self.position: PlayerPosition = PlayerPosition(position)
 
+    def __setstate__(self, state):
+        # Players pickled before their default position was recorded can only get it from their lineup slot
+        state.setdefault("default_position", self.resolve_default_position(state.get("position")))
+        self.__dict__.update(state)
+
+    @staticmethod
+    def resolve_default_position(position, default_position=None):
+        """Gets the position a player plays, as opposed to the lineup slot they were put in. Without ESPN's default
+        position this is only known if they were in a slot just for their position. Returns None if unknown"""
+        if default_position is not None:
+            return PlayerPosition(default_position)
+        if position in POSITION_SLOTS:
+            return PlayerPosition(position)
+        return None
 
-class Team:
+
+class Team(CachedAggregates):
 
     def __init__(self, division, espn_id, name, member, schedule, year):
+        self._cache: dict = {}
         self.division: int = division
         self.espn_id: str = espn_id
         self.name: str = name
-        self.matchups: set[Matchup] = set()
+        # Matchups are keyed by (opponent ESPN ID, week, GameType) so they can be looked up and replaced in O(1)
+        self.matchups_by_key: dict[tuple[int, int, GameType], Matchup] = {}
         self.member: Member = member
         self.regular_season_losses: int = 0
         self.regular_season_ties: int = 0
@@ -228,10 +364,59 @@ class Team:
         self.schedule: list[int] = schedule
         self.year: int = year
 
-    def add_matchup(self, matchup):
-        """Adds a matchup to the team"""
-        self.matchups.add(matchup)
+    def __getstate__(self):
+        # The league pickles the team's matchups (see FantasyLeague.__getstate__)
+        state = super().__getstate__()
+        state.pop("matchups_by_key", None)
+        return state
+
+    def __setstate__(self, state):
+        state["matchups_by_key"] = {}
+        self.__dict__.update(state)
+
+    def key_matchups(self, matchups):
+        """Stores the given matchups under their keys"""
+        for matchup in matchups:
+            self.matchups_by_key[self.matchup_key(matchup)] = matchup
 
+    @property
+    def matchups(self):
+        """All of the team's matchups"""
+        return self.matchups_by_key.values()
+
+    @staticmethod
+    def matchup_key(matchup):
+        """Returns the key a matchup is stored under"""
+        return matchup.opponent.espn_id, matchup.week, matchup.type
+
+    def add_matchup(self, matchup):
+        """Adds a matchup to the team, replacing the existing one against the same opponent in the same week"""
+        self.upsert_matchup(matchup)
+
+    def get_matchup(self, opponent_espn_id, week, game_type):
+        """Returns the team's matchup against the given opponent in the given week, or None if there isn't one"""
+        return self.matchups_by_key.get((opponent_espn_id, week, game_type))
+
+    def upsert_matchup(self, matchup):
+        """Adds a matchup to the team, or replaces the stale copy of it (EG if ESPN corrected a score).
+        Returns the matchup that was replaced, if any"""
+        key = self.matchup_key(matchup)
+        stale = self.matchups_by_key.get(key)
+        # Keep the lineup already on record if the new copy of the matchup came without one
+        if stale is not None and not matchup.lineup:
+            matchup.lineup = stale.lineup
+        self.matchups_by_key[key] = matchup
+        # The team's aggregates and its member's aggregates now include the new matchup
+        self.clear_cache()
+        self.member.clear_cache()
+        return stale
+
+    @cached
+    def last_matchup(self):
+        """Returns the team's latest matchup, or None if it has not played yet"""
+        return max(self.matchups, key=lambda matchup: matchup.week, default=None)
+
+    @cached
     def made_playoffs(self):
         """Returns a boolean representing whether the team made the playoffs"""
         return any(matchup.type == GameType.PLAYOFF for matchup in self.matchups)
@@ -240,14 +425,17 @@ class Team:
         """Gets all players from all matchups in a team"""
         return set(itertools.chain.from_iterable((matchup.lineup for matchup in self.matchups)))
 
+    @cached
     def playoff_points_scored(self):
         """Calculates the playoff points scored for a team"""
         return round(sum(matchup.points_for for matchup in self.matchups if matchup.type == GameType.PLAYOFF), 2)
 
+    @cached
     def regular_season_points_against(self):
         """Calculates the regular season points scored for a team"""
         return round(sum(matchup.points_against for matchup in self.matchups if matchup.type == GameType.REGULAR_SEASON), 2)
 
+    @cached
     def regular_season_points_scored(self):
         """Calculates the regular season points scored for a team"""
         return round(sum(matchup.points_for for matchup in self.matchups if matchup.type == GameType.REGULAR_SEASON), 2)
@@ -267,7 +455,7 @@ class Team:
     def won_championship(self):
         """Returns a boolean representing whether the team won the championship"""
         if self.year <= self.member.league.max_completed_year:
-            last_game = sorted(self.matchups, key=lambda matchup: matchup.week, reverse=True)[0]
-            return last_game.type == GameType.PLAYOFF and last_game.outcome == GameOutcome.WIN
+            last_game = self.last_matchup()
+            return last_game is not None and last_game.type == GameType.PLAYOFF and last_game.outcome == GameOutcome.WIN
         else:
             return False
@@ -31,3 +31,10 @@ class PlayerPosition(IntEnum):
 
     def __repr__(self):
         return self.name
+
+
+# Lineup slots that can only be filled by a player of that position
+POSITION_SLOTS = (PlayerPosition.QB, PlayerPosition.RB, PlayerPosition.WR, PlayerPosition.TE, PlayerPosition.DEFENSE,
+                  PlayerPosition.KICKER)
+# Positions that can also be played in a FLEX slot
+FLEX_POSITIONS = (PlayerPosition.RB, PlayerPosition.WR, PlayerPosition.TE)
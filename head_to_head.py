@@ -0,0 +1,64 @@
+from __future__ import annotations
+import numpy as np
+
+from fantasy_classes import Member
+from fantasy_enums import GameOutcome, GameType
+from matchup_table import NO_INDEX
+
+# Order of the game type axis in every HeadToHead matrix
+GAME_TYPES = (GameType.REGULAR_SEASON, GameType.PLAYOFF)
+
+
+class HeadToHead:
+    """Member-vs-member totals for every pair of members, split by game type
+
+    Every matrix has the shape (len(GAME_TYPES), members, members), where [type, a, b] holds member a's results
+    against member b. Members are in the same order as MatchupTable.members"""
+
+    def __init__(self, table):
+        self.members: list[Member] = table.members
+        self.member_index: dict[str, int] = {member.name: index for index, member in enumerate(self.members)}
+
+        member_count = len(self.members)
+        shape = (len(GAME_TYPES), member_count, member_count)
+        # Games against the BYE placeholder don't belong to any pair
+        real_games = table.opponent_member != NO_INDEX
+        game_type_index = np.zeros(len(table), dtype=np.int64)
+        for index, game_type in enumerate(GAME_TYPES):
+            game_type_index[table.is_type(game_type)] = index
+        # Flatten (type, member, opponent) so every total is a single bincount
+        cells = np.ravel_multi_index((game_type_index[real_games],
+                                      table.member[real_games],
+                                      table.opponent_member[real_games]), shape)
+
+        def total(values=None, mask=None):
+            weights = None if values is None else values[real_games]
+            if mask is not None:
+                weights = mask[real_games].astype(np.float64) if weights is None else weights * mask[real_games]
+            return np.bincount(cells, weights=weights, minlength=np.prod(shape)).reshape(shape)
+
+        self.games = total().astype(np.int64)
+        self.wins = total(mask=table.is_outcome(GameOutcome.WIN)).astype(np.int64)
+        self.losses = total(mask=table.is_outcome(GameOutcome.LOSS)).astype(np.int64)
+        self.ties = total(mask=table.is_outcome(GameOutcome.TIE)).astype(np.int64)
+        self.points_for = total(table.points_for)
+        self.points_against = total(table.points_against)
+
+    def row(self, member_name, game_types=GAME_TYPES):
+        """Returns a member's totals against every other member, summed over the given game types"""
+        index = self.member_index[member_name]
+        type_indices = [GAME_TYPES.index(game_type) for game_type in game_types]
+        return {"games": self.games[type_indices, index].sum(axis=0),
+                "wins": self.wins[type_indices, index].sum(axis=0),
+                "losses": self.losses[type_indices, index].sum(axis=0),
+                "ties": self.ties[type_indices, index].sum(axis=0),
+                "points_for": self.points_for[type_indices, index].sum(axis=0),
+                "points_against": self.points_against[type_indices, index].sum(axis=0), }
+
+    def win_percentages(self, member_name, game_types=GAME_TYPES):
+        """Returns (opponent, win percentage) for every member the given member has played"""
+        totals = self.row(member_name, game_types)
+        played = np.flatnonzero(totals["games"])
+        played = played[played != self.member_index[member_name]]
+        percentages = np.round(totals["wins"][played] * 100 / totals["games"][played], 2)
+        return [(self.members[opponent], float(percentage)) for opponent, percentage in zip(played, percentages)]
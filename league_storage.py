@@ -0,0 +1,310 @@
+from __future__ import annotations
+import json
+import os
+import pickle
+import sqlite3
+from urllib.request import pathname2url
+
+from fantasy_classes import FantasyLeague, Matchup, Member, Player, Team
+from fantasy_enums import GameOutcome, GameType
+from utility import write_atomically
+
+# File extension used for each way of storing a league
+STORAGE_EXTENSIONS = {
+    "pickle": ".pickle",
+    "sqlite": ".sqlite",
+}
+
+SCHEMA = """
+CREATE TABLE league (
+    id INTEGER PRIMARY KEY,
+    active_year INTEGER NOT NULL,
+    active_year_playoff_slots INTEGER NOT NULL,
+    active_year_regular_season_length INTEGER NOT NULL,
+    espn_s2 TEXT NOT NULL,
+    espn_swid TEXT NOT NULL,
+    founded_year INTEGER NOT NULL,
+    max_completed_year INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE final_weeks (
+    year INTEGER NOT NULL,
+    week INTEGER NOT NULL,
+    PRIMARY KEY (year, week)
+);
+CREATE TABLE members (
+    id TEXT PRIMARY KEY,
+    joined_year INTEGER NOT NULL,
+    left_year INTEGER NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE teams (
+    id INTEGER PRIMARY KEY,
+    division INTEGER,
+    espn_id INTEGER NOT NULL,
+    member_id TEXT NOT NULL REFERENCES members (id),
+    name TEXT NOT NULL,
+    regular_season_losses INTEGER NOT NULL,
+    regular_season_ties INTEGER NOT NULL,
+    regular_season_wins INTEGER NOT NULL,
+    schedule TEXT NOT NULL,
+    year INTEGER NOT NULL
+);
+CREATE TABLE matchups (
+    id INTEGER PRIMARY KEY,
+    opponent_id INTEGER REFERENCES teams (id),
+    outcome TEXT NOT NULL,
+    points_against REAL NOT NULL,
+    points_for REAL NOT NULL,
+    team_id INTEGER NOT NULL REFERENCES teams (id),
+    type TEXT NOT NULL,
+    week INTEGER NOT NULL
+);
+CREATE TABLE lineups (
+    default_position INTEGER,
+    matchup_id INTEGER NOT NULL REFERENCES matchups (id),
+    name TEXT NOT NULL,
+    player_id INTEGER NOT NULL,
+    points REAL NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE TABLE record_book (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+CREATE INDEX lineup_columns ON lineups (matchup_id, position, default_position, points);
+"""
+# The columns of every lineup the lineup records are built from, read straight out of the lineup_columns index without
+# touching the rest of the lineups table
+LINEUP_COLUMNS_QUERY = "SELECT matchup_id, position, default_position, points FROM lineups ORDER BY matchup_id"
+
+
+class LineupColumns:
+    """The columns of every player in every lineup that the lineup records are built from, one entry per player, so
+    that they can be built without keeping a Player for each of them"""
+
+    def __init__(self):
+        self.default_positions: list[int | None] = []
+        self.matchups: list[Matchup] = []
+        self.points: list[float] = []
+        self.slots: list[int] = []
+
+    def add(self, matchup, slot, default_position, points):
+        """Adds a player in a matchup's lineup, with the position they play (or None if it isn't known)"""
+        self.default_positions.append(default_position)
+        self.matchups.append(matchup)
+        self.points.append(points)
+        self.slots.append(slot)
+
+
+def league_filename(directory, league_name, storage):
+    """Returns the path a league is stored at for the given storage type"""
+    return os.path.join(directory, f"{league_name}{STORAGE_EXTENSIONS[storage]}")
+
+
+def save_league(league, path, record_book=None):
+    """Stores a league at the given path, as SQLite if the path ends in .sqlite and as a pickle otherwise. SQLite also
+    stores the leaderboards of the league's RecordBook, if one is given, for the site to serve without the league"""
+    if path.endswith(STORAGE_EXTENSIONS["sqlite"]):
+        save_league_sqlite(league, path, record_book)
+    else:
+        # Write to a temporary file and rename it so the site never loads a half-written league
+        write_atomically(path, "wb", lambda f: pickle.dump(league, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def load_league(path, lineups=True):
+    """Loads the league stored at the given path. Players are left out of the matchups' lineups if lineups is False"""
+    if path.endswith(STORAGE_EXTENSIONS["sqlite"]):
+        return load_league_sqlite(path, lineups=lineups)
+    with open(path, "rb") as f:
+        league = pickle.load(f)
+    # A pickle has to be loaded with its players, but they can still be dropped so they don't take up memory
+    if not lineups:
+        drop_lineups(league)
+    return league
+
+
+def load_league_lineup_columns(path):
+    """Loads the league stored at the given path without any players, along with the LineupColumns of their lineups.
+    Returns (league, LineupColumns)"""
+    if path.endswith(STORAGE_EXTENSIONS["sqlite"]):
+        try:
+            league, matchups, lineup_rows = read_league_sqlite(path, LINEUP_COLUMNS_QUERY)
+        except sqlite3.OperationalError:
+            # Databases written before default positions were stored don't have every column, so load their players
+            lineup_rows = None
+        if lineup_rows is not None:
+            columns = LineupColumns()
+            for row in lineup_rows:
+                default_position = Player.resolve_default_position(row["position"], row["default_position"])
+                columns.add(matchups[row["matchup_id"]], row["position"],
+                            None if default_position is None else default_position.value, round(row["points"], 2))
+            return league, columns
+
+    # A pickle has to be loaded with its players, so their columns are copied out before they are dropped
+    league = load_league(path)
+    columns = LineupColumns()
+    for matchup in league.matchup_superset():
+        for player in matchup.lineup:
+            columns.add(matchup, player.position.value,
+                        None if player.default_position is None else player.default_position.value, player.points)
+    drop_lineups(league)
+    return league, columns
+
+
+def drop_lineups(league):
+    """Empties every matchup's lineup, freeing the memory held by the players"""
+    for matchup in league.matchup_superset():
+        matchup.lineup.clear()
+
+
+def save_league_sqlite(league, path, record_book=None):
+    """Writes a league (and its record book, if one is given) to a new SQLite database in a single transaction, then
+    renames it into place"""
+    temp_path = f"{path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.executescript(SCHEMA)
+        with connection:
+            connection.execute("INSERT INTO league VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (league.id, league.active_year, league.active_year_playoff_slots,
+                                league.active_year_regular_season_length, league.espn_s2, league.espn_swid,
+                                league.founded_year, league.max_completed_year, league.name))
+            connection.executemany("INSERT INTO final_weeks VALUES (?, ?)", sorted(league.final_weeks))
+            connection.executemany("INSERT INTO members VALUES (?, ?, ?, ?)",
+                                   [(member.id, member.joined_year, member.left_year, member.name)
+                                    for member in league.members])
+
+            # Teams are numbered here, so that matchups can point at the exact Team, even if it was co-owned
+            teams = sorted(league.team_superset(), key=lambda team: (team.year, team.espn_id, team.member.id))
+            team_ids = {team: team_id for team_id, team in enumerate(teams, start=1)}
+            connection.executemany("INSERT INTO teams VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(team_ids[team], team.division, team.espn_id, team.member.id, team.name,
+                                     team.regular_season_losses, team.regular_season_ties, team.regular_season_wins,
+                                     json.dumps(team.schedule), team.year) for team in teams])
+
+            matchup_rows = []
+            lineup_rows = []
+            for team in teams:
+                for matchup in sorted(team.matchups, key=lambda matchup: (matchup.week, matchup.type.value)):
+                    matchup_id = len(matchup_rows) + 1
+                    # BYE weeks are played against a placeholder team, which is stored as no opponent
+                    matchup_rows.append((matchup_id, team_ids.get(matchup.opponent), matchup.outcome.name,
+                                         matchup.points_against, matchup.points_for, team_ids[team],
+                                         matchup.type.name, matchup.week))
+                    lineup_rows.extend((player.default_position, matchup_id, player.name, player.id, player.points,
+                                        player.position.value) for player in matchup.lineup)
+            connection.executemany("INSERT INTO matchups VALUES (?, ?, ?, ?, ?, ?, ?, ?)", matchup_rows)
+            connection.executemany("INSERT INTO lineups VALUES (?, ?, ?, ?, ?, ?)", lineup_rows)
+            if record_book is not None:
+                connection.executemany("INSERT INTO record_book VALUES (?, ?, ?)", record_book.stored_rows())
+    finally:
+        connection.close()
+    os.replace(temp_path, path)
+
+
+def connect_read_only(path):
+    """Opens a SQLite league for reading, without creating it if it doesn't exist"""
+    connection = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro", uri=True)
+    connection.row_factory = sqlite3.Row
+    return connection
+
+
+def load_record_book_rows(path):
+    """Reads the (kind, name, JSON) rows of the record book stored with a SQLite league, without any of the league.
+    Returns None for a pickle, or a database stored without a record book"""
+    if not path.endswith(STORAGE_EXTENSIONS["sqlite"]):
+        return None
+    connection = connect_read_only(path)
+    try:
+        rows = connection.execute("SELECT kind, name, value FROM record_book ORDER BY kind, name").fetchall()
+    except sqlite3.OperationalError:
+        # Databases written before record books were stored don't have the table
+        return None
+    finally:
+        connection.close()
+    return [tuple(row) for row in rows] or None
+
+
+def load_league_sqlite(path, lineups=True):
+    """Rebuilds a FantasyLeague and everything in it from a SQLite database"""
+    league, matchups, lineup_rows = read_league_sqlite(path, "SELECT * FROM lineups" if lineups else None)
+
+    # Databases written before default positions were stored don't have them
+    has_default_position = bool(lineup_rows) and "default_position" in lineup_rows[0].keys()
+    for row in lineup_rows:
+        default_position = row["default_position"] if has_default_position else None
+        matchups[row["matchup_id"]].add_player(Player(espn_id=row["player_id"], name=row["name"],
+                                                      points=row["points"], position=row["position"],
+                                                      default_position=default_position))
+
+    return league
+
+
+def read_league_sqlite(path, lineup_query=None):
+    """Rebuilds a FantasyLeague from a SQLite database, without any players, and reads the lineup rows the given
+    query selects. Returns (league, dict[matchup id: Matchup], lineup rows)"""
+    connection = connect_read_only(path)
+    try:
+        # Read everything in one transaction so a league being written at the same time can't be mixed in
+        with connection:
+            connection.execute("BEGIN")
+            league_row = connection.execute("SELECT * FROM league").fetchone()
+            final_week_rows = connection.execute("SELECT year, week FROM final_weeks").fetchall()
+            member_rows = connection.execute("SELECT * FROM members").fetchall()
+            team_rows = connection.execute("SELECT * FROM teams ORDER BY id").fetchall()
+            matchup_rows = connection.execute("SELECT * FROM matchups ORDER BY id").fetchall()
+            lineup_rows = connection.execute(lineup_query).fetchall() if lineup_query is not None else []
+    finally:
+        connection.close()
+
+    league = FantasyLeague(espn_s2=league_row["espn_s2"], espn_swid=league_row["espn_swid"],
+                           founded_year=league_row["founded_year"], league_id=league_row["id"])
+    league.update_active_year(league_row["active_year"])
+    league.update_active_year_playoff_slots(league_row["active_year_playoff_slots"])
+    league.update_active_year_regular_season_length(league_row["active_year_regular_season_length"])
+    league.update_max_completed_year(league_row["max_completed_year"])
+    league.update_name(league_row["name"])
+    for row in final_week_rows:
+        league.mark_week_final(row["year"], row["week"])
+
+    for row in member_rows:
+        member = Member(league=league, member_id=row["id"], name=row["name"])
+        member.update_joined_year(row["joined_year"])
+        member.update_left_year(row["left_year"])
+        league.add_member(member)
+
+    teams = {}
+    for row in team_rows:
+        member = league.get_member(row["member_id"])
+        team = Team(division=row["division"], espn_id=row["espn_id"], name=row["name"], member=member,
+                    schedule=json.loads(row["schedule"]), year=row["year"])
+        team.update_regular_season_losses(row["regular_season_losses"])
+        team.update_regular_season_ties(row["regular_season_ties"])
+        team.update_regular_season_wins(row["regular_season_wins"])
+        member.add_team(team)
+        teams[row["id"]] = team
+
+    # BYE weeks are played against a placeholder team, like the one update_league.py uses
+    bye_league = FantasyLeague(espn_s2="", espn_swid="", founded_year=99999, league_id=99999)
+    bye_team = Team(division=99999, espn_id=99999, name="", schedule=[], year=99999,
+                    member=Member(member_id="", league=bye_league, name=""))
+
+    matchups = {}
+    team_matchups = {team: [] for team in teams.values()}
+    for row in matchup_rows:
+        team = teams[row["team_id"]]
+        opponent = teams[row["opponent_id"]] if row["opponent_id"] is not None else bye_team
+        matchup = Matchup(opponent=opponent, outcome=GameOutcome[row["outcome"]],
+                          points_against=row["points_against"], points_for=row["points_for"], team=team,
+                          game_type=GameType[row["type"]], week=row["week"])
+        matchups[row["id"]] = matchup
+        team_matchups[team].append(matchup)
+    for team, matchups_for_team in team_matchups.items():
+        team.key_matchups(matchups_for_team)
+
+    return league, matchups, lineup_rows
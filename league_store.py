@@ -0,0 +1,155 @@
+from __future__ import annotations
+import gc
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from league_storage import load_league_lineup_columns, load_record_book_rows
+from record_book import RecordBook, StoredRecordBook, get_record_book
+
+
+def file_version(*paths):
+    """Builds a version stamp from the modification time and size of each file"""
+    stamps = []
+    for path in paths:
+        stat = os.stat(path)
+        stamps.append(f"{stat.st_mtime_ns}-{stat.st_size}")
+    return "-".join(stamps)
+
+
+class WatchedJsonFile:
+    """The contents of a JSON file, only read again when the file changes"""
+
+    def __init__(self, path, default=None):
+        self.default = default
+        self.path: str = path
+        # (version, contents) of the last read, swapped out in one assignment so readers never see a mix
+        self._loaded: tuple[str | None, object] = (None, default)
+
+    def get(self):
+        """Returns the file's contents, reading it again if it has changed. Returns the default if it doesn't exist"""
+        return self.load()[1]
+
+    def load(self):
+        """Returns (version, contents) for the file, reading it again if it has changed"""
+        try:
+            version = file_version(self.path)
+        except OSError:
+            return None, self.default
+        if version != self._loaded[0]:
+            with open(self.path, "r") as f:
+                self._loaded = (version, json.load(f))
+        return self._loaded
+
+    def version(self):
+        """Returns the version stamp of the file, or None if it doesn't exist"""
+        return self.load()[0]
+
+
+class LeagueData:
+    """Everything loaded from disk for one version of the data. Never modified once built"""
+
+    def __init__(self, record_book, standings_snapshot, version, load_seconds):
+        self.load_seconds: float = load_seconds
+        self.loaded_at: float = time.time()
+        self.record_book: RecordBook | StoredRecordBook = record_book
+        self.standings_snapshot: list[dict] = standings_snapshot
+        self.version: str = version
+
+
+class LeagueStore:
+    """Holds the current LeagueData and swaps in a new one, loaded off the request path, when the files change"""
+
+    def __init__(self, league_path, snapshot_path, check_interval):
+        self.check_interval: float = check_interval
+        self.current: LeagueData | None = None
+        self.league_path: str = league_path
+        self.snapshot_path: str = snapshot_path
+        self._last_check: float = 0
+        self._lock = threading.Lock()
+        self._reloading: bool = False
+
+    def data_version(self):
+        """Returns the version stamp of the files currently on disk"""
+        return file_version(self.league_path, self.snapshot_path)
+
+    def load(self):
+        """Reads the league and snapshot from disk and builds a complete LeagueData from them"""
+        start = time.perf_counter()
+        version = self.data_version()
+        # A SQLite league comes with the leaderboards update_league.py built from it, which is all the site serves, so
+        # the league itself only has to be loaded if they weren't stored or were built by different code
+        league = lineup_columns = None
+        record_book_rows = load_record_book_rows(self.league_path)
+        if record_book_rows is None or not StoredRecordBook.is_current(record_book_rows):
+            # The site never shows the players, so the league is loaded without them, along with just the columns of
+            # their lineups that the lineup records are built from
+            league, lineup_columns = load_league_lineup_columns(self.league_path)
+        with open(self.snapshot_path, "r") as f:
+            standings_snapshot = json.load(f)
+        # If either file was replaced while it was being read, the pair may not match, so try again later
+        if self.data_version() != version:
+            raise OSError(f"{self.league_path} changed while it was being loaded")
+        load_seconds = time.perf_counter() - start
+
+        if league is None:
+            record_book = StoredRecordBook(record_book_rows, standings_snapshot, version)
+        else:
+            # The lineup columns are only needed to build the record book, so they aren't kept
+            record_book = get_record_book(league, standings_snapshot, version, lineup_columns)
+        return LeagueData(record_book, standings_snapshot, version, load_seconds)
+
+    def preload(self):
+        """Loads the current data so that processes forked afterwards (the uWSGI workers) share it copy-on-write"""
+        # Loading only creates objects that stay alive, so collecting while doing so is wasted work
+        gc.disable()
+        try:
+            self.current = self.load()
+        finally:
+            # Move everything loaded so far into the permanent generation, where collections in the workers never
+            # traverse it. Otherwise they would write to its pages and each worker would end up with its own copy
+            gc.freeze()
+            gc.enable()
+
+    def get(self):
+        """Returns the current data, kicking off a background reload if the files on disk have changed"""
+        if self.current is None:
+            # Nothing was preloaded, so the first caller has to wait for the data to be loaded
+            with self._lock:
+                if self.current is None:
+                    self.current = self.load()
+        if self.check_interval > 0 and time.monotonic() - self._last_check >= self.check_interval:
+            self._last_check = time.monotonic()
+            self.reload_if_changed()
+        return self.current
+
+    def has_changed(self):
+        """Returns a boolean representing whether the files on disk no longer match the current data"""
+        try:
+            return self.current is None or self.data_version() != self.current.version
+        except OSError:
+            # The files are being replaced right now, so keep serving what is loaded
+            return False
+
+    def reload_if_changed(self):
+        """Starts a background reload if the files on disk no longer match the current data"""
+        if not self.has_changed():
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, daemon=True).start()
+
+    def _reload(self):
+        """Loads the new data and swaps it in with a single assignment, so readers see the old or new data, never a mix"""
+        try:
+            self.current = self.load()
+        except (OSError, EOFError, pickle.UnpicklingError, sqlite3.Error, json.JSONDecodeError) as e:
+            print(f"Could not reload league data, continuing with the data already loaded: {e}")
+        finally:
+            with self._lock:
+                self._reloading = False
@@ -0,0 +1,108 @@
+from __future__ import annotations
+import numpy as np
+
+from fantasy_enums import FLEX_POSITIONS, POSITION_SLOTS, PlayerPosition
+# Lineup slots that don't count towards a team's score
+NON_STARTING_SLOTS = (PlayerPosition.BENCH.value, PlayerPosition.IR.value)
+# Positions that can be played in a FLEX slot, along with FLEX itself for starters whose position isn't known
+FLEX_SLOT_POSITIONS = tuple(position.value for position in FLEX_POSITIONS) + (PlayerPosition.FLEX.value,)
+# Stands in for the position of a starter whose position isn't known, so they can only fill the slot they were in
+UNKNOWN_POSITION = -1
+
+
+def rank_within_groups(*keys):
+    """Sorts rows by the given keys (the last key is the primary one, like np.lexsort) and numbers each row by its
+    place within the group of rows sharing every key but the first. Returns (order, rank), where rank[i] is the
+    place of row order[i]"""
+    order = np.lexsort(keys)
+    group_keys = np.stack([key[order] for key in keys[1:]])
+    # A new group starts wherever any of the grouping keys changes
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = np.any(group_keys[:, 1:] != group_keys[:, :-1], axis=0)
+    positions = np.arange(len(order))
+    return order, positions - np.maximum.accumulate(np.where(starts, positions, 0))
+
+
+def lineup_efficiency(lineup_points, optimal_points):
+    """Calculates the percentage of the optimal lineup's points that the lineup that was played scored"""
+    return np.round(np.divide(lineup_points * 100, optimal_points, out=np.zeros(len(optimal_points)),
+                              where=optimal_points > 0), 2)
+
+
+class LineupTable:
+    """Actual and optimal lineup points for every matchup in a MatchupTable, computed in one vectorized pass over every
+    player in every lineup
+
+    The optimal lineup fills each season's starting slots with the highest scoring players that could have played
+    them. Every column is aligned with the rows of the MatchupTable. Matchups without a lineup (IE before 2018), or
+    with benched players whose positions aren't known, are left out of has_lineup"""
+
+    def __init__(self, table, lineup_columns=None):
+        # One row per player in any lineup, taken from the LineupColumns (see league_storage.py) if the league was
+        # loaded without its players
+        if lineup_columns is not None:
+            table_rows = {matchup: row for row, matchup in enumerate(table.matchups)}
+            matchup_rows = [table_rows[matchup] for matchup in lineup_columns.matchups]
+            slots = lineup_columns.slots
+            positions = [UNKNOWN_POSITION if position is None else position
+                         for position in lineup_columns.default_positions]
+            points = lineup_columns.points
+        else:
+            matchup_rows = []
+            slots = []
+            positions = []
+            points = []
+            for row, matchup in enumerate(table.matchups):
+                for player in matchup.lineup:
+                    matchup_rows.append(row)
+                    slots.append(player.position.value)
+                    positions.append(UNKNOWN_POSITION if player.default_position is None
+                                     else player.default_position.value)
+                    points.append(player.points)
+        matchup_rows = np.array(matchup_rows, dtype=np.int64)
+        slots = np.array(slots, dtype=np.int64)
+        positions = np.array(positions, dtype=np.int64)
+        points = np.array(points, dtype=np.float64)
+
+        matchup_count = len(table)
+        starters = ~np.isin(slots, NON_STARTING_SLOTS)
+        # Without the position of every benched player, there's no telling what the optimal lineup was. Players
+        # fetched before positions were recorded only have one if their lineup slot gave it away
+        unknown_bench = (slots == PlayerPosition.BENCH.value) & (positions == UNKNOWN_POSITION)
+        self.has_lineup: np.ndarray = ((np.bincount(matchup_rows, minlength=matchup_count) > 0) &
+                                       (np.bincount(matchup_rows, weights=unknown_bench, minlength=matchup_count) == 0))
+        self.lineup_points: np.ndarray = np.round(
+            np.bincount(matchup_rows, weights=points * starters, minlength=matchup_count), 2)
+
+        # Every slot a team had to fill in a season, taken as the most starters any lineup had in it that season
+        years, year_rows = np.unique(table.year, return_inverse=True)
+        player_years = year_rows[matchup_rows]
+        slot_count = max(PlayerPosition).value + 1
+        weekly_slots = np.zeros((matchup_count, slot_count), dtype=np.int64)
+        np.add.at(weekly_slots, (matchup_rows[starters], slots[starters]), 1)
+        season_slots = np.zeros((len(years), slot_count), dtype=np.int64)
+        np.maximum.at(season_slots, year_rows, weekly_slots)
+
+        # A starter whose position isn't known can only fill their own slot, and injured players can't be started
+        positions = np.where(starters & (positions == UNKNOWN_POSITION), slots, positions)
+        positions[slots == PlayerPosition.IR.value] = UNKNOWN_POSITION
+        eligible = positions != UNKNOWN_POSITION
+
+        # Fill each position's own slots with that position's best players first. FLEX slots take any of several
+        # positions, so they are filled last from whoever is left, which can't do worse than any other assignment
+        chosen = np.zeros(len(points), dtype=bool)
+        position_slots = np.isin(positions, [position.value for position in POSITION_SLOTS]) & eligible
+        order, rank = rank_within_groups(-points, positions, matchup_rows)
+        needed = season_slots[player_years[order], positions[order]]
+        chosen[order] = position_slots[order] & (rank < needed)
+
+        flexible = eligible & ~chosen & np.isin(positions, FLEX_SLOT_POSITIONS)
+        order, rank = rank_within_groups(-points, np.where(flexible, 0, 1), matchup_rows)
+        needed = season_slots[player_years[order], PlayerPosition.FLEX.value]
+        chosen[order] |= flexible[order] & (rank < needed)
+
+        self.optimal_points: np.ndarray = np.round(
+            np.bincount(matchup_rows, weights=points * chosen, minlength=matchup_count), 2)
+        # The lineup that was played is always one of the options, so the optimal one can't score less
+        self.optimal_points = np.maximum(self.optimal_points, self.lineup_points)
+        self.points_left_on_bench: np.ndarray = np.round(self.optimal_points - self.lineup_points, 2)
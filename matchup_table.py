@@ -0,0 +1,107 @@
+from __future__ import annotations
+import numpy as np
+
+from fantasy_classes import FantasyLeague, Matchup, Member, Team
+from fantasy_enums import GameOutcome, GameType
+
+# Index used for opponents that are not part of the league (IE the placeholder team for BYE weeks)
+NO_INDEX = -1
+
+
+class MatchupTable:
+    """Struct-of-arrays copy of every matchup in a league, so record queries can run as vectorized numpy operations
+
+    Row i of every column describes self.matchups[i]. Teams and members are referred to by their position in
+    self.teams and self.members"""
+
+    def __init__(self, league):
+        self.league: FantasyLeague = league
+        self.members: list[Member] = sorted(league.members, key=lambda member: member.id)
+        self.teams: list[Team] = sorted(league.team_superset(), key=lambda team: (team.year, team.espn_id))
+        # Sort the matchups so the table (and any ties in the records built from it) is the same on every load
+        self.matchups: list[Matchup] = sorted(league.matchup_superset(),
+                                              key=lambda matchup: (matchup.team.year, matchup.week, matchup.team.espn_id))
+
+        member_index = {member: index for index, member in enumerate(self.members)}
+        team_index = {team: index for index, team in enumerate(self.teams)}
+        matchups = self.matchups
+
+        self.year = np.fromiter((matchup.team.year for matchup in matchups), dtype=np.int32, count=len(matchups))
+        self.week = np.fromiter((matchup.week for matchup in matchups), dtype=np.int32, count=len(matchups))
+        self.team = np.fromiter((team_index[matchup.team] for matchup in matchups), dtype=np.int32, count=len(matchups))
+        self.opponent = np.fromiter((team_index.get(matchup.opponent, NO_INDEX) for matchup in matchups),
+                                    dtype=np.int32, count=len(matchups))
+        self.member = np.fromiter((member_index[matchup.team.member] for matchup in matchups),
+                                  dtype=np.int32, count=len(matchups))
+        self.opponent_member = np.fromiter((member_index.get(matchup.opponent.member, NO_INDEX) for matchup in matchups),
+                                           dtype=np.int32, count=len(matchups))
+        self.type = np.fromiter((matchup.type.value for matchup in matchups), dtype=np.int8, count=len(matchups))
+        self.outcome = np.fromiter((matchup.outcome.value for matchup in matchups), dtype=np.int8, count=len(matchups))
+        self.points_for = np.fromiter((matchup.points_for for matchup in matchups), dtype=np.float64, count=len(matchups))
+        self.points_against = np.fromiter((matchup.points_against for matchup in matchups),
+                                          dtype=np.float64, count=len(matchups))
+
+        # Per-team columns
+        self.team_year = np.fromiter((team.year for team in self.teams), dtype=np.int32, count=len(self.teams))
+        self.team_member = np.fromiter((member_index[team.member] for team in self.teams),
+                                       dtype=np.int32, count=len(self.teams))
+
+    def __len__(self):
+        return len(self.matchups)
+
+    def is_type(self, game_type):
+        """Returns a mask of the matchups of the given GameType"""
+        return self.type == game_type.value
+
+    def is_outcome(self, outcome):
+        """Returns a mask of the matchups with the given GameOutcome"""
+        return self.outcome == outcome.value
+
+    def top(self, values, mask=None, count=None, descending=True):
+        """Returns the row indices of the matchups (or teams, or members) with the highest or lowest values"""
+        indices = np.arange(len(values)) if mask is None else np.flatnonzero(mask)
+        order = np.argsort(-values[indices] if descending else values[indices], kind="stable")
+        return indices[order[:count]]
+
+    def sum_by_team(self, values, mask=None):
+        """Sums a matchup column into one value per team"""
+        return self._sum_by(self.team, len(self.teams), values, mask)
+
+    def sum_by_member(self, values, mask=None):
+        """Sums a matchup column into one value per member"""
+        return self._sum_by(self.member, len(self.members), values, mask)
+
+    def count_by_team(self, mask=None):
+        """Counts the matchups for each team"""
+        return self._sum_by(self.team, len(self.teams), None, mask).astype(np.int64)
+
+    def count_by_member(self, mask=None):
+        """Counts the matchups for each member"""
+        return self._sum_by(self.member, len(self.members), None, mask).astype(np.int64)
+
+    @staticmethod
+    def _sum_by(groups, group_count, values, mask):
+        """Group-by sum of values (or a count, if there are no values) over the rows selected by the mask"""
+        if mask is not None:
+            groups = groups[mask]
+            values = None if values is None else values[mask]
+        return np.bincount(groups, weights=values, minlength=group_count)
+
+    def last_game_by_team(self):
+        """Returns the row index of each team's latest matchup, or NO_INDEX for teams without matchups"""
+        last_game = np.full(len(self.teams), NO_INDEX, dtype=np.int64)
+        # Sorted by team then week, the last row for each team is its latest game
+        order = np.lexsort((self.week, self.team))
+        sorted_teams = self.team[order]
+        group_ends = np.flatnonzero(np.diff(sorted_teams, append=NO_INDEX) != 0)
+        last_game[sorted_teams[group_ends]] = order[group_ends]
+        return last_game
+
+    def championships_by_team(self):
+        """Returns a mask of the teams that won their league's championship"""
+        last_game = self.last_game_by_team()
+        has_games = last_game != NO_INDEX
+        won_last_game = np.zeros(len(self.teams), dtype=bool)
+        won_last_game[has_games] = ((self.type[last_game[has_games]] == GameType.PLAYOFF.value) &
+                                    (self.outcome[last_game[has_games]] == GameOutcome.WIN.value))
+        return won_last_game & (self.team_year <= self.league.max_completed_year)
@@ -0,0 +1,42 @@
+import argparse
+
+# Fields read from /proc/<pid>/smaps_rollup, all in kB
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def process_memory(pid="self"):
+    """Reads a process's resident memory, split into shared and private pages, from /proc/<pid>/smaps_rollup.
+    Returns a dict[field: kB], or None if it can't be read (EG not on Linux 4.14 or later)"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                field, _, value = line.partition(":")
+                if field in MEMORY_FIELDS:
+                    memory[field] = int(value.split()[0])
+    except (OSError, ValueError):
+        return None
+    return memory
+
+
+def format_memory(memory):
+    """Formats the memory of a process as a single line, in MB"""
+    return ", ".join(f"{field} {memory.get(field, 0) / 1024:.1f} MB" for field in MEMORY_FIELDS)
+
+
+if __name__ == "__main__":
+    # EG python memory_usage.py $(pgrep -f fantasy_football_records.ini)
+    parser = argparse.ArgumentParser(description="Show how much of each process's memory is shared or private")
+    parser.add_argument("pids", nargs="+", help="Process IDs, such as the uWSGI master and its workers")
+    args = parser.parse_args()
+    total = dict.fromkeys(MEMORY_FIELDS, 0)
+    for pid in args.pids:
+        memory = process_memory(pid)
+        if memory is None:
+            print(f"{pid}: could not read /proc/{pid}/smaps_rollup")
+            continue
+        print(f"{pid}: {format_memory(memory)}")
+        for field in MEMORY_FIELDS:
+            total[field] += memory.get(field, 0)
+    # Pss splits shared pages between the processes sharing them, so its total is the real cost of all of them
+    print(f"Total: {format_memory(total)}")
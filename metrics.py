@@ -0,0 +1,167 @@
+from __future__ import annotations
+import functools
+import os
+import threading
+import time
+from flask import g
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Server-Timing descriptions of each phase of a request
+PHASES = {
+    "data": "Preparing the data",
+    "render": "Rendering the template or JSON",
+    "total": "Whole request",
+}
+
+
+class Histogram:
+    """Cumulative histogram of observed values, kept the way Prometheus expects them"""
+
+    def __init__(self, buckets):
+        self.buckets: tuple[float, ...] = buckets
+        self.count: int = 0
+        # One count per bucket, plus the +Inf bucket
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0
+
+    def observe(self, value):
+        """Adds a value to the histogram"""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """Returns (upper bound, number of values at or under it) for each bucket, ending with +Inf"""
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        total = 0
+        cumulative = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class RequestMetrics:
+    """Request duration histograms for each route and phase, for this process"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets: tuple[float, ...] = buckets
+        # Histograms are keyed by (route, phase, cache status)
+        self.durations: dict[tuple[str, str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, phase, cache, seconds):
+        """Adds how long a phase of a request to the route took"""
+        key = (route, phase, cache)
+        with self._lock:
+            histogram = self.durations.get(key)
+            if histogram is None:
+                histogram = self.durations[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def exposition(self, worker):
+        """Formats the histograms in the Prometheus text format, labelled with the given worker label"""
+        lines = ["# HELP records_request_duration_seconds Time spent in each phase of a request, by route",
+                 "# TYPE records_request_duration_seconds histogram"]
+        with self._lock:
+            for (route, phase, cache), histogram in sorted(self.durations.items()):
+                labels = f'{worker},route="{escape_label(route)}",phase="{phase}",cache="{cache}"'
+                for bound, count in histogram.cumulative_counts():
+                    lines.append(f'records_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f"records_request_duration_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"records_request_duration_seconds_count{{{labels}}} {histogram.count}")
+        return lines
+
+
+def escape_label(value):
+    """Escapes a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def metric(name, metric_type, description, value, labels=""):
+    """Formats a single gauge or counter in the Prometheus text format, with the given comma-separated labels"""
+    return [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}", f"{name}{{{labels}}} {value}"]
+
+
+def worker_label():
+    """Gets the label that tells this worker's series apart from the other workers', each of which keeps its own: the
+    uWSGI worker number, or the process ID when not running under uWSGI"""
+    worker = uwsgi.worker_id() if uwsgi is not None else os.getpid()
+    return f'worker="{worker}"'
+
+
+def start_request():
+    """Starts timing the current request"""
+    g.request_start = time.perf_counter()
+    g.phase_seconds = {}
+    g.cache_status = "none"
+
+
+def add_phase(phase, seconds):
+    """Adds time spent in a phase of the current request"""
+    phase_seconds = g.get("phase_seconds")
+    if phase_seconds is not None:
+        phase_seconds[phase] = phase_seconds.get(phase, 0) + seconds
+
+
+def set_cache_status(status):
+    """Records how the response cache served the current request: "hit", "miss", or "none" if it wasn't used"""
+    g.cache_status = status
+
+
+def timed_render(render):
+    """Wraps Flask's render_template so all of the time it takes counts as rendering. Flask's before_render_template
+    signal only fires once the template has been loaded and compiled, which would leave that counted as data"""
+    @functools.wraps(render)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        html = render(*args, **kwargs)
+        add_phase("render", time.perf_counter() - start)
+        return html
+    return wrapper
+
+
+def timed_build(build):
+    """Wraps a function that builds a response body so the time it takes, less any template rendering inside it, is
+    counted as data preparation"""
+    def wrapper():
+        set_cache_status("miss")
+        render_before = g.get("phase_seconds", {}).get("render", 0)
+        start = time.perf_counter()
+        body = build()
+        elapsed = time.perf_counter() - start
+        add_phase("data", elapsed - (g.get("phase_seconds", {}).get("render", 0) - render_before))
+        return body
+    return wrapper
+
+
+def finish_request(response, route, request_metrics):
+    """Adds a Server-Timing header for the current request, and its phases to the histograms"""
+    request_start = g.get("request_start")
+    if request_start is None:
+        return response
+    phase_seconds = dict(g.phase_seconds)
+    # The client already had the response, so it was neither served from the cache nor built
+    if response.status_code == 304:
+        set_cache_status("not_modified")
+    phase_seconds["total"] = time.perf_counter() - request_start
+    timings = [f'{phase};dur={seconds * 1000:.2f};desc="{PHASES.get(phase)}"'
+               for phase, seconds in phase_seconds.items()]
+    if g.cache_status != "none":
+        timings.append(f'cache;desc="{g.cache_status}"')
+    response.headers["Server-Timing"] = ", ".join(timings)
+    if route is not None:
+        for phase, seconds in phase_seconds.items():
+            request_metrics.observe(route, phase, g.cache_status, seconds)
+    return response
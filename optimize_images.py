@@ -0,0 +1,123 @@
+import argparse
+import glob
+import hashlib
+import io
+import json
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+from utility import write_atomically
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+MEET_THE_MANAGERS_ASSETS = os.path.join(dir_path, "static/meet_the_managers")
+OPTIMIZED_DIRECTORY = "optimized"
+MANIFEST_FILENAME = "manifest.json"
+
+# Widths to make each image at. Images are never scaled up, so smaller images get fewer of them
+WIDTHS = (320, 640, 960, 1280)
+# Pillow format name, file extension, and save options for each format made
+FORMATS = {
+    "webp": ("WEBP", ".webp", {"quality": 80, "method": 6}),
+    "jpeg": ("JPEG", ".jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def content_hash(data):
+    """Calculates the short hash used in the filename of an image variant"""
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def variant_widths(width):
+    """Gets the widths to make an image of the given width at"""
+    return [variant_width for variant_width in WIDTHS if variant_width < width] + [min(width, max(WIDTHS))]
+
+
+def build_variants(source_path, output_directory):
+    """Makes resized copies of an image in every format, named by their content so they can be cached forever.
+    Returns the manifest entry describing them"""
+    with Image.open(source_path) as original:
+        # Apply any rotation from the camera, and drop everything (EG EXIF data) that the browser doesn't need
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    variants = {name: [] for name in FORMATS}
+    for width in variant_widths(image.width):
+        height = round(image.height * width / image.width)
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+        for name, (pillow_format, extension, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, pillow_format, **options)
+            data = buffer.getvalue()
+            filename = f"{stem}-{width}w-{content_hash(data)}{extension}"
+            if not os.path.exists(os.path.join(output_directory, filename)):
+                write_atomically(os.path.join(output_directory, filename), "wb", lambda f: f.write(data))
+            variants[name].append({"bytes": len(data), "src": f"{OPTIMIZED_DIRECTORY}/{filename}", "width": width})
+
+    largest = variants["jpeg"][-1]["width"]
+    return {"height": round(image.height * largest / image.width), "variants": variants, "width": largest}
+
+
+def file_hash(path):
+    """Calculates the sha256 of a file's contents"""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def optimize_images(assets_directory, force=False):
+    """Builds the variants of every manager image that is new or has changed, writes the manifest the site reads to
+    find them, and deletes variants that are no longer in it. Returns (images built, images unchanged)"""
+    output_directory = os.path.join(assets_directory, OPTIMIZED_DIRECTORY)
+    manifest_path = os.path.join(output_directory, MANIFEST_FILENAME)
+    os.makedirs(output_directory, exist_ok=True)
+    try:
+        with open(manifest_path, "r") as f:
+            previous_manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        previous_manifest = {}
+
+    manifest = {}
+    built = 0
+    unchanged = 0
+    for source_path in sorted(glob.glob(os.path.join(assets_directory, "*.jpg"))):
+        key_name = os.path.splitext(os.path.basename(source_path))[0]
+        source_hash = file_hash(source_path)
+        previous = previous_manifest.get(key_name)
+        # Skip images that haven't changed since their variants were built
+        if (not force and previous is not None and previous.get("source_hash") == source_hash and
+                all(os.path.exists(os.path.join(assets_directory, variant.get("src")))
+                    for variants in previous.get("variants").values() for variant in variants)):
+            manifest[key_name] = previous
+            unchanged += 1
+            continue
+        entry = build_variants(source_path, output_directory)
+        entry["source_hash"] = source_hash
+        manifest[key_name] = entry
+        built += 1
+
+    write_atomically(manifest_path, "w", lambda f: json.dump(manifest, f, indent=1, sort_keys=True))
+
+    # Delete the variants of images that have changed or been removed
+    in_use = {os.path.basename(variant.get("src")) for entry in manifest.values()
+              for variants in entry.get("variants").values() for variant in variants}
+    for filename in os.listdir(output_directory):
+        if filename != MANIFEST_FILENAME and filename not in in_use:
+            os.remove(os.path.join(output_directory, filename))
+
+    return built, unchanged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make resized WebP and JPEG copies of the manager images")
+    parser.add_argument("--force", action="store_true", help="Rebuild every image, even ones that haven't changed")
+    args = parser.parse_args()
+
+    if Image is None:
+        print("Pillow is needed to optimize images, install it with: pip install Pillow")
+        exit(1)
+
+    images_built, images_unchanged = optimize_images(MEET_THE_MANAGERS_ASSETS, force=args.force)
+    print(f"Optimized {images_built} manager images ({images_unchanged} unchanged)")
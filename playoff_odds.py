@@ -0,0 +1,211 @@
+from __future__ import annotations
+import itertools
+import json
+import multiprocessing
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from fantasy_enums import GameType
+from standings import BYE_SLOTS, ODDS_FILENAME, active_year_teams, remaining_games, remove_playoff_odds, team_records
+from utility import write_atomically
+
+# How many times to play out the rest of the season by default
+DEFAULT_SIMULATIONS = 20000
+# How many simulations to play at once, which bounds the memory used early in the season when many games are left
+BATCH_SIZE = 5000
+# Teams with fewer scores than this so far in the season also draw from their member's scores in past seasons
+MINIMUM_SCORES = 4
+# The odds worked out for each team, in the order the simulator counts them
+ODDS = ("division", "bye", "playoffs", "championship", "pooper_bowl")
+# How many teams play in the pooper bowl
+POOPER_BOWL_SLOTS = 2
+# Playoff rounds, each a list of (higher seed, lower seed) games. A seed is an index into the playoff seeds, or a
+# negative number for the winner of that game in the previous round (-1 for its first game, -2 for its second)
+PLAYOFF_ROUNDS = (
+    ((3, 4), (2, 5)),
+    ((0, -1), (1, -2)),
+    ((-1, -2),),
+)
+
+
+class PlayoffSimulator:
+    """Plays out the rest of the regular season and then the playoffs many times over, all at once with NumPy
+
+    Every score a team puts up is drawn from the scores it has put up before (its scores this season, topped up with
+    its member's scores from past seasons early on). Playoff games that have already been played keep their real
+    scores"""
+
+    def __init__(self, fantasy_league):
+        teams = active_year_teams(fantasy_league)
+        records = team_records(teams)
+        self.espn_ids: list = sorted(records)
+        index = {espn_id: i for i, espn_id in enumerate(self.espn_ids)}
+        self.names: list[str] = [records.get(espn_id).get("name") for espn_id in self.espn_ids]
+        self.playoff_slots: int = fantasy_league.active_year_playoff_slots
+
+        divisions = defaultdict(list)
+        for espn_id in self.espn_ids:
+            divisions[teams.get(espn_id).division].append(index.get(espn_id))
+        self.division_members: list[list[int]] = list(divisions.values())
+        division_of = {i: division for division, members in enumerate(self.division_members) for i in members}
+
+        # The scores each team can draw from, padded out to the same length
+        scores = [team_scores(teams.get(espn_id), records.get(espn_id), fantasy_league) for espn_id in self.espn_ids]
+        self.score_counts: np.ndarray = np.array([len(team_score) for team_score in scores], dtype=np.int64)
+        self.scores: np.ndarray = np.zeros((len(scores), max(self.score_counts.max(initial=0), 1)))
+        for i, team_score in enumerate(scores):
+            self.scores[i, :len(team_score)] = team_score
+
+        # Each remaining regular season game, by team index
+        games = remaining_games(teams, records, fantasy_league.active_year_regular_season_length)
+        self.home: np.ndarray = np.array([index.get(home) for _, home, _ in games], dtype=np.int64)
+        self.away: np.ndarray = np.array([index.get(away) for _, _, away in games], dtype=np.int64)
+        self.divisional: np.ndarray = np.array([division_of.get(index.get(home)) == division_of.get(index.get(away))
+                                                for _, home, away in games], dtype=bool)
+
+        self.divisional_wins: np.ndarray = np.array([records.get(espn_id).get("divisional_wins")
+                                                     for espn_id in self.espn_ids], dtype=np.float64)
+        self.points_for: np.ndarray = np.array([records.get(espn_id).get("points_for") for espn_id in self.espn_ids])
+        self.wins: np.ndarray = np.array([records.get(espn_id).get("wins") for espn_id in self.espn_ids],
+                                         dtype=np.float64)
+
+        # The real scores of playoff games that are over, by team and round, or NaN if they haven't been played
+        self.playoff_scores: np.ndarray = np.full((len(self.espn_ids), len(PLAYOFF_ROUNDS)), np.nan)
+        for espn_id in self.espn_ids:
+            for matchup in teams.get(espn_id).matchups:
+                playoff_round = matchup.week - fantasy_league.active_year_regular_season_length
+                if (matchup.type == GameType.PLAYOFF and 1 <= playoff_round <= len(PLAYOFF_ROUNDS) and
+                        fantasy_league.is_week_final(fantasy_league.active_year, matchup.week)):
+                    self.playoff_scores[index.get(espn_id), playoff_round - 1] = matchup.points_for
+
+    def can_simulate(self):
+        """Returns a boolean representing whether there are enough teams, and scores, to simulate"""
+        return (len(self.espn_ids) >= self.playoff_slots + POOPER_BOWL_SLOTS and self.playoff_slots == 6 and
+                bool(np.all(self.score_counts > 0)))
+
+    def draw_scores(self, team_indexes, rng):
+        """Draws a score for each of the given team indexes (an array of any shape) from that team's past scores"""
+        picks = (rng.random(team_indexes.shape) * self.score_counts[team_indexes]).astype(np.int64)
+        return self.scores[team_indexes, picks]
+
+    def simulate(self, simulations, rng):
+        """Plays out the season the given number of times. Returns how many of them each team reached each of ODDS in,
+        as an array of shape (len(ODDS), teams)"""
+        team_count = len(self.espn_ids)
+        rows = np.arange(simulations)[:, None]
+
+        # Play the regular season: one column per remaining game, and then total up each team's results
+        home_points = self.draw_scores(np.broadcast_to(self.home, (simulations, len(self.home))), rng)
+        away_points = self.draw_scores(np.broadcast_to(self.away, (simulations, len(self.away))), rng)
+        home_games = np.eye(team_count)[self.home]
+        away_games = np.eye(team_count)[self.away]
+        home_won = (home_points > away_points).astype(np.float64)
+        away_won = (away_points > home_points).astype(np.float64)
+        wins = self.wins + home_won @ home_games + away_won @ away_games
+        divisional_wins = (self.divisional_wins + (home_won * self.divisional) @ home_games +
+                           (away_won * self.divisional) @ away_games)
+        points_for = self.points_for + home_points @ home_games + away_points @ away_games
+
+        # Apply the WFFL rules (see standings.py). Wins and divisional wins are whole numbers, so tiebreakers that
+        # follow them can be folded into a single sortable number, as long as points stay under 1e7
+        division_key = wins * 1e9 + divisional_wins * 1e7 + points_for
+        seeding_key = wins * 1e7 + points_for
+        leaders = np.stack([np.array(members)[np.argmax(division_key[:, members], axis=1)]
+                            for members in self.division_members], axis=1)
+        is_leader = np.zeros((simulations, team_count), dtype=bool)
+        is_leader[rows, leaders] = True
+        leaders = leaders[rows, np.argsort(-seeding_key[rows, leaders], axis=1)]
+        wildcard_slots = self.playoff_slots - len(self.division_members)
+        # Points come first in the wildcard race, and any difference in them has to outweigh the tiebreakers, so sort
+        # by each key in turn (lexsort's last key is the primary one), with the division leaders sorted last
+        wildcards = np.lexsort((-divisional_wins, -wins, np.where(is_leader, np.inf, -points_for)),
+                               axis=1)[:, :wildcard_slots]
+        seeds = np.concatenate([leaders, wildcards], axis=1)
+        in_playoffs = np.zeros((simulations, team_count), dtype=bool)
+        in_playoffs[rows, seeds] = True
+        # The pooper bowl is played by the lowest seeds of the teams that missed the playoffs
+        pooper_bowl = np.argsort(np.where(in_playoffs, np.inf, seeding_key), axis=1)[:, :POOPER_BOWL_SLOTS]
+
+        # Then play the playoffs, a round at a time
+        winners = seeds
+        for playoff_round, games in enumerate(PLAYOFF_ROUNDS):
+            round_winners = []
+            for higher_seed, lower_seed in games:
+                higher = seeds[:, higher_seed] if higher_seed >= 0 else winners[:, -higher_seed - 1]
+                lower = seeds[:, lower_seed] if lower_seed >= 0 else winners[:, -lower_seed - 1]
+                higher_points = np.where(np.isnan(self.playoff_scores[higher, playoff_round]),
+                                         self.draw_scores(higher, rng), self.playoff_scores[higher, playoff_round])
+                lower_points = np.where(np.isnan(self.playoff_scores[lower, playoff_round]),
+                                        self.draw_scores(lower, rng), self.playoff_scores[lower, playoff_round])
+                # The higher seed wins a tie
+                round_winners.append(np.where(higher_points >= lower_points, higher, lower))
+            winners = np.stack(round_winners, axis=1)
+
+        counts = np.zeros((len(ODDS), team_count), dtype=np.int64)
+        counts[0] = is_leader.sum(axis=0)
+        counts[1] = np.bincount(seeds[:, :BYE_SLOTS].ravel(), minlength=team_count)
+        counts[2] = in_playoffs.sum(axis=0)
+        counts[3] = np.bincount(winners[:, 0], minlength=team_count)
+        counts[4] = np.bincount(pooper_bowl.ravel(), minlength=team_count)
+        return counts
+
+
+def team_scores(team, record, fantasy_league):
+    """Gets the scores a team's future scores are drawn from: its regular season scores so far this season, plus its
+    member's from past seasons if it hasn't played many games yet"""
+    games_played = record.get("wins") + record.get("losses") + record.get("ties")
+    # Leave out the game in progress, if there is one
+    scores = [matchup.points_for for matchup in team.matchups
+              if matchup.type == GameType.REGULAR_SEASON and matchup.week <= games_played]
+    if len(scores) < MINIMUM_SCORES:
+        scores += [matchup.points_for for matchup in team.member.regular_season_matchups()
+                   if matchup.team.year < fantasy_league.active_year and matchup.points_for > 0]
+    return scores
+
+
+def simulate_chunk(simulator, simulations, seed):
+    """Runs part of the simulations, in batches, with its own random numbers (a module-level function, so that worker
+    processes can run it)"""
+    rng = np.random.default_rng(seed)
+    return sum(simulator.simulate(min(BATCH_SIZE, simulations - start), rng)
+               for start in range(0, simulations, BATCH_SIZE))
+
+
+def playoff_odds(fantasy_league, simulations=DEFAULT_SIMULATIONS, processes=1, seed=None):
+    """Simulates the rest of the active year to work out each team's odds of winning its division, getting a bye,
+    making the playoffs, winning the championship, and ending up in the pooper bowl. Simulations are split across
+    worker processes if more than one is asked for. Returns dict[team name: dict[odds: percentage]], or None if
+    there isn't enough data to simulate with"""
+    simulator = PlayoffSimulator(fantasy_league)
+    if not simulator.can_simulate() or simulations <= 0:
+        return None
+
+    # Split the simulations evenly between the processes, each with its own independent stream of random numbers
+    processes = max(processes, 1)
+    chunk_sizes = [simulations // processes + (chunk < simulations % processes) for chunk in range(processes)]
+    chunk_sizes = [size for size in chunk_sizes if size > 0]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    if len(chunk_sizes) > 1:
+        # Forked workers get the simulator without re-running the script that started them
+        with multiprocessing.get_context("fork").Pool(len(chunk_sizes)) as pool:
+            chunks = pool.starmap(simulate_chunk, zip(itertools.repeat(simulator), chunk_sizes, seeds))
+    else:
+        chunks = [simulate_chunk(simulator, simulations, seeds[0])]
+    counts = np.sum(chunks, axis=0)
+
+    return {name: {odds: round(float(counts[j, i]) * 100 / simulations, 1) for j, odds in enumerate(ODDS)}
+            for i, name in enumerate(simulator.names)}
+
+
+def write_playoff_odds(fantasy_league, directory, simulations=DEFAULT_SIMULATIONS, processes=1, seed=None):
+    """Simulates the playoff odds and writes them to the directory for the site. Returns them, or None if there isn't
+    enough data to simulate with (or no simulations were asked for), in which case any odds already there are removed"""
+    odds = playoff_odds(fantasy_league, simulations=simulations, processes=processes, seed=seed)
+    if odds is None:
+        remove_playoff_odds(directory)
+    else:
+        write_atomically(os.path.join(directory, ODDS_FILENAME), "w",
+                         lambda f: json.dump({"odds": odds, "simulations": simulations}, f))
+    return odds
@@ -0,0 +1,281 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from fantasy_classes import FantasyLeague
+from fantasy_enums import GameOutcome, GameType
+from head_to_head import HeadToHead
+from lineup_table import LineupTable, lineup_efficiency
+from matchup_table import MatchupTable
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+# Modules whose code decides what goes into a record book. A record book stored with the league is only used while
+# these are the same as when it was built
+RECORD_BOOK_MODULES = ("fantasy_classes.py", "fantasy_enums.py", "head_to_head.py", "lineup_table.py",
+                       "matchup_table.py", "record_book.py")
+
+
+def format_member_for_display(member_obj, affected_by_tenure=False):
+    """Formats a member's name, optionally noting when they joined late or left early"""
+    league = member_obj.league
+    # Member was a founding member of the league and is still active
+    if member_obj.joined_year == league.founded_year and member_obj.left_year == league.active_year:
+        return member_obj.name
+    # If there is a reason to note that a member joined late or left early, do so
+    if affected_by_tenure:
+        # Member was a founding member of the league but is no longer active
+        if member_obj.joined_year == league.founded_year and member_obj.left_year < league.active_year:
+            return f"{member_obj.name}\N{ASTERISK} (Left {member_obj.left_year})"
+        # Member joined the league after it was founded, but is still active
+        elif member_obj.left_year == league.active_year:
+            return f"{member_obj.name}\N{ASTERISK} (Joined {member_obj.joined_year})"
+        # Member joined the league after it was founded, and is no longer active
+        return f"{member_obj.name}\N{ASTERISK} ({member_obj.joined_year} - {member_obj.left_year})"
+    # Otherwise just return their name
+    return member_obj.name
+
+
+def lineup_record(record, lineup_points, optimal_points):
+    """Adds the points a lineup scored and the points the optimal lineup would have scored to a table row"""
+    record["lineup_points"] = lineup_points
+    record["optimal_points"] = optimal_points
+    return record
+
+
+def matchup_record(matchup, value=None):
+    """Builds the table row for a single matchup, with its points unless another value is given"""
+    return {"member": format_member_for_display(matchup.team.member),
+            "team": matchup.team.name,
+            "value": matchup.points_for if value is None else value,
+            "week": matchup.week,
+            "year": matchup.team.year, }
+
+
+def member_record(member, value, average=None, affected_by_tenure=False):
+    """Builds the table row for a single member"""
+    record = {"member": format_member_for_display(member, affected_by_tenure=affected_by_tenure),
+              "value": value, }
+    if average is not None:
+        record["average"] = average
+    return record
+
+
+def team_record(team, value):
+    """Builds the table row for a single team season"""
+    return {"member": format_member_for_display(team.member),
+            "team": team.name,
+            "value": value,
+            "year": team.year, }
+
+
+class RecordBook:
+    """Every leaderboard on the site, computed once for a given version of the league data"""
+
+    def __init__(self, league, standings_snapshot, version, lineup_columns=None):
+        self.head_to_head: dict[str, list[dict]] = {}
+        self.league: FantasyLeague = league
+        self.managers: list[dict] = []
+        self.snapshot: list[dict] = []
+        self.sorted_managers: list[str] = sorted(member.name for member in league.members)
+        self.standings_snapshot: list[dict] = standings_snapshot
+        self.table: MatchupTable = MatchupTable(league)
+        self.rivalries: HeadToHead = HeadToHead(self.table)
+        # Built from the players in the lineups, or from their LineupColumns if the league was loaded without them
+        self.lineups: LineupTable = LineupTable(self.table, lineup_columns)
+        self.tables: dict[str, list[dict]] = {}
+        self.version: str = version
+        self.build()
+
+    def build(self):
+        """Computes every leaderboard from the league data"""
+        league = self.league
+        table = self.table
+        members = table.members
+        teams = table.teams
+        matchups = table.matchups
+
+        self.snapshot = self.standings_snapshot[:int(np.count_nonzero(table.team_year == league.active_year))]
+
+        regular_season = table.is_type(GameType.REGULAR_SEASON)
+        playoffs = table.is_type(GameType.PLAYOFF)
+        wins = table.is_outcome(GameOutcome.WIN)
+
+        # Per-member aggregates, rounded the same way as the equivalent Member methods
+        regular_season_points = np.round(table.sum_by_member(table.points_for, regular_season), 2)
+        regular_season_games = table.count_by_member(regular_season)
+        regular_season_average = np.round(regular_season_points / np.maximum(regular_season_games, 1), 2)
+        win_percent = np.round(table.count_by_member(regular_season & wins) * 100 / np.maximum(regular_season_games, 1), 2)
+        playoff_points = np.round(table.sum_by_member(table.points_for, playoffs), 2)
+        playoff_games = table.count_by_member(playoffs)
+        playoff_average = np.round(playoff_points / np.maximum(playoff_games, 1), 2)
+        made_playoffs = table.count_by_team(playoffs) > 0
+        playoff_appearances = np.bincount(table.team_member, weights=made_playoffs, minlength=len(members)).astype(np.int64)
+        championships = np.bincount(table.team_member, weights=table.championships_by_team(),
+                                    minlength=len(members)).astype(np.int64)
+
+        self.tables["championships"] = [
+            member_record(members[index], int(championships[index]), affected_by_tenure=True)
+            for index in table.top(championships, mask=championships > 0)]
+
+        self.tables["total_regular_season_points"] = [
+            member_record(members[index], float(regular_season_points[index]),
+                          average=float(regular_season_average[index]), affected_by_tenure=True)
+            for index in table.top(regular_season_points)]
+
+        self.tables["total_playoff_points"] = [
+            member_record(members[index], float(playoff_points[index]),
+                          average=float(playoff_average[index]), affected_by_tenure=True)
+            for index in table.top(playoff_points, mask=playoff_appearances > 0)]
+
+        self.tables["win_percent"] = [member_record(members[index], float(win_percent[index]))
+                                      for index in table.top(win_percent)]
+
+        self.tables["playoff_appearances"] = [
+            member_record(members[index], int(playoff_appearances[index]), affected_by_tenure=True)
+            for index in table.top(playoff_appearances, mask=playoff_appearances > 0)]
+
+        # Per-team season aggregates, with the active season left out of the "lowest" leaderboards
+        points_scored = np.round(table.sum_by_team(table.points_for, regular_season), 2)
+        points_against = np.round(table.sum_by_team(table.points_against, regular_season), 2)
+        past_seasons = table.team_year != league.active_year
+
+        self.tables["highest_regular_season"] = [team_record(teams[index], float(points_scored[index]))
+                                                 for index in table.top(points_scored, count=10)]
+        self.tables["lowest_regular_season"] = [
+            team_record(teams[index], float(points_scored[index]))
+            for index in table.top(points_scored, mask=past_seasons, count=9, descending=False)]
+        self.tables["best_defense"] = [
+            team_record(teams[index], float(points_against[index]))
+            for index in table.top(points_against, mask=past_seasons, count=9, descending=False)]
+        self.tables["worst_defense"] = [team_record(teams[index], float(points_against[index]))
+                                        for index in table.top(points_against, count=10)]
+
+        # Single-week leaderboards, ignoring zero scores (weeks with no data) for the high and low scores
+        scored = table.points_for != 0
+        self.tables["highest_week"] = [matchup_record(matchups[index])
+                                       for index in table.top(table.points_for, mask=scored, count=10)]
+        self.tables["lowest_week"] = [matchup_record(matchups[index])
+                                      for index in table.top(table.points_for, mask=scored, count=9, descending=False)]
+        self.tables["lowest_win"] = [matchup_record(matchups[index])
+                                     for index in table.top(table.points_for, mask=wins, count=10, descending=False)]
+        self.tables["highest_loss"] = [
+            matchup_record(matchups[index])
+            for index in table.top(table.points_for, mask=table.is_outcome(GameOutcome.LOSS), count=10)]
+
+        self.build_lineup_records()
+
+        for member in league.members:
+            self.head_to_head[member.name] = self.build_head_to_head(member)
+
+        self.managers = [{"display_name": name, "key_name": name.lower().replace(" ", "")}
+                         for name in sorted(member.name for member in league.members
+                                            if member.left_year == league.active_year)]
+
+    def build_lineup_records(self):
+        """Computes the bench points and lineup efficiency leaderboards, from the matchups that have lineups"""
+        table = self.table
+        lineups = self.lineups
+        members = table.members
+        teams = table.teams
+        matchups = table.matchups
+        has_lineup = lineups.has_lineup
+
+        self.tables["points_left_on_bench"] = [
+            matchup_record(matchups[index], float(lineups.points_left_on_bench[index]))
+            for index in table.top(lineups.points_left_on_bench, mask=has_lineup, count=10)]
+
+        # Per-team season totals
+        team_has_lineup = table.count_by_team(has_lineup) > 0
+        team_lineup_points = np.round(table.sum_by_team(lineups.lineup_points, has_lineup), 2)
+        team_optimal_points = np.round(table.sum_by_team(lineups.optimal_points, has_lineup), 2)
+        team_points_left = np.round(team_optimal_points - team_lineup_points, 2)
+        team_efficiency = lineup_efficiency(team_lineup_points, team_optimal_points)
+        past_seasons = table.team_year != self.league.active_year
+
+        def team_lineup_record(index, value):
+            return lineup_record(team_record(teams[index], value),
+                                 float(team_lineup_points[index]), float(team_optimal_points[index]))
+
+        self.tables["season_points_left_on_bench"] = [
+            team_lineup_record(index, float(team_points_left[index]))
+            for index in table.top(team_points_left, mask=team_has_lineup, count=10)]
+        self.tables["best_season_efficiency"] = [
+            team_lineup_record(index, float(team_efficiency[index]))
+            for index in table.top(team_efficiency, mask=team_has_lineup, count=10)]
+        self.tables["worst_season_efficiency"] = [
+            team_lineup_record(index, float(team_efficiency[index]))
+            for index in table.top(team_efficiency, mask=team_has_lineup & past_seasons, count=10, descending=False)]
+
+        # Per-member all-time totals
+        member_has_lineup = table.count_by_member(has_lineup) > 0
+        member_lineup_points = np.round(table.sum_by_member(lineups.lineup_points, has_lineup), 2)
+        member_optimal_points = np.round(table.sum_by_member(lineups.optimal_points, has_lineup), 2)
+        member_efficiency = lineup_efficiency(member_lineup_points, member_optimal_points)
+        self.tables["manager_efficiency"] = [
+            lineup_record(member_record(members[index], float(member_efficiency[index])),
+                          float(member_lineup_points[index]), float(member_optimal_points[index]))
+            for index in table.top(member_efficiency, mask=member_has_lineup)]
+
+    def build_head_to_head(self, member):
+        """Computes a member's win percentage against every other member from the head-to-head matrix"""
+        winrates = [{"member": format_member_for_display(opponent, affected_by_tenure=True),
+                     "value": winrate}
+                    for opponent, winrate in self.rivalries.win_percentages(member.name)]
+        return sorted(winrates, key=lambda x: x.get("value"), reverse=True)
+
+    def stored_rows(self):
+        """Gets everything the site serves from the record book as (kind, name, JSON) rows, for storing with the
+        league (see StoredRecordBook)"""
+        rows = [("book", "code_version", json.dumps(record_book_version())),
+                ("book", "managers", json.dumps(self.managers)),
+                ("book", "snapshot_length", json.dumps(len(self.snapshot))),
+                ("book", "sorted_managers", json.dumps(self.sorted_managers))]
+        rows += [("table", name, json.dumps(table)) for name, table in self.tables.items()]
+        rows += [("head_to_head", name, json.dumps(winrates)) for name, winrates in self.head_to_head.items()]
+        return rows
+
+
+class StoredRecordBook:
+    """The leaderboards of a RecordBook that update_league.py stored with the league, which is all the site serves, so
+    it can start without loading (or building anything from) the league's history"""
+
+    def __init__(self, rows, standings_snapshot, version):
+        book = {name: json.loads(value) for kind, name, value in rows if kind == "book"}
+        self.head_to_head: dict[str, list[dict]] = {name: json.loads(value) for kind, name, value in rows
+                                                    if kind == "head_to_head"}
+        self.managers: list[dict] = book.get("managers")
+        self.snapshot: list[dict] = standings_snapshot[:book.get("snapshot_length")]
+        self.sorted_managers: list[str] = book.get("sorted_managers")
+        self.standings_snapshot: list[dict] = standings_snapshot
+        self.tables: dict[str, list[dict]] = {name: json.loads(value) for kind, name, value in rows if kind == "table"}
+        self.version: str = version
+
+    @staticmethod
+    def is_current(rows):
+        """Returns a boolean representing whether stored rows were built by the record book code that is here now"""
+        return any(kind == "book" and name == "code_version" and json.loads(value) == record_book_version()
+                   for kind, name, value in rows)
+
+
+def record_book_version():
+    """Hashes the code of RECORD_BOOK_MODULES, so that a record book built by different code isn't served"""
+    digest = hashlib.sha256()
+    for module in RECORD_BOOK_MODULES:
+        with open(os.path.join(dir_path, module), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+# The most recently built record book, reused until the data version changes
+_current_record_book = None
+
+
+def get_record_book(league, standings_snapshot, version, lineup_columns=None):
+    """Returns the record book for the given data version, only rebuilding it when the version has changed"""
+    global _current_record_book
+    if _current_record_book is None or _current_record_book.version != version:
+        _current_record_book = RecordBook(league, standings_snapshot, version, lineup_columns)
+    return _current_record_book
@@ -0,0 +1,198 @@
+import argparse
+import configparser
+import json
+import os
+import sys
+import time
+
+from utility import StageTimer
+
+# Only the standard library and utility.py are imported up front, everything else is imported by the command that
+# needs it. --timing shows how long each command spends importing
+STARTED = time.perf_counter()
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+# Where config.ini and the data written by update_league.py are, the same as for the site (see app.py). Every command
+# uses this one directory, which is passed on to update_league.py and export_site.py
+data_path = os.environ.get("RECORDS_DATA_DIR", dir_path)
+# Commands that hand the rest of the command line to another script, which parses it itself
+PASS_THROUGH_COMMANDS = ("update", "export")
+
+
+def read_config():
+    """Reads config.ini from the data directory"""
+    config = configparser.ConfigParser()
+    config.read(f"{data_path}/config.ini")
+    return config
+
+
+def stored_league_path(config):
+    """Gets the path update_league.py stored the league at, exiting if there isn't one"""
+    from league_storage import league_filename
+    league_name = config["WEBSITE"]["league_name"].replace('"', '')
+    league_storage_filename = league_filename(data_path, league_name,
+                                              config["WEBSITE"].get("storage", fallback="pickle"))
+    if not os.path.exists(league_storage_filename):
+        print(f"Could not find stored league instance at {league_storage_filename}")
+        exit(1)
+    return league_storage_filename
+
+
+def run_update(args, extra_args, stage_timer):
+    """Runs update_league.py with the rest of the command line"""
+    with stage_timer.stage("import"):
+        import update_league
+    with stage_timer.stage("update"):
+        update_league.main(extra_args, prog="records.py update", data_directory=data_path)
+
+
+def run_export(args, extra_args, stage_timer):
+    """Runs export_site.py with the rest of the command line"""
+    with stage_timer.stage("import"):
+        import export_site
+    with stage_timer.stage("export"):
+        export_site.main(extra_args, prog="records.py export", data_directory=data_path)
+
+
+def run_snapshot(args, extra_args, stage_timer):
+    """Writes the playoff snapshot and odds for the stored league, the same as the end of an update"""
+    config = read_config()
+    simulations = args.simulations
+    if simulations is None:
+        simulations = config["WEBSITE"].getint("playoff_odds_simulations", fallback=None)
+    with stage_timer.stage("import"):
+        from league_storage import load_league
+        from standings import remove_playoff_odds, write_playoff_snapshot
+    with stage_timer.stage("load league"):
+        fantasy_league = load_league(stored_league_path(config))
+    with stage_timer.stage("snapshot"):
+        write_playoff_snapshot(fantasy_league, data_path, processes=args.processes)
+    if simulations == 0:
+        # Odds simulated for an older snapshot would no longer match it
+        remove_playoff_odds(data_path)
+        return
+    # Only the odds need numpy, so it isn't loaded when they are skipped
+    with stage_timer.stage("import"):
+        from playoff_odds import DEFAULT_SIMULATIONS, write_playoff_odds
+    with stage_timer.stage("playoff odds"):
+        write_playoff_odds(fantasy_league, data_path, simulations=simulations or DEFAULT_SIMULATIONS,
+                           processes=args.processes)
+
+
+def run_query(args, extra_args, stage_timer):
+    """Prints a record from the stored league, or lists the records if none was asked for"""
+    config = read_config()
+    with stage_timer.stage("import"):
+        from league_store import LeagueStore
+        from standings import SNAPSHOT_FILENAME
+    # Loaded the same way as the site, so a SQLite league's stored record book is used when it's there
+    with stage_timer.stage("load record book"):
+        record_book = LeagueStore(stored_league_path(config), os.path.join(data_path, SNAPSHOT_FILENAME),
+                                  0).load().record_book
+
+    # Pick out the same data the matching /api route serves
+    if args.member is not None:
+        member_name = args.member.strip().title()
+        if member_name not in record_book.head_to_head:
+            print(f"{args.member} is not a member, pick one of: {', '.join(record_book.sorted_managers)}")
+            exit(1)
+        rows = record_book.head_to_head.get(member_name)
+    elif args.record is None:
+        print("\n".join(["snapshot"] + sorted(record_book.tables)))
+        return
+    elif args.record == "snapshot":
+        rows = record_book.snapshot
+    elif args.record in record_book.tables:
+        rows = record_book.tables.get(args.record)
+    else:
+        print(f"{args.record} is not a record, pick one of: {', '.join(['snapshot'] + sorted(record_book.tables))}")
+        exit(1)
+
+    rows = rows[:args.limit] if args.limit else rows
+    if args.json:
+        print(json.dumps(rows, indent=1))
+    else:
+        print_table(rows)
+
+
+def run_serve(args, extra_args, stage_timer):
+    """Runs the site locally"""
+    # The app finds the data through RECORDS_DATA_DIR when it is imported. Like the site, it expects to be run from here
+    # so it can find the static files
+    os.environ["RECORDS_DATA_DIR"] = data_path
+    os.chdir(dir_path)
+    with stage_timer.stage("import"):
+        from app import app, preload_data
+    with stage_timer.stage("load league"):
+        preload_data()
+    app.run(host=args.host, port=args.port)
+
+
+def print_table(rows):
+    """Prints a list of table rows (dicts) as aligned columns, in the order their keys first appear"""
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    cells = [[str(row.get(column, "")) for column in columns] for row in rows]
+    widths = [max([len(column)] + [len(row[i]) for row in cells]) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)).rstrip())
+    for row in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def build_parser():
+    """Builds the command-line parser, with a subcommand for each job"""
+    parser = argparse.ArgumentParser(prog="records.py", description="Update, export, and query the league's records")
+    parser.add_argument("--timing", action="store_true",
+                        help="Print how long starting up, importing, and each stage of the command took to stderr")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    # update and export leave their arguments (and --help) to update_league.py and export_site.py
+    commands.add_parser("update", add_help=False, help="Fetch new league data from ESPN (see update --help)")
+    commands.add_parser("export", add_help=False, help="Render the site to static files (see export --help)")
+
+    snapshot = commands.add_parser("snapshot", help="Work out the playoff snapshot and odds from the stored league, "
+                                                    "without fetching anything")
+    snapshot.add_argument("--processes", type=int, default=1,
+                          help="Number of processes to work out clinches and simulate the playoff odds with")
+    snapshot.add_argument("--simulations", type=int,
+                          help="How many times to simulate the rest of the season for the playoff odds (0 to skip "
+                               "them, defaults to the playoff_odds_simulations setting in config.ini)")
+
+    query = commands.add_parser("query", help="Print a record, or a member's head-to-head record")
+    query.add_argument("record", nargs="?", help="Record to print, named like its /api route (lists them if left out)")
+    query.add_argument("--member", help="Print this member's head-to-head win percentages instead")
+    query.add_argument("--limit", type=int, help="Only print this many rows")
+    query.add_argument("--json", action="store_true", help="Print JSON, the same as the API, instead of a table")
+
+    serve = commands.add_parser("serve", help="Run the site with Flask's development server")
+    serve.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    serve.add_argument("--port", type=int, default=5000, help="Port to listen on")
+    return parser
+
+
+COMMANDS = {
+    "export": run_export,
+    "query": run_query,
+    "serve": run_serve,
+    "snapshot": run_snapshot,
+    "update": run_update,
+}
+
+
+def main(argv=None):
+    """Runs the subcommand given on the command line (sys.argv if None)"""
+    parser = build_parser()
+    args, extra_args = parser.parse_known_args(argv)
+    if extra_args and args.command not in PASS_THROUGH_COMMANDS:
+        parser.error(f"unrecognized arguments: {' '.join(extra_args)}")
+
+    stage_timer = StageTimer()
+    stage_timer.add("startup", time.perf_counter() - STARTED)
+    try:
+        COMMANDS[args.command](args, extra_args, stage_timer)
+    finally:
+        if args.timing:
+            print(json.dumps({"command": args.command, "stages": stage_timer.summary()}), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+import json
+import multiprocessing
+import os
+from collections import defaultdict
+
+from fantasy_enums import GameOutcome, GameType
+from utility import write_atomically
+
+# Slots in the snapshot: every seed, then the winner of each playoff game
+FULL_BRACKET_SLOTS = 19
+# How many of the top seeds skip the first round of the playoffs
+BYE_SLOTS = 2
+# Added to a team's name in the snapshot for the best thing it has clinched
+CLINCHED_LABELS = {
+    "bye": "** (clinched bye)",
+    "division": "* (clinched division)",
+    "playoffs": " (clinched playoffs)",
+}
+# Stands in for the points a team could still score, which have no upper limit
+UNLIMITED_POINTS = 1e9
+# The file the snapshot is written to for the site, next to the league
+SNAPSHOT_FILENAME = "Playoff Snapshot.json"
+# The file the playoff odds (see playoff_odds.py) are written to for the site, next to the snapshot
+ODDS_FILENAME = "Playoff Odds.json"
+
+
+"""
+WFFL rules state that divisional standings are determined as follows:
+    Overall record
+    Tiebreaker 1 - divisional record
+    Tiebreaker 2 - total points scored
+"""
+
+
+def division_key(team_data):
+    """Gets the key a team is ranked by within its division"""
+    return team_data.get("wins"), team_data.get("divisional_wins"), team_data.get("points_for")
+
+
+"""
+WFFL rules state that wildcard standings are determined as follows:
+    Total points for
+    Tiebreaker 1 - overall record
+    Tiebreaker 2 - divisional record
+"""
+
+
+def wildcard_key(team_data):
+    """Gets the key a team is ranked by in the wildcard race"""
+    return team_data.get("points_for"), team_data.get("wins"), team_data.get("divisional_wins")
+
+
+"""
+Once the standings are sorted, divisional winners are seeded by total wins, and so are the teams that missed the
+playoffs
+    Tiebreaker 1 - total points scored
+"""
+
+
+def seeding_key(team_data):
+    """Gets the key division winners, and the teams that missed the playoffs, are seeded by"""
+    return team_data.get("wins"), team_data.get("points_for")
+
+
+def active_year_teams(fantasy_league):
+    """Gets one team for each ESPN ID in the active year (teams with co-owners are stored once per owner) as a
+    dict[espn_id: Team]"""
+    teams = {}
+    for team in sorted(fantasy_league.teams_in_active_year(), key=lambda active_team: active_team.name):
+        teams.setdefault(team.espn_id, team)
+    return teams
+
+
+def team_records(teams):
+    """Gets the data needed to figure out the standings for each team, as dict[espn_id: team_data]"""
+    # Create a dict {division_id: list[team_id_in_division]}
+    divisions = defaultdict(list)
+    for team in teams.values():
+        divisions[team.division].append(team.espn_id)
+
+    records = {}
+    for team in teams.values():
+        # Calculate how many in-division wins a team has
+        divisional_wins = 0
+        divisional_losses = 0
+        for matchup in team.matchups:
+            if (matchup.type == GameType.REGULAR_SEASON and
+                    matchup.outcome == GameOutcome.WIN and
+                    matchup.opponent.espn_id in divisions.get(team.division)):
+                divisional_wins += 1
+            elif (matchup.type == GameType.REGULAR_SEASON and
+                  matchup.outcome == GameOutcome.LOSS and
+                  matchup.opponent.espn_id in divisions.get(team.division)):
+                divisional_losses += 1
+
+        records[team.espn_id] = {
+            "divisional_losses": divisional_losses,
+            "divisional_wins": divisional_wins,
+            "losses": team.regular_season_losses,
+            "name": team.name,
+            "points_for": team.regular_season_points_scored(),
+            "ties": team.regular_season_ties,
+            "wins": team.regular_season_wins,
+        }
+    return records
+
+
+def remaining_games(teams, records, regular_season_length):
+    """Lists the regular season games still to be played, taken from each team's schedule, as
+    (week, espn_id, espn_id) tuples"""
+    games = set()
+    for espn_id, team in teams.items():
+        record = records.get(espn_id)
+        games_played = record.get("wins") + record.get("losses") + record.get("ties")
+        # The schedule has one opponent per week, starting from week 1
+        for week in range(games_played + 1, min(regular_season_length, len(team.schedule)) + 1):
+            opponent_id = team.schedule[week - 1]
+            if opponent_id in teams and opponent_id != espn_id:
+                games.add((week, min(espn_id, opponent_id), max(espn_id, opponent_id)))
+    return sorted(games)
+
+
+def seed_teams(records, divisions, playoff_slots):
+    """Splits the teams into division winners, wildcards, and everyone else, each sorted in seed order.
+    Returns (division winners, wildcards, rest of league) as lists of team_data"""
+    # Determine who is leading each division
+    division_leaders = [max((records.get(espn_id) for espn_id in division), key=division_key)
+                        for division in divisions.values()]
+    sorted_division_leaders = sorted(division_leaders, key=seeding_key, reverse=True)
+
+    # Then wildcard spots are determined from everyone else
+    wildcard_standings = sorted((team_data for team_data in records.values() if team_data not in division_leaders),
+                                key=wildcard_key, reverse=True)
+    wildcard_slots = playoff_slots - len(divisions)
+    sorted_wildcard_leaders = wildcard_standings[:wildcard_slots]
+
+    # The remaining teams are re-sorted the same way as the division winners
+    sorted_rest_of_league = sorted(wildcard_standings[wildcard_slots:], key=seeding_key, reverse=True)
+    return sorted_division_leaders, sorted_wildcard_leaders, sorted_rest_of_league
+
+
+class StandingsEngine:
+    """Exactly decides what each team has clinched, or been eliminated from, by searching the outcomes of the
+    regular season games left to play
+
+    Only wins and losses are searched. Nothing caps the points a team can score, so a team with games left can end up
+    with more points than anyone, or with no more than it has now. When looking for a way for a team to miss out,
+    every points tiebreak goes against it; when looking for a way for it to get in, they all go its way. The search
+    is depth first, stops as soon as bounds on every team's final record settle the question, and remembers the
+    records it has already ruled out"""
+
+    def __init__(self, records, divisions, games, playoff_slots):
+        self.espn_ids: list = sorted(records)
+        index = {espn_id: i for i, espn_id in enumerate(self.espn_ids)}
+        self.division_members: list[list[int]] = [[index.get(espn_id) for espn_id in division]
+                                                  for division in divisions.values()]
+        self.division_of: list[int] = [0] * len(self.espn_ids)
+        for division, members in enumerate(self.division_members):
+            for i in members:
+                self.division_of[i] = division
+        # Each game as (team index, team index, whether it is a divisional game)
+        self.games: list[tuple[int, int, bool]] = [
+            (index.get(home), index.get(away), self.division_of[index.get(home)] == self.division_of[index.get(away)])
+            for _, home, away in games]
+        self.divisional_wins: list[int] = [records.get(espn_id).get("divisional_wins") for espn_id in self.espn_ids]
+        self.points_for: list[float] = [records.get(espn_id).get("points_for") for espn_id in self.espn_ids]
+        self.wildcard_slots: int = playoff_slots - len(divisions)
+        self.wins: list[int] = [records.get(espn_id).get("wins") for espn_id in self.espn_ids]
+
+    def can_finish(self, espn_id, goal, reached):
+        """Returns a boolean representing whether any outcome of the remaining games ends with the team reaching the
+        goal ("division", "bye", or "playoffs"), or with it missing the goal if reached is False"""
+        team = self.espn_ids.index(espn_id)
+        team_count = len(self.espn_ids)
+        has_games = [False] * team_count
+        for home, away, _ in self.games:
+            has_games[home] = has_games[away] = True
+
+        # Settle points tiebreaks, and then any exact ties, the way the search is hoping for
+        if reached:
+            points = [points_for + (UNLIMITED_POINTS if has_games[i] and i == team else 0)
+                      for i, points_for in enumerate(self.points_for)]
+        else:
+            points = [points_for + (UNLIMITED_POINTS if has_games[i] and i != team else 0)
+                      for i, points_for in enumerate(self.points_for)]
+        tiebreak = [-i for i in range(team_count)]
+        tiebreak[team] = team_count if reached else -team_count
+
+        # Search the team's own games first, then the rest of its division's, as they matter the most
+        games = sorted(self.games, key=lambda game: (team not in game[:2],
+                                                     self.division_of[team] not in (self.division_of[game[0]],
+                                                                                    self.division_of[game[1]])))
+        # Games (and divisional games) each team has left from each point of the search onwards
+        games_left = [[0] * team_count for _ in range(len(games) + 1)]
+        divisional_games_left = [[0] * team_count for _ in range(len(games) + 1)]
+        for k in range(len(games) - 1, -1, -1):
+            home, away, divisional = games[k]
+            games_left[k] = list(games_left[k + 1])
+            divisional_games_left[k] = list(divisional_games_left[k + 1])
+            games_left[k][home] += 1
+            games_left[k][away] += 1
+            if divisional:
+                divisional_games_left[k][home] += 1
+                divisional_games_left[k][away] += 1
+
+        def decide(wins, divisional_wins, k):
+            """Returns whether the team reaches its goal: True or False if the remaining games can't change it, or None
+            if they still could"""
+            left = games_left[k]
+            divisional_left = divisional_games_left[k]
+            max_wins = [wins[i] + left[i] for i in range(team_count)]
+            division_min = [(wins[i], divisional_wins[i], points[i], tiebreak[i]) for i in range(team_count)]
+            division_max = [(max_wins[i], divisional_wins[i] + divisional_left[i], points[i], tiebreak[i])
+                            for i in range(team_count)]
+
+            def leads(i):
+                """Returns whether a team finishes top of its division: True, False, or None if undecided"""
+                members = self.division_members[self.division_of[i]]
+                if all(division_min[i] > division_max[j] for j in members if j != i):
+                    return True
+                if any(division_min[j] > division_max[i] for j in members if j != i):
+                    return False
+                return None
+
+            leading = leads(team)
+            if goal == "division":
+                return leading
+
+            if goal == "bye":
+                # Only division winners get a bye
+                if leading is False:
+                    return False
+                seed_min = (wins[team], points[team], tiebreak[team])
+                seed_max = (max_wins[team], points[team], tiebreak[team])
+                above = 0
+                possibly_above = 0
+                for division, members in enumerate(self.division_members):
+                    if division == self.division_of[team]:
+                        continue
+                    leader = next((i for i in members if leads(i)), None)
+                    if leader is not None:
+                        above += (wins[leader], points[leader], tiebreak[leader]) > seed_max
+                        possibly_above += (max_wins[leader], points[leader], tiebreak[leader]) > seed_min
+                    else:
+                        # Whoever wins the division has at least as many wins as anyone in it
+                        above += any(wins[i] > max_wins[team] for i in members)
+                        possibly_above += any((max_wins[i], points[i], tiebreak[i]) > seed_min for i in members)
+                if above >= BYE_SLOTS:
+                    return False
+                if leading and possibly_above < BYE_SLOTS:
+                    return True
+                return None
+
+            # Division winners always make the playoffs, so the team only needs a wildcard if it doesn't win its own
+            if leading:
+                return True
+            wildcard_min = (points[team], wins[team], divisional_wins[team], tiebreak[team])
+            wildcard_max = (points[team], max_wins[team], division_max[team][1], tiebreak[team])
+            ahead = 0
+            possibly_ahead = 0
+            for i in range(team_count):
+                if i == team:
+                    continue
+                i_leads = leads(i)
+                if i_leads is False and (points[i], wins[i], divisional_wins[i], tiebreak[i]) > wildcard_max:
+                    ahead += 1
+                if i_leads is not True and (points[i], max_wins[i], division_max[i][1], tiebreak[i]) > wildcard_min:
+                    possibly_ahead += 1
+            if leading is False and ahead >= self.wildcard_slots:
+                return False
+            if possibly_ahead < self.wildcard_slots:
+                return True
+            return None
+
+        ruled_out = set()
+
+        def search(wins, divisional_wins, k):
+            """Returns whether any outcome of the games from the kth onwards gets the result being searched for"""
+            decided = decide(wins, divisional_wins, k)
+            if decided is not None:
+                return decided == reached
+            state = (k, tuple(wins), tuple(divisional_wins))
+            if state in ruled_out:
+                return False
+
+            home, away, divisional = games[k]
+            # Try the more promising result first: the team winning its own games if it is hoping to reach the goal,
+            # or the team's rivals winning theirs if it is hoping to miss out
+            if team in (home, away):
+                winners = (team, away if home == team else home)
+                if not reached:
+                    winners = winners[::-1]
+            else:
+                threat = sorted((home, away), key=lambda i: (self.division_of[i] == self.division_of[team], wins[i]))
+                winners = (threat[0], threat[1]) if reached else (threat[1], threat[0])
+            for winner in winners:
+                wins[winner] += 1
+                divisional_wins[winner] += divisional
+                found = search(wins, divisional_wins, k + 1)
+                wins[winner] -= 1
+                divisional_wins[winner] -= divisional
+                if found:
+                    return True
+            ruled_out.add(state)
+            return False
+
+        return search(list(self.wins), list(self.divisional_wins), 0)
+
+    def team_status(self, espn_id):
+        """Works out the best thing a team has clinched (or None), and whether it has been eliminated from the
+        playoffs. Returns (clinched, eliminated)"""
+        clinched = None
+        # Only division winners get a bye, so there's no clinching one without clinching the division
+        if not self.can_finish(espn_id, "division", False):
+            clinched = "bye" if not self.can_finish(espn_id, "bye", False) else "division"
+        elif not self.can_finish(espn_id, "playoffs", False):
+            clinched = "playoffs"
+        eliminated = clinched is None and not self.can_finish(espn_id, "playoffs", True)
+        return clinched, eliminated
+
+
+def team_status(engine, espn_id):
+    """Works out a team's status with the given engine (a module-level function, so that worker processes can run it)"""
+    return engine.team_status(espn_id)
+
+
+def clinching_statuses(engine, processes=1):
+    """Gets the (clinched, eliminated) status of every team as dict[espn_id: status], checking teams in parallel
+    worker processes if more than one is asked for"""
+    if processes > 1:
+        # Forked workers start out as copies of this process, so unlike spawned ones they don't have to import
+        # everything again before they can start, and don't need whatever started them to be importable
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            statuses = pool.starmap(team_status, [(engine, espn_id) for espn_id in engine.espn_ids])
+    else:
+        statuses = [engine.team_status(espn_id) for espn_id in engine.espn_ids]
+    return dict(zip(engine.espn_ids, statuses))
+
+
+def playoff_result(team, team_data, opponent_data, week):
+    """Gets whichever of two teams won their playoff game in the given week, or None if it hasn't been played"""
+    for matchup in team.matchups:
+        if matchup.week == week and matchup.outcome == GameOutcome.WIN:
+            return team_data
+        elif matchup.week == week and matchup.outcome == GameOutcome.LOSS:
+            return opponent_data
+    return None
+
+
+def playoff_snapshot(fantasy_league, processes=1):
+    """Builds the active year's playoff picture: every team in seed order with what it has clinched, followed by the
+    winner of each playoff game played so far, padded out to FULL_BRACKET_SLOTS"""
+    teams = active_year_teams(fantasy_league)
+    records = team_records(teams)
+    divisions = defaultdict(list)
+    for espn_id, team in sorted(teams.items()):
+        divisions[team.division].append(espn_id)
+
+    sorted_division_leaders, sorted_wildcard_leaders, sorted_rest_of_league = seed_teams(
+        records, divisions, fantasy_league.active_year_playoff_slots)
+    engine = StandingsEngine(records, divisions,
+                             remaining_games(teams, records, fantasy_league.active_year_regular_season_length),
+                             fantasy_league.active_year_playoff_slots)
+    statuses = clinching_statuses(engine, processes)
+    espn_ids = {id(team_data): espn_id for espn_id, team_data in records.items()}
+
+    # Playoff teams are given their seed
+    # Teams on the outside of the playoffs looking in have their total-points-needed for a wildcard spot calculated
+    # Pooper bowl teams are given their seed
+    full_playoff_picture = []
+    seed = 1
+    for team_data in sorted_division_leaders + sorted_wildcard_leaders + sorted_rest_of_league:
+        if seed <= fantasy_league.active_year_playoff_slots:
+            team_data["seed"] = seed
+        else:
+            team_data["points_out"] = round(sorted_wildcard_leaders[-1].get("points_for") -
+                                            team_data.get("points_for"), 2)
+        if seed >= len(records) - 1:
+            team_data["seed"] = "P"
+        clinched, eliminated = statuses.get(espn_ids.get(id(team_data)))
+        if clinched is not None:
+            team_data["clinched"] = CLINCHED_LABELS.get(clinched)
+        if eliminated:
+            team_data["eliminated"] = True
+        full_playoff_picture.append(team_data)
+        seed += 1
+
+    # Get the regular season games played by the first place person (should be the same as everyone else)
+    regular_season_games_played = (int(full_playoff_picture[0].get("losses")) +
+                                   int(full_playoff_picture[0].get("ties")) +
+                                   int(full_playoff_picture[0].get("wins")))
+
+    # First seed gets a bye, so they win game 1
+    full_playoff_picture.append(full_playoff_picture[0])
+    # Second seed gets a bye, so they win game 2
+    full_playoff_picture.append(full_playoff_picture[1])
+    # Then who won the 4 vs 5 and 3 vs 6 matchups, the round 2 matchups of the high and low seeds, and the
+    # championship, each as (team, opponent, playoff round), looked up as the bracket is filled in
+    playoff_games = ((3, 4, 1), (2, 5, 1), (0, -2, 2), (1, -2, 2), (-2, -1, 3))
+    for team_position, opponent_position, playoff_round in playoff_games:
+        team_data = full_playoff_picture[team_position]
+        winner = playoff_result(teams.get(espn_ids.get(id(team_data))), team_data,
+                                full_playoff_picture[opponent_position], regular_season_games_played + playoff_round)
+        if winner is not None:
+            full_playoff_picture.append(winner)
+
+    # If there are less than a full bracket's worth of teams, the season isn't complete yet, so add blanks
+    for _ in range(FULL_BRACKET_SLOTS - len(full_playoff_picture)):
+        full_playoff_picture.append({"name": ""})
+    return full_playoff_picture
+
+
+def write_playoff_snapshot(fantasy_league, directory, processes=1):
+    """Works out the active year's playoff snapshot and writes it to the directory for the site. Returns it"""
+    full_playoff_picture = playoff_snapshot(fantasy_league, processes=processes)
+    write_atomically(os.path.join(directory, SNAPSHOT_FILENAME), "w", lambda f: json.dump(full_playoff_picture, f))
+    return full_playoff_picture
+
+
+def remove_playoff_odds(directory):
+    """Removes the playoff odds written to the directory for the site, if there are any, so that it stops showing odds
+    that no longer match the snapshot"""
+    try:
+        os.remove(os.path.join(directory, ODDS_FILENAME))
+    except FileNotFoundError:
+        pass
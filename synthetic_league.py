@@ -0,0 +1,233 @@
+import argparse
+import os
+import random
+
+from fantasy_classes import FantasyLeague, Matchup, Member, Player, Team
+from fantasy_enums import FLEX_POSITIONS, GameOutcome, GameType, PlayerPosition
+from league_storage import STORAGE_EXTENSIONS, league_filename, save_league
+from record_book import RecordBook
+from standings import seed_teams, team_records, write_playoff_snapshot
+
+# The last season of a generated league
+LAST_YEAR = 2024
+# Lineups are only available from ESPN from this year on (see espn_fetch.fetch_player_data)
+FIRST_LINEUP_YEAR = 2018
+DIVISIONS = 4
+# A full lineup: the starting slots, then the bench and IR
+LINEUP_SLOTS = (PlayerPosition.QB, PlayerPosition.RB, PlayerPosition.RB, PlayerPosition.WR, PlayerPosition.WR,
+                PlayerPosition.TE, PlayerPosition.FLEX, PlayerPosition.DEFENSE, PlayerPosition.KICKER) + \
+               (PlayerPosition.BENCH,) * 6 + (PlayerPosition.IR,)
+# Average points scored by a player at each position in a week
+AVERAGE_POINTS = {
+    PlayerPosition.QB: 18,
+    PlayerPosition.RB: 11,
+    PlayerPosition.WR: 11,
+    PlayerPosition.TE: 8,
+    PlayerPosition.DEFENSE: 7,
+    PlayerPosition.KICKER: 8,
+}
+# ESPN's defaultPositionId for each position (the reverse of espn_fetch.DEFAULT_POSITION_IDS)
+ESPN_POSITION_IDS = {
+    PlayerPosition.QB: 1,
+    PlayerPosition.RB: 2,
+    PlayerPosition.WR: 3,
+    PlayerPosition.TE: 4,
+    PlayerPosition.KICKER: 5,
+    PlayerPosition.DEFENSE: 16,
+}
+FIRST_NAMES = ("Alex", "Blake", "Casey", "Drew", "Emery", "Frankie", "Gray", "Harper", "Indy", "Jordan", "Kai", "Logan",
+               "Morgan", "Noel", "Oakley", "Parker", "Quinn", "Riley", "Sawyer", "Taylor")
+LAST_NAMES = ("Adams", "Brooks", "Chen", "Diaz", "Evans", "Fischer", "Garcia", "Hughes", "Ito", "Jensen", "Kowalski",
+              "Lopez", "Murphy", "Nguyen", "Okafor", "Patel", "Quinn", "Rossi", "Silva", "Tanaka")
+
+
+def member_name(number):
+    """Makes up a unique name for the given member number"""
+    name = f"{FIRST_NAMES[number % len(FIRST_NAMES)]} {LAST_NAMES[number // len(FIRST_NAMES) % len(LAST_NAMES)]}"
+    if number >= len(FIRST_NAMES) * len(LAST_NAMES):
+        name = f"{name} {number // (len(FIRST_NAMES) * len(LAST_NAMES)) + 1}"
+    return name
+
+
+def make_roster(rng, espn_id, year):
+    """Makes up a roster for a team, as a list of (player ESPN ID, name, position) for each lineup slot"""
+    roster = []
+    for k, slot in enumerate(LINEUP_SLOTS):
+        if slot in AVERAGE_POINTS:
+            position = slot
+        elif slot == PlayerPosition.FLEX:
+            position = rng.choice(FLEX_POSITIONS)
+        else:
+            position = rng.choice((PlayerPosition.QB,) + FLEX_POSITIONS)
+        player_id = year * 100000 + espn_id * 100 + k
+        roster.append((player_id, f"Player {player_id}", position))
+    return roster
+
+
+def make_lineup(rng, roster):
+    """Makes up a week's lineup for a roster. Returns (list of Player, points scored by the starters)"""
+    lineup = []
+    points_for = 0
+    for (player_id, name, position), slot in zip(roster, LINEUP_SLOTS):
+        points = max(rng.gauss(AVERAGE_POINTS.get(position), AVERAGE_POINTS.get(position) / 2), 0)
+        player = Player(espn_id=player_id, name=name, points=points, position=slot.value,
+                        default_position=position.value)
+        lineup.append(player)
+        if slot not in (PlayerPosition.BENCH, PlayerPosition.IR):
+            points_for += player.points
+    return lineup, round(points_for, 2)
+
+
+def play_week(rng, pairs, year, week, game_type, rosters):
+    """Plays each (team, team) pair's game in a week, adding the matchups to both teams"""
+    for home, away in pairs:
+        lineups = {}
+        scores = {}
+        for team in (home, away):
+            if year >= FIRST_LINEUP_YEAR:
+                lineups[team], scores[team] = make_lineup(rng, rosters.get(team))
+            else:
+                lineups[team], scores[team] = [], round(max(rng.gauss(105, 25), 30), 2)
+        for team, opponent in ((home, away), (away, home)):
+            outcome = GameOutcome.WIN
+            if scores.get(team) < scores.get(opponent):
+                outcome = GameOutcome.LOSS
+            elif scores.get(team) == scores.get(opponent):
+                outcome = GameOutcome.TIE
+            matchup = Matchup(opponent=opponent, outcome=outcome, points_against=scores.get(opponent),
+                              points_for=scores.get(team), team=team, game_type=game_type, week=week)
+            for player in lineups.get(team):
+                matchup.add_player(player)
+            team.upsert_matchup(matchup)
+            if game_type == GameType.REGULAR_SEASON:
+                team.update_regular_season_wins(team.regular_season_wins + (outcome == GameOutcome.WIN))
+                team.update_regular_season_losses(team.regular_season_losses + (outcome == GameOutcome.LOSS))
+                team.update_regular_season_ties(team.regular_season_ties + (outcome == GameOutcome.TIE))
+
+
+def play_playoffs(rng, fantasy_league, teams, year, rosters, weeks_played):
+    """Plays as much of a season's bracket (seeds 1 and 2 get byes, then 3 vs 6 and 4 vs 5) as has happened"""
+    records = team_records({team.espn_id: team for team in teams})
+    divisions = {}
+    for team in teams:
+        divisions.setdefault(team.division, []).append(team.espn_id)
+    leaders, wildcards, _ = seed_teams(records, divisions, fantasy_league.active_year_playoff_slots)
+    by_name = {team.name: team for team in teams}
+    seeds = [by_name.get(team_data.get("name")) for team_data in leaders + wildcards]
+    first_week = fantasy_league.active_year_regular_season_length + 1
+
+    rounds = [[(seeds[3], seeds[4]), (seeds[2], seeds[5])]]
+    for playoff_round in range(3):
+        week = first_week + playoff_round
+        if week > weeks_played or playoff_round >= len(rounds):
+            break
+        play_week(rng, rounds[playoff_round], year, week, GameType.PLAYOFF, rosters)
+        winners = [home if home.get_matchup(away.espn_id, week, GameType.PLAYOFF).outcome == GameOutcome.WIN
+                   else away for home, away in rounds[playoff_round]]
+        if playoff_round == 0:
+            rounds.append([(seeds[0], winners[0]), (seeds[1], winners[1])])
+        elif playoff_round == 1:
+            rounds.append([(winners[0], winners[1])])
+        fantasy_league.mark_week_final(year, week)
+
+
+def generate_league(years=10, members=12, weeks=17, regular_season_length=14, current_week=None, seed=0):
+    """Builds a league of made up members, teams, matchups, and (from 2018 on) full lineups, shaped like one built by
+    update_league.py. Every member has a team every year. The last season is complete unless a current_week is
+    given, in which case only the weeks before it have been played"""
+    if members % 2 or members < 8:
+        raise ValueError("A synthetic league needs an even number of members, and at least 8")
+    rng = random.Random(seed)
+    fantasy_league = FantasyLeague(espn_s2="", espn_swid="", founded_year=LAST_YEAR - years + 1, league_id=0)
+    fantasy_league.update_name("Synthetic League")
+    fantasy_league.update_active_year_playoff_slots(6)
+    fantasy_league.update_active_year_regular_season_length(regular_season_length)
+    league_members = []
+    for number in range(members):
+        member = Member(league=fantasy_league, member_id=f"SYNTHETIC-{number:04d}", name=member_name(number))
+        fantasy_league.add_member(member)
+        league_members.append(member)
+
+    for year in range(fantasy_league.founded_year, LAST_YEAR + 1):
+        fantasy_league.update_active_year(year)
+        weeks_played = weeks if year < LAST_YEAR or current_week is None else current_week - 1
+        if weeks_played >= weeks:
+            fantasy_league.update_max_completed_year(year)
+
+        # Each member gets a team, and every team gets a schedule with a random opponent each week
+        teams = []
+        for espn_id, member in enumerate(rng.sample(league_members, members), start=1):
+            member.update_joined_year(year)
+            member.update_left_year(year)
+            team = Team(division=espn_id % DIVISIONS, espn_id=espn_id, name=f"{member.name}'s {year} Team",
+                        member=member, schedule=[], year=year)
+            member.add_team(team)
+            teams.append(team)
+        weekly_pairs = []
+        for _ in range(regular_season_length):
+            order = rng.sample(teams, len(teams))
+            weekly_pairs.append(list(zip(order[::2], order[1::2])))
+            for home, away in weekly_pairs[-1]:
+                home.schedule.append(away.espn_id)
+                away.schedule.append(home.espn_id)
+        rosters = {team: make_roster(rng, team.espn_id, year) for team in teams}
+
+        for week, pairs in enumerate(weekly_pairs, start=1):
+            if week > weeks_played:
+                break
+            play_week(rng, pairs, year, week, GameType.REGULAR_SEASON, rosters)
+            fantasy_league.mark_week_final(year, week)
+        if weeks_played > regular_season_length:
+            play_playoffs(rng, fantasy_league, teams, year, rosters, weeks_played)
+    return fantasy_league
+
+
+def player_data_response(teams, seed=0):
+    """Makes up the JSON ESPN sends for fetch_player_data (the roster and matchup views for a week) for the given
+    number of teams, with a full lineup each"""
+    rng = random.Random(seed)
+    roster_teams = []
+    schedule = []
+    for espn_id in range(1, teams + 1):
+        roster = make_roster(rng, espn_id, LAST_YEAR)
+        roster_teams.append({"id": espn_id,
+                             "roster": {"entries": [{"lineupSlotId": slot.value, "playerId": player_id}
+                                                    for (player_id, _, _), slot in zip(roster, LINEUP_SLOTS)]}})
+        entries = [{"playerId": player_id,
+                    "playerPoolEntry": {"appliedStatTotal": rng.uniform(0, 30),
+                                        "player": {"defaultPositionId": ESPN_POSITION_IDS.get(position),
+                                                   "fullName": name}}}
+                   for player_id, name, position in roster]
+        # Each game in the schedule has a home and an away team
+        if espn_id % 2:
+            schedule.append({"home": {"rosterForCurrentScoringPeriod": {"entries": entries}}})
+        else:
+            schedule[-1]["away"] = {"rosterForCurrentScoringPeriod": {"entries": entries}}
+    return {"schedule": schedule, "teams": roster_teams}
+
+
+def write_synthetic_league(fantasy_league, directory, league_name, storage="pickle"):
+    """Saves a league, and its playoff snapshot, where the site expects to find them, the same way update_league.py
+    does. Returns the league's path"""
+    os.makedirs(directory, exist_ok=True)
+    path = league_filename(directory, league_name, storage)
+    full_playoff_picture = write_playoff_snapshot(fantasy_league, directory)
+    record_book = RecordBook(fantasy_league, full_playoff_picture, "") if storage == "sqlite" else None
+    save_league(fantasy_league, path, record_book)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Make up a league of any size, EG to benchmark the site against")
+    parser.add_argument("output", help="Directory to write the league and its playoff snapshot to")
+    parser.add_argument("--years", type=int, default=10, help="How many seasons the league has existed for")
+    parser.add_argument("--members", type=int, default=12, help="How many members (and teams each year) it has")
+    parser.add_argument("--current-week", type=int, help="Leave the last season in progress, at this week")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random numbers, so leagues can be remade")
+    parser.add_argument("--storage", choices=STORAGE_EXTENSIONS, default="pickle", help="How to store the league")
+    parser.add_argument("--league-name", default="SYNTHETIC", help="The league_name the site will look for it by")
+    args = parser.parse_args()
+
+    league = generate_league(years=args.years, members=args.members, current_week=args.current_week, seed=args.seed)
+    league_path = write_synthetic_league(league, args.output, args.league_name, args.storage)
+    print(f"Wrote a {args.years} year, {args.members} member league to {league_path}")
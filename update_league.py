@@ -1,175 +1,80 @@
 import argparse
 import configparser
-import itertools
 import json
 import os
-import pickle
-import requests
-from collections import defaultdict
-from copy import deepcopy
+import time
 from datetime import date
-from espn_api.football import League
-from espn_api.requests.espn_requests import ESPNInvalidLeague
 
 import utility
-from fantasy_classes import FantasyLeague, Matchup, Member, Player, Team
+from espn_cache import ResponseCache
+from espn_fetch import (DEFAULT_CONCURRENCY, DEFAULT_RATE_LIMIT, DEFAULT_RETRIES, RequestStats, create_session,
+                        fetch_scoreboards, fetch_weeks_player_data, fetch_years, use_session, week_is_final,
+                        weeks_to_fetch)
+from fantasy_classes import FantasyLeague, Matchup, Member, Team
 from fantasy_enums import GameOutcome, GameType
+from league_storage import STORAGE_EXTENSIONS, league_filename, load_league, save_league
+from playoff_odds import DEFAULT_SIMULATIONS, write_playoff_odds
+from record_book import RecordBook
+from standings import write_playoff_snapshot
 
-config = configparser.ConfigParser()
 dir_path = os.path.dirname(os.path.realpath(__file__))
-config.read(f'{dir_path}/config.ini')
-
-S2 = config["ESPN"]["s2"]
-SWID = config["ESPN"]["swid"]
-LEAGUE_ID = int(config["ESPN"]["league_id"])
-FIRST_YEAR = int(config["ESPN"]["league_founded"])
-FULL_BRACKET_SLOTS = 19
-LEAGUE_NAME = config["WEBSITE"]["league_name"].replace('"', '')
-LEAGUE_ABBREVIATION = config["WEBSITE"]["league_abbreviation"].replace('"', '')
-MEET_THE_MANAGERS_ASSETS = os.path.join('static/meet_the_managers')
-MANAGER_BIOS_PATH = os.path.join(MEET_THE_MANAGERS_ASSETS, 'manager_bios.json')
+# Where config.ini is, and where the league, snapshot, and odds are written for the site. The same as the site's (see
+# app.py), so RECORDS_DATA_DIR points both at somewhere else
+data_path = os.environ.get("RECORDS_DATA_DIR", dir_path)
 
 # Placeholders for BYE weeks
 PLACEHOLDER_LEAGUE = FantasyLeague(espn_s2="", espn_swid="", founded_year=99999, league_id=99999)
 PLACEHOLDER_MEMBER = Member(member_id="", league=PLACEHOLDER_LEAGUE, name="")
 PLACEHOLDER_TEAM = Team(division=99999, espn_id=99999, name="", member=PLACEHOLDER_MEMBER, schedule=[], year=99999)
 
-# Create a new instance of a league from the config values
-fantasy_league = FantasyLeague(espn_s2=S2, espn_swid=SWID, founded_year=FIRST_YEAR, league_id=LEAGUE_ID)
-
-# Override the new instance if the --cache flag is provided at runtime and a saved instance is already on disk
-league_pickle_filename = f"{dir_path}/{LEAGUE_NAME}.pickle"
-parser = argparse.ArgumentParser(description="Process command-line flags")
-parser.add_argument('--cache', action='store_true', help="Load the cached league instance from disk")
-args = parser.parse_args()
-if args.cache and os.path.exists(league_pickle_filename):
-    with open(league_pickle_filename, "rb") as f:
-        fantasy_league = pickle.load(f)
-
-
-def fetch_player_data(league_id, espn_s2, espn_swid, fetch_year, fetch_week):
-    """Gets name, points, position_id, and team for players in the given year/week combination.
-    Data not available prior to 2018. Returns data as a defaultdict[week: list[Player]]"""
-
-    # Start a defaultdict for the results
-    output_data = defaultdict(list)
-    # This data is not available prior to 2018
-    if fetch_year < 2018:
-        return output_data
-
-    endpoint = f"https://lm-api-reads.fantasy.espn.com/apis/v3/games/ffl/seasons/{fetch_year}/segments/0/leagues/{league_id}"
-    params = {
-        "view": "mRoster",
-        "scoringPeriodId": fetch_week,
-    }
-    cookies = {
-        'swid': espn_swid,
-        'espn_s2': espn_s2
-    }
-    # Rostered players that week
-    rostered = []
-    r = requests.get(endpoint, params=params, cookies=cookies)
-    if r.status_code != 200:
-        print("year: ", fetch_year, "week: ", fetch_week, "returned an HTTP", r.status_code)
-        return output_data
-
-    result = r.json()
-    # Loop over the teams' rosters
-    for fetch_team in result.get("teams"):
-        for entry in fetch_team.get("roster").get("entries"):
-            # Add the data that can be pulled from this endpoint
-            rostered.append({
-                "name": None,
-                "on_team": fetch_team.get("id"),
-                "player_id": entry.get("playerId"),
-                "points": None,
-                "position_id": entry.get("lineupSlotId"),
-            })
-
-    params = {
-        "view": "mMatchup",
-        "scoringPeriodId": fetch_week,
-    }
-    r = requests.get(endpoint, params=params, cookies=cookies)
-    if r.status_code != 200:
-        print("year: ", fetch_year, "week: ", fetch_week, "returned an HTTP", r.status_code)
-        return output_data
-
-    # Create a list of scheduled players
-    scheduled = []
-    # Get players who were played and players who were benched
-    result = r.json()
-    for game in result.get("schedule"):
-        scheduled.extend(game.get("home", {}).get("rosterForCurrentScoringPeriod", {}).get("entries", []))
-        scheduled.extend(game.get("away", {}).get("rosterForCurrentScoringPeriod", {}).get("entries", []))
-
-    # Enrich the rostered players with the scheduled players (only fully works in 2018 or later)
-    for rostered_player in rostered:
-        for scheduled_player in scheduled:
-            if scheduled_player.get("playerId") == rostered_player.get("player_id"):
-                rostered_player["name"] = scheduled_player.get("playerPoolEntry").get("player").get("fullName")
-                rostered_player["points"] = scheduled_player.get("playerPoolEntry").get("appliedStatTotal")
-
-    # Use the data we put together to create a player object
-    for rostered_player in rostered:
-        if rostered_player.get("name"):
-            player_object = Player(espn_id=rostered_player.get("player_id"),
-                                   name=rostered_player.get("name"),
-                                   points=rostered_player.get("points"),
-                                   position=rostered_player.get("position_id"))
-            output_data[rostered_player.get("on_team")].append(player_object)
-
-    return output_data
-
-
-def get_year_from_api(query_year):
-    """ Returns an ESPN_API object for the given year """
-    return League(league_id=fantasy_league.id, year=query_year, espn_s2=fantasy_league.espn_s2, swid=fantasy_league.espn_swid)
-
-
-# Get all years that the league could have existed
-all_league_years = range(fantasy_league.founded_year, date.today().year + 1)
-
-# Loop over years the league could have existed
-api_years = []
-for year in all_league_years:
-    # Try to get the data for the league for that year
-    try:
-        api_year = get_year_from_api(year)
-        # If the year of gathered data is newer than the newest active year, the league needs to be updated
-        if fantasy_league.active_year < year:
-            api_years.append(api_year)
-            fantasy_league.update_active_year(year)
-            fantasy_league.update_active_year_playoff_slots(api_year.settings.playoff_team_count)
-            fantasy_league.update_active_year_regular_season_length(api_year.settings.reg_season_count)
-        # If the year of gathered data has not yet completed, the league needs to be updated
-        if api_year.current_week < len(api_year.settings.matchup_periods):
-            api_years.append(api_year)
-        # If the year of gathered data has completed, the maximum completed year should be updated
-        else:
-            fantasy_league.update_max_completed_year(year)
-    # If it fails, that's ok
-    # It most likely just means that the fantasy football year hasn't started for the calendar year
-    except ESPNInvalidLeague:
-        continue
 
-# Now loop over the data that needs to be integrated into the league instance
-for api_year in api_years:
+def parse_refetch(value):
+    """Parses a YEAR or YEAR:WEEK command-line value into a (year, week) tuple, with a week of None for a whole year"""
+    try:
+        year, _, week = value.partition(":")
+        return int(year), int(week) if week else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not in the form YEAR or YEAR:WEEK")
+
+
+def build_parser(config, prog=None):
+    """Builds the command-line parser, with defaults taken from the config"""
+    parser = argparse.ArgumentParser(prog=prog, description="Fetch new league data from ESPN and store it for the site")
+    # Override the new instance if the --cache flag is provided at runtime and a saved instance is already on disk
+    parser.add_argument('--cache', action='store_true', help="Load the cached league instance from disk")
+    parser.add_argument('--storage', choices=STORAGE_EXTENSIONS,
+                        default=config["WEBSITE"].get("storage", fallback="pickle"),
+                        help="How to store the league on disk (defaults to the storage setting in config.ini)")
+    parser.add_argument('--workers', type=int, help="Maximum number of ESPN requests to make at the same time")
+    parser.add_argument('--refetch', action='append', default=[], type=parse_refetch, metavar="YEAR[:WEEK]",
+                        help="Fetch a year (or a single week of it) again even if it is already final. Can be repeated")
+    parser.add_argument('--no-http-cache', action='store_true',
+                        help="Don't read or write the on-disk ESPN response cache")
+    parser.add_argument('--offline', action='store_true',
+                        help="Only use the on-disk ESPN response cache, never the network")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Number of processes to work out clinches and simulate the playoff odds with")
+    parser.add_argument('--simulations', type=int,
+                        default=config["WEBSITE"].getint("playoff_odds_simulations", fallback=DEFAULT_SIMULATIONS),
+                        help="How many times to simulate the rest of the season for the playoff odds (0 to skip them)")
+    parser.add_argument('--summary', help="Also write the JSON summary of the run to this file")
+    return parser
+
+
+def merge_members_and_teams(fantasy_league, api_year):
+    """Adds a year's members and teams to the league, or updates the ones it already has"""
     # Loop over the members of the league that year and grab a few of their identifiers
     for member in api_year.members:
         name = utility.clean_member_name(f'{member.get("firstName")} {member.get("lastName")}')
         member_id = utility.clean_user_id(member.get("id"))
-        member_object = Member(league=fantasy_league, member_id=member_id, name=name)
         # If the id matches an existing league member, update the data for that member
-        for existing in fantasy_league.members:
-            if member_object.same(existing):
-                # update existing members
-                existing.update_joined_year(api_year.year)
-                existing.update_left_year(api_year.year)
-                break
-        # If the loop completed without a break (IE there was no match to an existing league member)
-        # Add the new member to the league
+        existing = fantasy_league.get_member(member_id)
+        if existing is not None:
+            existing.update_joined_year(api_year.year)
+            existing.update_left_year(api_year.year)
+        # If there was no match to an existing league member, add the new member to the league
         else:
+            member_object = Member(league=fantasy_league, member_id=member_id, name=name)
             member_object.update_joined_year(api_year.year)
             fantasy_league.add_member(member_object)
 
@@ -180,413 +85,268 @@ for api_year in api_years:
     for team in api_year.teams:
         # Get the ESPN-assigned team ID
         espn_id = team.team_id
-        # Loop over the league members to find its owner
-        for member in fantasy_league.members:
-            # Match on the owner
-            if any(member.id == utility.clean_user_id(team_owner.get("id")) for team_owner in team.owners):
-                # Use the ESPN team ID and year to generate a true team ID
-                team_id = utility.generate_team_id(espn_id, api_year.year)
-                # If the owner already has a record of that team, update the record
-                for existing_team in member.teams:
-                    if utility.generate_team_id(existing_team.espn_id, existing_team.year) == team_id:
-                        existing_team.update_regular_season_losses(team.losses)
-                        existing_team.update_regular_season_ties(team.ties)
-                        existing_team.update_regular_season_wins(team.wins)
-                        break
-                # If the loop completed without a break (IE there was no match to an existing member's teams)
-                # Add the new team to the member
-                else:
-                    team_name = utility.clean_team_name(member.name, api_year.year, team.team_name)
-                    schedule_ids = [opponent.team_id for opponent in team.schedule]
-                    team_object = Team(division=team.division_id, espn_id=espn_id, name=team_name,
-                                       member=member, schedule=schedule_ids, year=api_year.year)
-                    team_object.update_regular_season_losses(team.losses)
-                    team_object.update_regular_season_ties(team.ties)
-                    team_object.update_regular_season_wins(team.wins)
-                    member.add_team(team_object)
-
-    # Figure out how far into the season we are
-    max_week = min(len(api_year.settings.matchup_periods), api_year.current_week)
-
-    # Get the teams from the league for the given year
-    this_years_teams = {team for team in fantasy_league.team_superset() if team.year == api_year.year}
-
-    # Loop over the weeks of the season that have happened or are in progress
-    for week in range(1, max_week + 1):
-        # Get the scoreboard for that week
-        scoreboard = api_year.scoreboard(week)
-        # If nobody has any points, the ESPN API doesn't have data for that week, so skip it
-        if all(game.home_score == 0 for game in scoreboard) and all(game.away_score == 0 for game in scoreboard):
-            continue
-        # Get the custom-built player data for that week
-        player_data = fetch_player_data(fantasy_league.id, fantasy_league.espn_s2, fantasy_league.espn_swid, api_year.year, week)
-        # Loop over the matchups for the week's scoreboard
-        for matchup in scoreboard:
-            # Skip "fake" playoff games
-            if matchup.matchup_type in ["LOSERS_CONSOLATION_LADDER", "WINNERS_CONSOLATION_LADDER"]:
+        # Look up the league member for each of the team's owners
+        owner_ids = sorted({utility.clean_user_id(team_owner.get("id")) for team_owner in team.owners})
+        for member in (fantasy_league.get_member(owner_id) for owner_id in owner_ids):
+            if member is None:
                 continue
-            # Set the game to be a regular season game
-            matchup_type = GameType.REGULAR_SEASON
-            # Switch it to a playoff game if it matches the "real" playoff game type
-            if matchup.matchup_type == "WINNERS_BRACKET":
-                matchup_type = GameType.PLAYOFF
-            # Get the home team's ID
-            try:
-                home_team_id = utility.generate_team_id(matchup.home_team.team_id, api_year.year)
-            # Or set it to None, denoting a BYE
-            except AttributeError:
-                home_team_id = None
-            # Get the away team's ID
-            try:
-                away_team_id = utility.generate_team_id(matchup.away_team.team_id, api_year.year)
-            # Or set it to None, denoting a BYE
-            except AttributeError:
-                away_team_id = None
-            for team in this_years_teams:
-                if utility.generate_team_id(team.espn_id, team.year) == home_team_id:
-                    # If there was no away team, throw in a placeholder
-                    if away_team_id is None:
-                        opponent = PLACEHOLDER_TEAM
-                    # If there was an away team, find it
-                    else:
-                        opponent = [opponent for opponent in this_years_teams if utility.generate_team_id(opponent.espn_id, opponent.year) == away_team_id][0]
-                    # Set the outcome to a win
-                    outcome = GameOutcome.WIN
-                    # Change it to a loss if the away team scored more points
-                    if matchup.home_score < matchup.away_score:
-                        outcome = GameOutcome.LOSS
-                    # Or change it to a tie if the teams had the same amount of points
-                    elif matchup.home_score == matchup.away_score:
-                        outcome = GameOutcome.TIE
-                    # Create a matchup object based on the information gathered
-                    matchup_object = Matchup(opponent=opponent, outcome=outcome, points_against=matchup.away_score,
-                                             points_for=matchup.home_score, team=team, game_type=matchup_type,
-                                             week=week)
-                    # Add the players for the team into the matchup object IF IT EXISTS
-                    # Remember that prior to 2018 this data doesn't exist
-                    if player_data:
-                        for player in player_data.get(matchup.home_team.team_id):
-                            matchup_object.add_player(player)
-                    # If this matchup is not already in the matchup set for a given team, add it
-                    if not any(matchup_object.same(existing) for existing in team.matchups):
-                        team.add_matchup(matchup_object)
-                elif utility.generate_team_id(team.espn_id, team.year) == away_team_id:
-                    # If there was no away team, throw in a placeholder
-                    if home_team_id is None:
-                        opponent = PLACEHOLDER_TEAM
-                    # If there was a home team, find it
-                    else:
-                        opponent = [opponent for opponent in this_years_teams if utility.generate_team_id(opponent.espn_id, opponent.year) == home_team_id][0]
-                    # Set the outcome to a win
-                    outcome = GameOutcome.WIN
-                    # Change it to a loss if the home team scored more points
-                    if matchup.home_score > matchup.away_score:
-                        outcome = GameOutcome.LOSS
-                    # Or change it to a tie if the teams had the same amount of points
-                    elif matchup.home_score == matchup.away_score:
-                        outcome = GameOutcome.TIE
-                    # Create a matchup object based on the information gathered
-                    matchup_object = Matchup(opponent=opponent, outcome=outcome, points_against=matchup.home_score,
-                                             points_for=matchup.away_score, team=team, game_type=matchup_type,
-                                             week=week)
-                    # Add the players for the team into the matchup object IF IT EXISTS
-                    # Remember that prior to 2018 this data doesn't exist
-                    if player_data:
-                        for player in player_data.get(matchup.away_team.team_id):
-                            matchup_object.add_player(player)
-                    # If this matchup is not already in the matchup set for a given team, add it
-                    if not any(matchup_object.same(existing) for existing in team.matchups):
-                        team.add_matchup(matchup_object)
-
-
-with open(league_pickle_filename, "wb") as f:
-    pickle.dump(fantasy_league, f, protocol=pickle.HIGHEST_PROTOCOL)
-
-
-# Now do stuff for the playoffs
-# Create a dict {division_id: list[team_id_in_division]}
-divisions = defaultdict(list)
-for team in fantasy_league.teams_in_active_year():
-    divisions[team.division].append(team.espn_id)
-
-
-# Create two dicts containing the data needed to calculate standings
-#     divisional_raw_data - data required to figure out who is winning a division
-#     flat_raw_data - data required to figure out who is winning the points-for wildcard race
-divisional_raw_data = defaultdict(list)
-flat_raw_data = []
-
-for team in fantasy_league.teams_in_active_year():
-    # Calculate how many in-division wins a team has
-    divisional_wins = 0
-    divisional_losses = 0
-    for matchup in team.matchups:
-        if (matchup.type == GameType.REGULAR_SEASON and
-                matchup.outcome == GameOutcome.WIN and
-                matchup.opponent.espn_id in divisions.get(team.division)):
-            divisional_wins += 1
-        elif (matchup.type == GameType.REGULAR_SEASON and
-              matchup.outcome == GameOutcome.LOSS and
-              matchup.opponent.espn_id in divisions.get(team.division)):
-            divisional_losses += 1
-
-    team_stats = {
-        "divisional_losses": divisional_losses,
-        "divisional_wins": divisional_wins,
-        "losses": team.regular_season_losses,
-        "name": team.name,
-        "points_for": team.regular_season_points_scored(),
-        "ties": team.regular_season_ties,
-        "wins": team.regular_season_wins,
-    }
-    # Store the raw data in the dict split by division
-    divisional_raw_data[team.division].append(team_stats)
-    # Store it again in the dict not split by division
-    flat_raw_data.append(team_stats)
-
-"""
-WFFL rules state that divisional standings are determined as follows:
-    Overall record
-    Tiebreaker 1 - divisional record
-    Tiebreaker 2 - total points scored
-"""
-
-# Now sort the raw divisional data so that each key contains a sorted list representing the standings for that division
-divisional_standings = {}
-
-for division, division_data in divisional_raw_data.items():
-    divisional_standings[division] = sorted(division_data, key=lambda team_data: (
-        team_data.get("wins"),
-        team_data.get("divisional_wins"),
-        team_data.get("points_for"),
-    ), reverse=True)
-
-"""
-WFFL rules state that wildcard standings are determined as follows:
-    Total points for
-    Tiebreaker 1 - overall record
-    Tiebreaker 2 - divisional record
-"""
-
-# And sort the raw flat data so that it is a list representing the wildcard standings
-wildcard_standings = sorted(flat_raw_data,
-                            key=lambda team_data: (
-                                team_data.get("points_for"),
-                                team_data.get("wins"),
-                                team_data.get("divisional_wins"),
-                            ), reverse=True)
-
-
-# Determine who is leading each division and store them in a dict {division_id: team_data}
-unsorted_division_leaders = {}
-for division, division_data in divisional_standings.items():
-    unsorted_division_leaders[division] = division_data[0]
-
-
-"""
-Once the standings are sorted, divisional winners are seeded by total wins
-    Tiebreaker 1 - total points scored
-"""
-
-
-sorted_division_leaders = sorted(unsorted_division_leaders.values(),
-                                 key=lambda team_data: (
-                                     team_data.get("wins"),
-                                     team_data.get("points_for"),
-                                 ), reverse=True)
-
-"""
-Then wildcard spots are determined by total points for
-    Tiebreaker 1 - total wins
-"""
-
-for leader in sorted_division_leaders:
-    wildcard_standings.remove(leader)
-
-sorted_wildcard_leaders = wildcard_standings[:2]
-
-"""
-The remaining teams are re-sorted by total wins
-    Tiebreaker 1 - total points scored
-"""
-
-sorted_rest_of_league = sorted(wildcard_standings[2:],
-                               key=lambda team_data: (
-                                   team_data.get("wins"),
-                                   team_data.get("points_for"),
-                               ), reverse=True)
-
-# Playoff teams are given their seed
-# Teams on the outside of the playoffs looking in have their total-points-needed for a wildcard spot calculated
-# Pooper bowl teams are given their seed
-full_playoff_picture = []
-seed = 1
-for team_data in itertools.chain(sorted_division_leaders, sorted_wildcard_leaders, sorted_rest_of_league):
-    if seed <= fantasy_league.active_year_playoff_slots:
-        team_data["seed"] = seed
+            # If the owner already has a record of that team, update the record
+            existing_team = next((existing for existing in fantasy_league.get_teams(api_year.year, espn_id)
+                                  if existing.member is member), None)
+            if existing_team is not None:
+                existing_team.update_regular_season_losses(team.losses)
+                existing_team.update_regular_season_ties(team.ties)
+                existing_team.update_regular_season_wins(team.wins)
+            # If there was no match to an existing member's teams, add the new team to the member
+            else:
+                team_name = utility.clean_team_name(member.name, api_year.year, team.team_name)
+                schedule_ids = [opponent.team_id for opponent in team.schedule]
+                team_object = Team(division=team.division_id, espn_id=espn_id, name=team_name,
+                                   member=member, schedule=schedule_ids, year=api_year.year)
+                team_object.update_regular_season_losses(team.losses)
+                team_object.update_regular_season_ties(team.ties)
+                team_object.update_regular_season_wins(team.wins)
+                member.add_team(team_object)
+
+
+def merge_week(fantasy_league, year, week, scoreboard, player_data):
+    """Adds a week's matchups, and their lineups if there are any, to the league's teams"""
+    # Loop over the matchups for the week's scoreboard
+    for matchup in scoreboard:
+        # Skip "fake" playoff games
+        if matchup.matchup_type in ["LOSERS_CONSOLATION_LADDER", "WINNERS_CONSOLATION_LADDER"]:
+            continue
+        # Set the game to be a regular season game
+        matchup_type = GameType.REGULAR_SEASON
+        # Switch it to a playoff game if it matches the "real" playoff game type
+        if matchup.matchup_type == "WINNERS_BRACKET":
+            matchup_type = GameType.PLAYOFF
+        # Get the home team's ESPN ID, or None for a BYE
+        home_espn_id = getattr(matchup.home_team, "team_id", None)
+        # Get the away team's ESPN ID, or None for a BYE
+        away_espn_id = getattr(matchup.away_team, "team_id", None)
+        home_teams = fantasy_league.get_teams(year, home_espn_id)
+        away_teams = fantasy_league.get_teams(year, away_espn_id)
+        for team in home_teams:
+            # If there was no away team, throw in a placeholder
+            opponent = away_teams[0] if away_teams else PLACEHOLDER_TEAM
+            # Set the outcome to a win
+            outcome = GameOutcome.WIN
+            # Change it to a loss if the away team scored more points
+            if matchup.home_score < matchup.away_score:
+                outcome = GameOutcome.LOSS
+            # Or change it to a tie if the teams had the same amount of points
+            elif matchup.home_score == matchup.away_score:
+                outcome = GameOutcome.TIE
+            # Create a matchup object based on the information gathered
+            matchup_object = Matchup(opponent=opponent, outcome=outcome, points_against=matchup.away_score,
+                                     points_for=matchup.home_score, team=team, game_type=matchup_type,
+                                     week=week)
+            # Add the players for the team into the matchup object IF IT EXISTS
+            # Remember that prior to 2018 this data doesn't exist
+            if player_data:
+                for player in player_data.get(home_espn_id):
+                    matchup_object.add_player(player)
+            # Add the matchup to the team, replacing any stale copy of it (EG a score ESPN has since corrected)
+            team.upsert_matchup(matchup_object)
+        for team in away_teams:
+            # If there was no home team, throw in a placeholder
+            opponent = home_teams[0] if home_teams else PLACEHOLDER_TEAM
+            # Set the outcome to a win
+            outcome = GameOutcome.WIN
+            # Change it to a loss if the home team scored more points
+            if matchup.home_score > matchup.away_score:
+                outcome = GameOutcome.LOSS
+            # Or change it to a tie if the teams had the same amount of points
+            elif matchup.home_score == matchup.away_score:
+                outcome = GameOutcome.TIE
+            # Create a matchup object based on the information gathered
+            matchup_object = Matchup(opponent=opponent, outcome=outcome, points_against=matchup.home_score,
+                                     points_for=matchup.away_score, team=team, game_type=matchup_type,
+                                     week=week)
+            # Add the players for the team into the matchup object IF IT EXISTS
+            # Remember that prior to 2018 this data doesn't exist
+            if player_data:
+                for player in player_data.get(away_espn_id):
+                    matchup_object.add_player(player)
+            # Add the matchup to the team, replacing any stale copy of it (EG a score ESPN has since corrected)
+            team.upsert_matchup(matchup_object)
+
+
+def update_league(config, args, data_directory):
+    """Fetches whatever has changed from ESPN, merges it into the stored league, and writes the league, playoff
+    snapshot, and playoff odds to the data directory for the site. Returns a summary of the run"""
+    # Time each stage of the run, and count what is sent to ESPN, for the summary
+    run_started = time.time()
+    stage_timer = utility.StageTimer()
+    request_stats = RequestStats()
+
+    fetch_concurrency = args.workers or config["ESPN"].getint("fetch_concurrency", fallback=DEFAULT_CONCURRENCY)
+    rate_limit = config["ESPN"].getfloat("max_requests_per_second", fallback=DEFAULT_RATE_LIMIT)
+    retries = config["ESPN"].getint("max_retries", fallback=DEFAULT_RETRIES)
+    league_name = config["WEBSITE"]["league_name"].replace('"', '')
+
+    # Create a new instance of a league from the config values, or load the stored one if asked to and there is one
+    fantasy_league = FantasyLeague(espn_s2=config["ESPN"]["s2"], espn_swid=config["ESPN"]["swid"],
+                                   founded_year=int(config["ESPN"]["league_founded"]),
+                                   league_id=int(config["ESPN"]["league_id"]))
+    league_storage_filename = league_filename(data_directory, league_name, args.storage)
+    if args.cache and os.path.exists(league_storage_filename):
+        with stage_timer.stage("load league"):
+            fantasy_league = load_league(league_storage_filename)
+
+    def response_is_final(year, week):
+        """Returns a boolean representing whether ESPN's data for a season (or a week of it) can no longer change"""
+        return year <= fantasy_league.max_completed_year or (week is not None and
+                                                             fantasy_league.is_week_final(year, week))
+
+    # Raw ESPN responses are kept on disk so that data which can no longer change is never downloaded twice
+    http_cache = None
+    if not args.no_http_cache:
+        http_cache = ResponseCache(config["ESPN"].get("cache_dir", fallback=f"{data_directory}/espn_cache"))
+        # Size the shared connection pool to match the concurrency, so every request can reuse a kept-alive connection
+        use_session(create_session(fetch_concurrency, cache=http_cache, rate_limit=rate_limit, retries=retries,
+                                   stats=request_stats, is_final=response_is_final, offline=args.offline,
+                                   refetch=args.refetch))
     else:
-        team_data["points_out"] = round(sorted_wildcard_leaders[-1].get("points_for") - team_data.get("points_for"), 2)
-    if seed >= len(list(fantasy_league.teams_in_active_year())) - 1:
-        team_data["seed"] = "P"
-    full_playoff_picture.append(team_data)
-    seed += 1
-
-# Get the regular season games played by the first place person (should be the same as everyone else)
-regular_season_games_played = (int(full_playoff_picture[0].get("losses")) +
-                               int(full_playoff_picture[0].get("ties")) +
-                               int(full_playoff_picture[0].get("wins")))
-
-# First seed gets a bye, so they win game 1
-full_playoff_picture.append(full_playoff_picture[0])
-# Second seed gets a bye, so they win game 2
-full_playoff_picture.append(full_playoff_picture[1])
-# Who won the 4 vs 5 matchup?
-for team in fantasy_league.teams_in_active_year():
-    if team.name == full_playoff_picture[3].get("name"):
-        for matchup in team.matchups:
-            if matchup.week == regular_season_games_played + 1 and matchup.outcome == GameOutcome.WIN:
-                full_playoff_picture.append(full_playoff_picture[3])
-                break
-            elif matchup.week == regular_season_games_played + 1 and matchup.outcome == GameOutcome.LOSS:
-                full_playoff_picture.append(full_playoff_picture[4])
-                break
-# Who won the 3 vs 6 matchup?
-for team in fantasy_league.teams_in_active_year():
-    if team.name == full_playoff_picture[2].get("name"):
-        for matchup in team.matchups:
-            if matchup.week == regular_season_games_played + 1 and matchup.outcome == GameOutcome.WIN:
-                full_playoff_picture.append(full_playoff_picture[2])
-                break
-            elif matchup.week == regular_season_games_played + 1 and matchup.outcome == GameOutcome.LOSS:
-                full_playoff_picture.append(full_playoff_picture[5])
-                break
-# Who won the round 2 high seed matchup?
-for team in fantasy_league.teams_in_active_year():
-    if team.name == full_playoff_picture[0].get("name"):
-        for matchup in team.matchups:
-            if matchup.week == regular_season_games_played + 2 and matchup.outcome == GameOutcome.WIN:
-                full_playoff_picture.append(full_playoff_picture[0])
-                break
-            elif matchup.week == regular_season_games_played + 2 and matchup.outcome == GameOutcome.LOSS:
-                full_playoff_picture.append(full_playoff_picture[-2])
-                break
-# Who won the round 2 low seed matchup?
-for team in fantasy_league.teams_in_active_year():
-    if team.name == full_playoff_picture[1].get("name"):
-        for matchup in team.matchups:
-            if matchup.week == regular_season_games_played + 2 and matchup.outcome == GameOutcome.WIN:
-                full_playoff_picture.append(full_playoff_picture[1])
-                break
-            elif matchup.week == regular_season_games_played + 2 and matchup.outcome == GameOutcome.LOSS:
-                full_playoff_picture.append(full_playoff_picture[-2])
-                break
-# Who won the championship?
-for team in fantasy_league.teams_in_active_year():
-    if team.name == full_playoff_picture[-2].get("name"):
-        for matchup in team.matchups:
-            if matchup.week == regular_season_games_played + 3 and matchup.outcome == GameOutcome.WIN:
-                full_playoff_picture.append(full_playoff_picture[-2])
-                break
-            elif matchup.week == regular_season_games_played + 3 and matchup.outcome == GameOutcome.LOSS:
-                full_playoff_picture.append(full_playoff_picture[-1])
+        use_session(create_session(fetch_concurrency, rate_limit=rate_limit, retries=retries, stats=request_stats))
+
+    # Lineups stored before players' default positions were can't be used for the lineup records, so those weeks are
+    # merged again. ESPN's cached responses have the positions in them, so they don't need to be downloaded again
+    position_weeks = fantasy_league.weeks_without_positions()
+    if position_weeks:
+        print("Refetching", len(position_weeks), "weeks whose lineups were stored without players' positions")
+
+    # Forget that the weeks being refetched are final so they get fetched and merged again
+    refetch_weeks = args.refetch + position_weeks
+    refetch_years = sorted({year for year, _ in refetch_weeks})
+    for year, week in refetch_weeks:
+        fantasy_league.clear_final_weeks(year, week)
+
+    # Get all years that the league could have existed, skipping completed years that are already stored
+    all_league_years = [year for year in range(fantasy_league.founded_year, date.today().year + 1)
+                        if year > fantasy_league.max_completed_year or year in refetch_years]
+
+    # Fetch every year that may need updating at the same time; years ESPN has no league for are left out
+    with stage_timer.stage("discover years"):
+        fetched_years = fetch_years(fantasy_league.id, fantasy_league.espn_s2, fantasy_league.espn_swid,
+                                    all_league_years, max_workers=fetch_concurrency)
+
+    # Loop over the years the league existed, in order
+    api_years = []
+    completed_years = []
+    for year, api_year in fetched_years.items():
+        # If the year of gathered data is newer than the newest active year, the league needs to be updated
+        if fantasy_league.active_year < year:
+            api_years.append(api_year)
+            fantasy_league.update_active_year(year)
+            fantasy_league.update_active_year_playoff_slots(api_year.settings.playoff_team_count)
+            fantasy_league.update_active_year_regular_season_length(api_year.settings.reg_season_count)
+        # If the year of gathered data has not yet completed, the league needs to be updated
+        if api_year.current_week < len(api_year.settings.matchup_periods):
+            if api_year not in api_years:
+                api_years.append(api_year)
+        # If the year of gathered data has completed, the maximum completed year should be updated (once it is merged)
+        else:
+            completed_years.append(year)
+            # If it wasn't merged completely last time (EG some of its lineups were missing), try again
+            if year > fantasy_league.max_completed_year and api_year not in api_years:
+                api_years.append(api_year)
+        # If the year is being refetched, it needs to be updated too
+        if year in refetch_years and api_year not in api_years:
+            api_years.append(api_year)
+
+    # Fetch the scoreboards for every week that isn't final yet, all at the same time
+    with stage_timer.stage("scoreboards"):
+        scoreboards = fetch_scoreboards([(api_year, week) for api_year in api_years
+                                         for week in weeks_to_fetch(api_year)
+                                         if not fantasy_league.is_week_final(api_year.year, week)],
+                                        max_workers=fetch_concurrency)
+
+    # Then the player data for every one of those weeks that ESPN has data for
+    with stage_timer.stage("player data"):
+        player_data_by_week = fetch_weeks_player_data(fantasy_league.id, fantasy_league.espn_s2,
+                                                      fantasy_league.espn_swid,
+                                                      [year_week for year_week, scoreboard in scoreboards.items()
+                                                       if scoreboard is not None],
+                                                      max_workers=fetch_concurrency)
+    week_data = {year_week: (scoreboard, player_data_by_week.get(year_week))
+                 for year_week, scoreboard in scoreboards.items() if scoreboard is not None}
+    # Weeks ESPN wouldn't send the lineups for, even after retrying
+    missing_lineups = [year_week for year_week, player_data in player_data_by_week.items() if player_data is None]
+
+    # Now loop over the data that needs to be integrated into the league instance
+    with stage_timer.stage("merge"):
+        for api_year in api_years:
+            merge_members_and_teams(fantasy_league, api_year)
+
+            # Loop over the weeks of the season that have happened or are in progress
+            for week in weeks_to_fetch(api_year):
+                # If the week was already final it wasn't fetched, and if the ESPN API doesn't have data for it, skip it
+                if week_data.get((api_year.year, week)) is None:
+                    continue
+                # Get the scoreboard and the custom-built player data for that week
+                scoreboard, player_data = week_data[(api_year.year, week)]
+                merge_week(fantasy_league, api_year.year, week, scoreboard, player_data)
+
+                # Once a week is over its results won't change, so future updates can skip fetching it. Unless its
+                # lineups couldn't be fetched, in which case the next update tries again
+                if week_is_final(api_year, week) and (api_year.year, week) not in missing_lineups:
+                    fantasy_league.mark_week_final(api_year.year, week)
+
+        # Completed years are never fetched again, so a year only counts as completed once all of its lineups are in
+        for year in completed_years:
+            if any(missing_year == year for missing_year, _ in missing_lineups):
                 break
+            fantasy_league.update_max_completed_year(year)
 
-# If there are less than a full bracket's worth of teams, the season isn't complete yet, so add blanks
-for _ in range(FULL_BRACKET_SLOTS - len(full_playoff_picture)):
-    full_playoff_picture.append({"name": ""})
-
-# Now see if anyone has a clinched a playoff berth
-simulated_berth = deepcopy(divisional_standings)
-
-# Loop over the divisions in the berth simulation
-for sim_division_data in simulated_berth.values():
-    # Set the division leader's remaining games to losses
-    leader = sim_division_data.pop(0)
-    leader_name = leader.get("name")
-    leader["losses"] += (fantasy_league.active_year_regular_season_length - regular_season_games_played)
-    leader["points_for"] = -1
-    # Set the other division teams remaining games to wins
-    for other_player in sim_division_data:
-        other_player["wins"] += (fantasy_league.active_year_regular_season_length - regular_season_games_played)
-        other_player["divisional_wins"] = 4 - other_player.get("divisional_losses")
-    # Re-insert the division leader
-    sim_division_data.append(leader)
-    # Recalculate the division's standings
-    simulated_division = sorted(sim_division_data, key=lambda team_data: (
-        team_data.get("wins"),
-        team_data.get("divisional_wins"),
-        team_data.get("points_for"),
-    ), reverse=True)
-    # See if the leader has changed
-    simulated_leader = simulated_division.pop(0)
-    simulated_leader_name = simulated_leader.get("name")
-    # If it hasn't, find them in the playoff picture and update their name to indicate a division clinch
-    if simulated_leader_name == leader_name:
-        for current_lead in full_playoff_picture[:4]:
-            if current_lead.get("name") == simulated_leader_name:
-                current_lead["clinched"] = "* (clinched division)"
-
-# Now see if anyone has a clinched a bye
-simulated_bye = deepcopy(divisional_standings)
-bye_holders = [s.get("name") for s in sorted_division_leaders[:2]]
-
-# Loop over the divisions in the bye simulation
-for sim_division_data in simulated_bye.values():
-    # If the division leader is already in a top-two spot, set the division leader's remaining games to losses
-    leader = sim_division_data.pop(0)
-    leader_name = leader.get("name")
-    if leader_name in bye_holders:
-        leader["losses"] += (fantasy_league.active_year_regular_season_length - regular_season_games_played)
-        leader["points_for"] = -1
-    # If they were not already in a top-two spot, set their remaining games to wins
-    else:
-        leader["wins"] += (fantasy_league.active_year_regular_season_length - regular_season_games_played)
-        leader["divisional_wins"] = 4 - other_player.get("divisional_losses")
-    # Set the other division teams remaining games to wins
-    for other_player in sim_division_data:
-        other_player["wins"] += (fantasy_league.active_year_regular_season_length - regular_season_games_played)
-        other_player["divisional_wins"] = 4 - other_player.get("divisional_losses")
-    # Re-insert the division leader
-    sim_division_data.append(leader)
-    # Recalculate the division's standings in place for use below
-    sim_division_data.sort(key=lambda team_data: (
-        team_data.get("wins"),
-        team_data.get("divisional_wins"),
-        team_data.get("points_for"),
-    ), reverse=True)
-
-# Get the four simulated division leaders in the bye simulation
-sim_unsorted_division_leaders = [division[0] for division in simulated_bye.values()]
-
-# Sort the division leaders per WaFFL rules
-sim_sorted_division_leaders = sorted(sim_unsorted_division_leaders,
-                                     key=lambda team_data: (
-                                         team_data.get("wins"),
-                                         team_data.get("points_for"),
-                                     ), reverse=True)
-
-# Get the two top division leaders in the simulation
-sim_bye_holders = [s.get("name") for s in sim_sorted_division_leaders[:2]]
-
-# Figure out what year it is one last time
-api_year = get_year_from_api(date.today().year)
-try:
-    api_year = get_year_from_api(date.today().year + 1)
-except ESPNInvalidLeague:
-    pass
-# So that we can figure out what week it is
-current_week = api_year.current_week
-
-# Check the current playoff picture's two top teams
-for current_lead in full_playoff_picture[:2]:
-    # If it is beyond the end of the regular season, they have clinched a bye
-    if current_week > fantasy_league.active_year_regular_season_length:
-        current_lead["clinched"] = "** (clinched bye)"
-    # If one or both of them is in the simulated bye-holders list, update their name to indicate a bye clinch
-    elif current_lead.get("name") in sim_bye_holders:
-        current_lead["clinched"] = "** (clinched bye)"
-
-# Save the regular season snapshot to a JSON file for use by the site
-snapshot_json_filename = f"{dir_path}/Playoff Snapshot.json"
-with open(snapshot_json_filename, "w") as f:
-    json.dump(full_playoff_picture, f)
+    # Work out the playoff picture, including what every team has clinched, and save it to a JSON file for the site
+    with stage_timer.stage("snapshot"):
+        full_playoff_picture = write_playoff_snapshot(fantasy_league, data_directory, processes=args.processes)
+
+    # A SQLite league is stored along with every leaderboard the site serves, so the site can start without loading
+    # (or building anything from) the league's history
+    record_book = None
+    if args.storage == "sqlite":
+        with stage_timer.stage("record book"):
+            record_book = RecordBook(fantasy_league, full_playoff_picture, "")
+
+    # Stored atomically, so the site never loads a half-written league
+    with stage_timer.stage("save league"):
+        save_league(fantasy_league, league_storage_filename, record_book)
+
+        # Now that the league knows which seasons and weeks are final, never revalidate their cached responses again
+        if http_cache is not None:
+            http_cache.freeze(response_is_final)
+
+    # Simulate the rest of the season to work out everyone's playoff odds, and save them next to the snapshot
+    with stage_timer.stage("playoff odds"):
+        write_playoff_odds(fantasy_league, data_directory, simulations=args.simulations, processes=args.processes)
+
+    requests_summary = request_stats.summary()
+    return {
+        "degraded": bool(missing_lineups or requests_summary.get("failures")),
+        "missing_lineups": [list(year_week) for year_week in missing_lineups],
+        "requests": requests_summary,
+        "seconds": round(time.time() - run_started, 3),
+        "stages": stage_timer.summary(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(run_started)),
+        "weeks_fetched": len(week_data),
+    }
+
+
+def main(argv=None, prog=None, data_directory=data_path):
+    """Runs an update of the data in a directory with the given command-line arguments (sys.argv if None)"""
+    config = configparser.ConfigParser()
+    config.read(f'{data_directory}/config.ini')
+    args = build_parser(config, prog).parse_args(argv)
+    run_summary = update_league(config, args, data_directory)
+
+    # Summarize the run as JSON, so that cron's output (or the --summary file) shows slow or degraded runs at a glance
+    print(json.dumps(run_summary))
+    if args.summary:
+        utility.write_atomically(args.summary, "w", lambda f: json.dump(run_summary, f, indent=1))
+
+
+if __name__ == "__main__":
+    main()
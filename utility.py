@@ -1,3 +1,8 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
 MANAGER_ALIASES = {
     "Joe Guidoboni": "Joe",
     "Brendan Shea": "Durgan",
@@ -11,6 +16,12 @@ REDACTED_TEAM_YEARS = {
     "Billy Heanue": [2017, 2018],
 }
 
+# The permissions open() would have given a new file. Temporary files are only readable by their owner, so they get
+# these before being renamed into place. umask can only be read by setting it, so it's read once, on import
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
 
 def clean_member_name(name: str) -> str:
     """Cleans up a manager's name str and fetches its alias, if present"""
@@ -34,3 +45,46 @@ def clean_user_id(user_id: str) -> str:
 
 def generate_team_id(espn_team_id: int, year: int) -> int:
     return hash(f"{year}-{espn_team_id}")
+
+
+def write_atomically(path, mode, write):
+    """Writes a file next to its destination and renames it into place so readers never see a partial file. Each write
+    gets its own uniquely named temporary file, so threads writing the same file at once can't collide"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.",
+                                      suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, FILE_MODE)
+        os.replace(temp_path, path)
+    except BaseException:
+        # Don't leave the temporary file behind if the write failed
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class StageTimer:
+    """Wall clock time spent in each stage of a run, in the order the stages started"""
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+
+    def add(self, name, seconds):
+        """Adds time spent in the named stage"""
+        self.seconds[name] = self.seconds.get(name, 0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        """Times the code in the with block as (more of) the named stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def summary(self):
+        """Returns the seconds spent in each stage, rounded for writing out as JSON"""
+        return {name: round(seconds, 3) for name, seconds in self.seconds.items()}
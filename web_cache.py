@@ -0,0 +1,110 @@
+from __future__ import annotations
+import glob
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from flask import Response, request
+
+# Responses smaller than this aren't worth compressing
+MINIMUM_COMPRESS_SIZE = 512
+
+
+class CachedBody:
+    """The bytes of a response, along with a gzip compressed copy if it is worth compressing"""
+
+    def __init__(self, body):
+        self.body: bytes = body
+        self.gzipped: bytes | None = gzip.compress(body) if len(body) >= MINIMUM_COMPRESS_SIZE else None
+
+
+class ResponseCache:
+    """Least recently used cache of response bodies for one version of the data
+
+    Bodies are built (and compressed) once per key, and everything is dropped as soon as a new data version is asked
+    for. Only max_entries bodies are kept, so keys that come from the URL can't grow the cache without limit"""
+
+    def __init__(self, max_entries):
+        self.entries: OrderedDict[str, CachedBody] = OrderedDict()
+        self.hits: int = 0
+        self.max_entries: int = max_entries
+        self.misses: int = 0
+        self.version: str | None = None
+        self._lock = threading.Lock()
+
+    def get(self, version, key, build_body):
+        """Returns the CachedBody for the key, calling build_body for its bytes if it isn't cached for the version"""
+        with self._lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Build outside the lock so a slow page doesn't hold up the others. Two requests may build the same page at
+        # once, which is harmless
+        entry = CachedBody(build_body())
+        if self.max_entries <= 0:
+            return entry
+        with self._lock:
+            if version == self.version:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return entry
+
+
+def accepts_gzip():
+    """Returns a boolean representing whether the client accepts gzip compressed responses"""
+    return request.accept_encodings["gzip"] > 0
+
+
+def build_version(directory):
+    """Hashes the code and templates in the directory that the site's responses are built from, so that responses
+    clients already have stop matching once a deploy changes how they are built, even if the data hasn't changed"""
+    digest = hashlib.sha256()
+    paths = glob.glob(os.path.join(directory, "*.py")) + glob.glob(os.path.join(directory, "templates", "**", "*"),
+                                                                     recursive=True)
+    for path in sorted(paths):
+        if os.path.isfile(path):
+            digest.update(os.path.relpath(path, directory).encode() + b"\0")
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def make_etag(version, key, encoding):
+    """Builds a strong ETag from the data version a response was built from, what was asked for, and its encoding"""
+    return hashlib.sha256(f"{version}\0{key}\0{encoding}".encode()).hexdigest()[:32]
+
+
+def add_cache_headers(response, etag, max_age):
+    """Lets clients and proxies cache a response for max_age seconds and then revalidate it with its ETag"""
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def conditional_response(version, key, build_body, mimetype, max_age, cache=None):
+    """Returns 304 Not Modified if the client already has the current response for the key, without building it.
+    Otherwise returns the bytes build_body makes, taken from the cache if one is given, gzip compressed if the client
+    accepts it"""
+    encoding = "gzip" if accepts_gzip() else "identity"
+    etag = make_etag(version, key, encoding)
+    if request.if_none_match.contains(etag):
+        return add_cache_headers(Response(status=304), etag, max_age)
+
+    entry = cache.get(version, key, build_body) if cache is not None else CachedBody(build_body())
+    if encoding == "gzip" and entry.gzipped is not None:
+        response = Response(entry.gzipped, mimetype=mimetype)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(entry.body, mimetype=mimetype)
+    return add_cache_headers(response, etag, max_age)
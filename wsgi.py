@@ -1,4 +1,30 @@
-from app import app
+from app import RELOAD_INTERVAL, app, league_store, preload_data
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+# The uWSGI signal the master sends a worker every RELOAD_INTERVAL seconds, to check for new data
+RELOAD_SIGNAL = 1
+
+
+def reload_if_changed(signal):
+    """Gracefully reloads uWSGI if update_league.py has written new data. The master loads it, the same as when it
+    started, and forks new workers to share it, while the old workers finish the requests they have"""
+    if league_store.has_changed():
+        uwsgi.reload()
+
+
+# uWSGI imports this in the master process, so the workers it forks share the data loaded here
+preload_data()
+
+if uwsgi is not None and RELOAD_INTERVAL > 0:
+    # Reloading in the workers would leave each of them with its own private copy of the new data, so new data is
+    # loaded by reloading the master instead
+    league_store.check_interval = 0
+    uwsgi.register_signal(RELOAD_SIGNAL, "worker", reload_if_changed)
+    uwsgi.add_timer(RELOAD_SIGNAL, max(int(RELOAD_INTERVAL), 1))
 
 if __name__ == "__main__":
     app.run()